@@ -0,0 +1,196 @@
+"""
+Incremental activity feed.
+
+New messages are read from the database as events, and their commits are
+announced on the realtime broker's ``activity`` channel. Event IDs are
+message IDs, so they only grow and double as cursors:
+
+    GET /api/activity/?since=<id>   events after a cursor, as JSON
+    GET /activity/stream/           Server-Sent Events (ASGI only)
+
+The message table is the log every worker shares, and an indexed range
+scan on its primary key answers a cursor. IDs are assigned on insert but
+become visible on commit, so a transaction can commit after a higher ID
+has been handed out. Events are therefore only served once their message
+is ``ACTIVITY_SETTLE_SECONDS`` old, by when every transaction that took a
+lower ID has committed or given up; only one held open longer than that
+can be skipped.
+
+The stream honours ``Last-Event-ID``, so a reconnecting ``EventSource``
+resumes where it left off. Broker announcements wake it to read the
+database once the new messages have settled; it also reads on every
+heartbeat in case another process's announcement never arrives. Deleted
+messages are passed on as ``message.deleted`` events, which carry no ID.
+"""
+import asyncio
+import json
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_safe
+
+from .broker import get_broker
+from .models import Message
+from .realtime import message_payload
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_CHANNEL = 'activity'
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_SECONDS = 15
+
+
+def max_events():
+    """The most events one request or replay returns"""
+    return getattr(settings, 'ACTIVITY_MAX_EVENTS', 200)
+
+
+def settle_seconds():
+    return getattr(settings, 'ACTIVITY_SETTLE_SECONDS', 1)
+
+
+def message_event(message):
+    """The activity event for a new message"""
+    payload = message_payload(message)
+    payload['room'] = {'id': message.room_id, 'name': message.room.name}
+    return {'id': message.id, 'type': 'message.created', 'message': payload}
+
+
+def deleted_event(message_id):
+    return {'type': 'message.deleted', 'message_id': message_id}
+
+
+def _settled_messages():
+    """Messages whose transactions have had time to commit in ID order"""
+    horizon = timezone.now() - timedelta(seconds=settle_seconds())
+    return Message.objects.select_related('user', 'room').filter(created__lte=horizon)
+
+
+def events_since(cursor, limit):
+    """
+    Events after ``cursor``
+
+    Returns:
+        List of at most ``limit`` events, oldest first
+    """
+    messages = _settled_messages().filter(id__gt=cursor).order_by('id')[:limit]
+    return [message_event(message) for message in messages]
+
+
+def latest_events(limit):
+    """The newest ``limit`` events, oldest first"""
+    messages = list(_settled_messages().order_by('-id')[:limit]) if limit else []
+    return [message_event(message) for message in reversed(messages)]
+
+
+def latest_id():
+    """The cursor of the newest event, or 0"""
+    return _settled_messages().order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _publish(event):
+    try:
+        get_broker().publish(ACTIVITY_CHANNEL, event)
+    except Exception as e:
+        logger.error(f"Failed to publish activity event: {e}")
+
+
+def record_message(message):
+    """Announce a committed message to the feed; never raises"""
+    try:
+        event = message_event(message)
+    except Exception as e:
+        logger.error(f"Failed to record activity for message {message.pk}: {e}")
+        return
+    _publish(event)
+
+
+def record_deletion(message_id):
+    _publish(deleted_event(message_id))
+
+
+def format_event(event):
+    """Encode an event as a Server-Sent Events frame"""
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    if 'id' in event:
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+def _cursor(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+async def _stream(cursor):
+    loop = asyncio.get_running_loop()
+    # Subscribe before reading so nothing committed in between is missed
+    subscription = await get_broker().subscribe(ACTIVITY_CHANNEL)
+    try:
+        yield 'retry: 5000\n: connected\n\n'
+        if cursor is None:
+            cursor = await sync_to_async(latest_id)()
+        # When to next read the database, and when the newest announced
+        # message will have settled
+        read_at = loop.time()
+        settled_at = None
+        while True:
+            if read_at is not None and loop.time() >= read_at:
+                events = await sync_to_async(events_since)(cursor, max_events())
+                for event in events:
+                    cursor = event['id']
+                    yield format_event(event)
+                if len(events) == max_events():
+                    read_at = loop.time()
+                elif settled_at is not None and settled_at > loop.time():
+                    read_at = settled_at
+                else:
+                    read_at = settled_at = None
+                continue
+            timeout = HEARTBEAT_SECONDS if read_at is None else read_at - loop.time()
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout)
+            except asyncio.TimeoutError:
+                if read_at is None:
+                    yield ': keep-alive\n\n'
+                    read_at = loop.time()
+                continue
+            if event['type'] == 'message.created':
+                settled_at = loop.time() + settle_seconds()
+                if read_at is None:
+                    read_at = settled_at
+            else:
+                yield format_event(event)
+    finally:
+        await subscription.close()
+
+
+@require_safe
+async def activity_stream(request):
+    """
+    Stream new activity as Server-Sent Events
+
+    Query parameters:
+        since: Resume after this event ID when there's no Last-Event-ID
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would pin a worker thread indefinitely
+        return HttpResponse(
+            'The activity stream needs an ASGI server; poll /api/activity/ instead.',
+            status=501, content_type='text/plain'
+        )
+    cursor = _cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    response = StreamingHttpResponse(_stream(cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
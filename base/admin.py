@@ -32,29 +32,24 @@ class TopicAdmin(admin.ModelAdmin):
     list_display = ['name', 'room_count', 'created']
     search_fields = ['name']
     ordering = ['name']
-    readonly_fields = ['created']
-    
-    def room_count(self, obj):
-        return obj.rooms.count()
-    room_count.short_description = 'Number of Rooms'
-
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('rooms')
+    readonly_fields = ['room_count', 'created']
 
 
 class MessageInline(admin.TabularInline):
     model = Message
     extra = 0
+    # A select widget per inline row would query every user once per row
+    raw_id_fields = ['user']
     readonly_fields = ['created', 'updated']
     fields = ['user', 'body', 'image', 'document', 'created']
 
 
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
-    list_display = ['name', 'host', 'topic', 'participant_count', 'message_count', 'created']
+    list_display = ['name', 'host', 'topic', 'participant_count', 'message_count', 'last_message_at', 'created']
     list_filter = ['topic', 'created', 'updated']
     search_fields = ['name', 'description', 'host__username', 'host__email']
-    readonly_fields = ['created', 'updated', 'participant_count', 'message_count']
+    readonly_fields = ['created', 'updated', 'participant_count', 'message_count', 'last_message_at']
     filter_horizontal = ['participants']
     inlines = [MessageInline]
     
@@ -71,21 +66,13 @@ class RoomAdmin(admin.ModelAdmin):
             'classes': ['collapse']
         }),
         ('Statistics', {
-            'fields': ['participant_count', 'message_count', 'created', 'updated'],
+            'fields': ['participant_count', 'message_count', 'last_message_at', 'created', 'updated'],
             'classes': ['collapse']
         })
     ]
     
-    def participant_count(self, obj):
-        return obj.participants.count()
-    participant_count.short_description = 'Participants'
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Messages'
-
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('host', 'topic').prefetch_related('participants')
+        return super().get_queryset(request).select_related('host', 'topic')
 
 
 class AttachmentInline(admin.TabularInline):
@@ -0,0 +1,316 @@
+"""
+Native async variants of the main REST endpoints.
+
+Mounted under ``/api/async/`` beside the DRF views in ``base.api.views``
+and returning the same JSON. Under ASGI they run on the event loop and
+reach the database through Django's async ORM (``aget``, ``acount``, async
+iteration), so a request holds a thread only while one of its queries runs
+rather than for its whole lifetime. Writes go through the same signal
+handlers as the sync views, in one thread hop per request. Under WSGI they
+still work but gain nothing.
+
+DRF has no async support, so these are plain Django views. Only session
+authentication applies, responses are always JSON, and
+``CsrfViewMiddleware`` checks unsafe requests.
+
+``manage.py benchmark_async_api`` compares them with the sync views.
+"""
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import HttpResponse
+from django.views.decorators.http import require_POST, require_safe
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from base import membership, search
+from base.db_routers import replica_reads
+from base.models import Message, Room, Topic, User
+from base.pagination import apaginate_keyset, decode_cursor
+from base.query_budget import query_budget
+from . import conditional
+from .renderers import FastJSONRenderer
+from .serializers import (
+    MessageSerializer, MessageValuesSerializer, RoomDetailSerializer, RoomListSerializer,
+    RoomListValuesSerializer, TopicSerializer, UserSerializer, UserValuesSerializer
+)
+from .values import fast_serialization
+from .views import MessageCursorPagination, StandardResultsSetPagination, room_detail_query
+
+_renderer = FastJSONRenderer()
+
+
+def _json(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type='application/json')
+
+
+def _page_size(request, default, maximum):
+    """``page_size`` like DRF's PageNumberPagination reads it"""
+    try:
+        size = int(request.GET['page_size'])
+    except (KeyError, ValueError):
+        return default
+    return min(size, maximum) if size > 0 else default
+
+
+async def _paginate(queryset, request):
+    """
+    Page-number pagination matching ``StandardResultsSetPagination``
+
+    Returns:
+        Tuple of (rows, envelope without ``results``), or None for a page
+        that doesn't exist
+    """
+    size = _page_size(
+        request, StandardResultsSetPagination.page_size, StandardResultsSetPagination.max_page_size
+    )
+    count = await queryset.acount()
+    pages = max(1, math.ceil(count / size))
+    number = request.GET.get('page', 1)
+    try:
+        number = pages if number == 'last' else int(number)
+    except ValueError:
+        return None
+    if number < 1 or number > pages:
+        return None
+
+    rows = [row async for row in queryset[(number - 1) * size:number * size]]
+    url = request.build_absolute_uri()
+    if number == 1:
+        previous = None
+    elif number == 2:
+        previous = remove_query_param(url, 'page')
+    else:
+        previous = replace_query_param(url, 'page', number - 1)
+    return rows, {
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if number < pages else None,
+        'previous': previous,
+    }
+
+
+def _invalid_page():
+    return _json({'detail': 'Invalid page.'}, status=404)
+
+
+@query_budget(6)
+@replica_reads
+@require_safe
+@conditional.async_condition(
+    etag_func=conditional.collection_etag(*conditional.ROOM_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.ROOM_LIST_GROUPS)
+)
+async def getRooms(request):
+    """Get all rooms with optional search and pagination"""
+    search_query = request.GET.get('q', '')
+    fast = fast_serialization()
+
+    rooms_queryset = Room.objects.all() if fast else Room.objects.select_related('host', 'topic')
+    if search_query:
+        ids = await sync_to_async(search.search_ids)(search.ROOM, search_query)
+        rooms_queryset = search.order_by_ids(rooms_queryset, ids)
+    else:
+        rooms_queryset = rooms_queryset.order_by('-updated')
+    if fast:
+        rooms_queryset = RoomListValuesSerializer.select(rooms_queryset)
+
+    page = await _paginate(rooms_queryset, request)
+    if page is None:
+        return _invalid_page()
+    rooms, envelope = page
+    if fast:
+        envelope['results'] = await RoomListValuesSerializer(rooms).adata()
+    else:
+        envelope['results'] = RoomListSerializer(rooms, many=True).data
+    response = _json(envelope)
+    if search_query:
+        response['X-Search-Limit'] = search.MAX_RESULTS
+    return response
+
+
+@query_budget(9)
+@replica_reads
+@require_safe
+@conditional.async_condition(etag_func=conditional.room_etag, last_modified_func=conditional.room_last_modified)
+async def getRoom(request, pk):
+    """Get a room; takes the same query parameters as the sync view"""
+    queryset, fields, expand = room_detail_query(request)
+    try:
+        room = await queryset.aget(id=pk)
+    except (Room.DoesNotExist, ValueError):
+        return _json({'error': 'Room not found'}, status=404)
+
+    serializer = RoomDetailSerializer(room, fields=fields, expand=expand, context={'request': request})
+    return _json(serializer.data)
+
+
+@query_budget(5)
+@replica_reads
+@require_safe
+@conditional.async_condition(
+    etag_func=conditional.collection_etag(*conditional.TOPIC_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.TOPIC_LIST_GROUPS)
+)
+async def getTopics(request):
+    """Get all topics with room counts"""
+    search_query = request.GET.get('q', '')
+
+    topics_queryset = Topic.objects.all()
+    if search_query:
+        ids = await sync_to_async(search.search_ids)(search.TOPIC, search_query)
+        topics_queryset = topics_queryset.filter(pk__in=ids)
+    topics_queryset = topics_queryset.order_by('-room_count', 'name')
+
+    topics = [topic async for topic in topics_queryset]
+    return _json(TopicSerializer(topics, many=True).data)
+
+
+def _cursor_link(request, param, cursor):
+    if cursor is None:
+        return None
+    url = request.build_absolute_uri()
+    url = remove_query_param(url, 'before')
+    url = remove_query_param(url, 'after')
+    return replace_query_param(url, param, cursor)
+
+
+@query_budget(8)
+@replica_reads
+@require_safe
+@conditional.async_condition(
+    etag_func=conditional.collection_etag(*conditional.MESSAGE_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.MESSAGE_LIST_GROUPS)
+)
+async def getMessages(request):
+    """Get recent messages with optional filtering and full-text search"""
+    room_id = request.GET.get('room')
+    search_query = request.GET.get('q', '')
+    fast = fast_serialization()
+
+    if fast:
+        messages_queryset = MessageValuesSerializer.select(Message.objects.all())
+    else:
+        messages_queryset = Message.objects.select_related('user').prefetch_related('attachments')
+    if room_id:
+        try:
+            room_id = int(room_id)
+        except ValueError:
+            return _json({'room': 'A valid integer is required.'}, status=400)
+        messages_queryset = messages_queryset.filter(room_id=room_id)
+
+    if search_query:
+        # Ranked results are paged by number; the result set is bounded by the
+        # index limit, which applies within the room
+        ids = await sync_to_async(search.search_ids)(search.MESSAGE, search_query, room_id=room_id or None)
+        page = await _paginate(search.order_by_ids(messages_queryset, ids), request)
+        if page is None:
+            return _invalid_page()
+        messages, envelope = page
+    else:
+        # Keyset pagination (newest first)
+        try:
+            before = request.GET.get('before')
+            after = request.GET.get('after')
+            keyset_page = await apaginate_keyset(
+                messages_queryset,
+                before=decode_cursor(before) if before else None,
+                after=decode_cursor(after) if after else None,
+                limit=_page_size(request, MessageCursorPagination.page_size, MessageCursorPagination.max_page_size)
+            )
+        except ValueError as e:
+            return _json({'cursor': str(e)}, status=400)
+        messages = list(reversed(keyset_page.items))
+        envelope = {
+            'next': _cursor_link(request, 'before', keyset_page.older_cursor),
+            'previous': _cursor_link(request, 'after', keyset_page.newer_cursor),
+        }
+
+    if fast:
+        envelope['results'] = await MessageValuesSerializer(messages).adata()
+    else:
+        envelope['results'] = MessageSerializer(messages, many=True).data
+    response = _json(envelope)
+    if search_query:
+        response['X-Search-Limit'] = search.MAX_RESULTS
+    return response
+
+
+@query_budget(6)
+@replica_reads
+@require_safe
+async def getUsers(request):
+    """Get all users"""
+    search_query = request.GET.get('q', '')
+
+    users_queryset = User.objects.all()
+    if search_query:
+        users_queryset = users_queryset.filter(
+            Q(username__icontains=search_query) |
+            Q(name__icontains=search_query) |
+            Q(email__icontains=search_query)
+        )
+    users_queryset = users_queryset.order_by('-date_joined')
+    fast = fast_serialization()
+    if fast:
+        users_queryset = UserValuesSerializer.select(users_queryset)
+
+    page = await _paginate(users_queryset, request)
+    if page is None:
+        return _invalid_page()
+    users, envelope = page
+    if fast:
+        envelope['results'] = await UserValuesSerializer(users).adata()
+    else:
+        envelope['results'] = UserSerializer(users, many=True).data
+    return _json(envelope)
+
+
+@query_budget(5)
+@replica_reads
+@require_safe
+async def getUser(request, pk):
+    """Get a specific user"""
+    try:
+        user = await User.objects.aget(id=pk)
+    except (User.DoesNotExist, ValueError):
+        return _json({'error': 'User not found'}, status=404)
+    return _json(UserSerializer(user).data)
+
+
+def _request_data(request):
+    """The body as DRF's default parsers would give it"""
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    data = request.POST.copy()
+    data.update(request.FILES)
+    return data
+
+
+def _create_message(serializer, user, room):
+    message = serializer.save(user=user, room=room)
+    membership.join(room, user)
+    return MessageSerializer(message).data
+
+
+@query_budget(18)
+@require_POST
+async def createMessage(request, room_pk):
+    """Create a new message in a room"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return _json({'detail': 'Authentication credentials were not provided.'}, status=403)
+    try:
+        room = await Room.objects.aget(id=room_pk)
+    except (Room.DoesNotExist, ValueError):
+        return _json({'error': 'Room not found'}, status=404)
+
+    try:
+        data = _request_data(request)
+    except ValueError as e:
+        return _json({'detail': f"JSON parse error - {e}"}, status=400)
+    serializer = MessageSerializer(data=data)
+    if not serializer.is_valid():
+        return _json(serializer.errors, status=400)
+    # Saving runs the sync signal handlers (counters, search, realtime)
+    return _json(await sync_to_async(_create_message)(serializer, user, room), status=201)
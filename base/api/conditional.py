@@ -0,0 +1,177 @@
+"""
+Conditional GET for the REST API.
+
+Validators are derived from the fragment cache's group versions
+(``base.fragments``) and, for a single room, one narrow row lookup, so
+neither the main queries nor the serializers run to compute them. The
+views wrap these in ``django.views.decorators.http.condition``, which
+answers ``If-None-Match`` / ``If-Modified-Since`` with 304 before the view
+body runs; async views use ``async_condition``.
+
+A version bump is only seen by every worker if the cache is shared
+between them (``base.caches``). Otherwise the validator functions return
+None, so responses carry no validators and are never answered with 304.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from base import caches, fragments
+from base.models import Room
+
+# Groups each collection endpoint renders data from
+ROOM_LIST_GROUPS = (fragments.ROOMS, fragments.TOPICS, fragments.MESSAGES, fragments.USERS)
+TOPIC_LIST_GROUPS = (fragments.TOPICS,)
+MESSAGE_LIST_GROUPS = (fragments.MESSAGES, fragments.USERS)
+
+
+def _request_key(request):
+    """
+    Everything besides the data that changes a response body: the query
+    string, the negotiated format and the host absolute URLs are built with
+    """
+    return '|'.join((
+        request.path,
+        '&'.join(sorted(request.GET.urlencode().split('&'))),
+        request.headers.get('Accept', ''),
+        request.get_host(),
+    ))
+
+
+def _etag(request, *parts):
+    digest = hashlib.sha1(_request_key(request).encode('utf-8'))
+    for part in parts:
+        digest.update(f"|{part}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _versions(groups):
+    versions = fragments.get_versions(groups)
+    return ','.join(f"{group}:{versions[group]}" for group in sorted(versions))
+
+
+def _from_timestamp(timestamp):
+    return None if timestamp is None else datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def collection_etag(*groups):
+    """
+    Build an ``etag_func`` for an endpoint rendering data from ``groups``
+
+    Returns:
+        Function of the request returning the ETag; costs one cache read
+    """
+    def etag(request, *args, **kwargs):
+        if not caches.is_shared():
+            return None
+        return _etag(request, _versions(groups))
+    return etag
+
+
+def collection_last_modified(*groups):
+    """
+    Build a ``last_modified_func`` for an endpoint rendering ``groups``
+
+    Returns:
+        Function of the request returning when any group last changed, or
+        None (no Last-Modified) if that's unknown
+    """
+    def last_modified(request, *args, **kwargs):
+        if not caches.is_shared():
+            return None
+        return _from_timestamp(fragments.last_modified(groups))
+    return last_modified
+
+
+def _room_groups(request):
+    # Both embeds are included unless ?expand= says otherwise
+    expand = request.GET.get('expand', 'participants,messages')
+    groups = [fragments.TOPICS, fragments.USERS]
+    if 'participants' in expand:
+        # Membership changes bump ROOMS without touching the room row
+        groups.append(fragments.ROOMS)
+    if 'messages' in expand:
+        groups.append(fragments.MESSAGES)
+    return groups
+
+
+def _room_state(request, pk):
+    """The room's validator columns, cached on the request for both functions"""
+    cache = request.__dict__.setdefault('_room_state', {})
+    if pk not in cache:
+        try:
+            cache[pk] = Room.objects.filter(pk=pk).values(
+                'updated', 'last_message_at', 'message_count', 'participant_count'
+            ).first()
+        except ValueError:
+            cache[pk] = None
+    return cache[pk]
+
+
+def room_etag(request, pk):
+    """ETag of ``/api/rooms/<pk>/``; None for a missing room so the view 404s"""
+    if not caches.is_shared():
+        return None
+    state = _room_state(request, pk)
+    if state is None:
+        return None
+    return _etag(
+        request,
+        state['updated'].isoformat(),
+        state['last_message_at'].isoformat() if state['last_message_at'] else '',
+        state['message_count'],
+        state['participant_count'],
+        _versions(_room_groups(request)),
+    )
+
+
+def room_last_modified(request, pk):
+    if not caches.is_shared():
+        return None
+    state = _room_state(request, pk)
+    if state is None:
+        return None
+    group_modified = fragments.last_modified(_room_groups(request))
+    if group_modified is None:
+        # A related change may have gone unrecorded; don't claim a date
+        return None
+    return max(
+        dt for dt in (state['updated'], state['last_message_at'], _from_timestamp(group_modified)) if dt
+    )
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    ``condition`` for async views
+
+    Django's decorator calls the validator functions on the event loop,
+    where the room validators can't query the database, so they run in a
+    thread here. Behaviour is otherwise the same.
+    """
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs) if etag_func else None
+        modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+        return (
+            quote_etag(etag) if etag is not None else None,
+            int(modified.timestamp()) if modified else None,
+        )
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
@@ -1,17 +1,68 @@
 from rest_framework import serializers
-from base.models import Room, Topic, Message, User, Attachment
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from base.models import Room, Topic, Message, User, Attachment, Upload, FeedEntry
+from .values import (
+    ValuesSerializer, Column, Derived, Nested, Related, datetime_value, file_url, renditions_value
+)
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """Resized image URLs keyed by size and format"""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for size, paths in (value or {}).items():
+            urls[size] = {}
+            for fmt, path in paths.items():
+                url = default_storage.url(path)
+                urls[size][fmt] = request.build_absolute_uri(url) if request else url
+        return urls
 
 
 class UserSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = User
-        fields = ['id', 'username', 'name', 'email', 'bio', 'avatar', 'date_joined']
+        fields = ['id', 'username', 'name', 'email', 'bio', 'avatar', 'renditions', 'date_joined']
         read_only_fields = ['id', 'date_joined']
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Compact user representation for embedding in other resources"""
+    renditions = RenditionsField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'name', 'avatar', 'renditions']
+        read_only_fields = fields
+
+
+class DynamicFieldsMixin:
+    """
+    Let callers choose the fields a serializer returns
+
+    Args:
+        fields: Optional iterable of field names to keep (sparse fieldset)
+        expand: Optional iterable naming which of ``expandable_fields`` to
+            include; expandable fields are omitted unless requested
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = set(fields or ())
+        expand = set(expand or ())
+        for name in list(self.fields):
+            if name in self.expandable_fields and name not in expand:
+                self.fields.pop(name)
+            elif fields and name not in fields and name not in expand:
+                self.fields.pop(name)
+
+
 class TopicSerializer(serializers.ModelSerializer):
-    room_count = serializers.IntegerField(read_only=True)
-    
     class Meta:
         model = Topic
         fields = ['id', 'name', 'created', 'room_count']
@@ -19,9 +70,11 @@ class TopicSerializer(serializers.ModelSerializer):
 
 
 class AttachmentSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
     class Meta:
         model = Attachment
-        fields = ['id', 'file', 'file_type', 'file_name', 'file_size', 'uploaded_at']
+        fields = ['id', 'file', 'renditions', 'file_type', 'file_name', 'file_size', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at']
 
 
@@ -29,11 +82,12 @@ class MessageSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     attachments = AttachmentSerializer(many=True, read_only=True)
     has_attachments = serializers.BooleanField(read_only=True)
+    renditions = RenditionsField()
     
     class Meta:
         model = Message
         fields = [
-            'id', 'user', 'body', 'image', 'document', 
+            'id', 'user', 'body', 'image', 'renditions', 'document', 
             'attachments', 'has_attachments', 'created', 'updated'
         ]
         read_only_fields = ['id', 'created', 'updated']
@@ -45,26 +99,179 @@ class RoomSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     participant_count = serializers.IntegerField(read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
+    renditions = RenditionsField()
     
     class Meta:
         model = Room
         fields = [
-            'id', 'host', 'topic', 'name', 'description', 'room_image',
-            'participants', 'participant_count', 'messages', 'created', 'updated'
+            'id', 'host', 'topic', 'name', 'description', 'room_image', 'renditions',
+            'participants', 'participant_count', 'message_count', 'last_message_at',
+            'messages', 'created', 'updated'
         ]
         read_only_fields = ['id', 'created', 'updated']
 
 
+class RoomDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Room detail without unbounded nesting
+
+    ``participants`` and ``messages`` are only embedded when expanded (the
+    views expand both unless told otherwise), and then only the
+    first/latest few (prefetched by the view into ``embedded_participants``
+    and ``embedded_messages``); the ``*_url`` links page through the rest.
+    """
+    host = UserSummarySerializer(read_only=True)
+    topic = TopicSerializer(read_only=True)
+    renditions = RenditionsField()
+    participants = UserSummarySerializer(many=True, read_only=True, source='embedded_participants')
+    messages = MessageSerializer(many=True, read_only=True, source='embedded_messages')
+    participants_url = serializers.SerializerMethodField()
+    messages_url = serializers.SerializerMethodField()
+
+    expandable_fields = ('participants', 'messages')
+
+    class Meta:
+        model = Room
+        fields = [
+            'id', 'host', 'topic', 'name', 'description', 'room_image', 'renditions',
+            'participant_count', 'message_count', 'last_message_at',
+            'participants', 'participants_url', 'messages', 'messages_url',
+            'created', 'updated'
+        ]
+        read_only_fields = fields
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_participants_url(self, room):
+        return self._absolute(reverse('api-room-participants', args=[room.pk]))
+
+    def get_messages_url(self, room):
+        return self._absolute(f"{reverse('api-messages')}?room={room.pk}")
+
+
 class RoomListSerializer(serializers.ModelSerializer):
     """Simplified serializer for room listings"""
     host = serializers.StringRelatedField()
     topic = serializers.StringRelatedField()
-    participant_count = serializers.IntegerField(read_only=True)
+    renditions = RenditionsField()
     
     class Meta:
         model = Room
         fields = [
-            'id', 'host', 'topic', 'name', 'description', 'room_image',
-            'participant_count', 'created', 'updated'
+            'id', 'host', 'topic', 'name', 'description', 'room_image', 'renditions',
+            'participant_count', 'message_count', 'last_message_at', 'created', 'updated'
+        ]
+        read_only_fields = ['id', 'created', 'updated']
+
+
+class TimelineMessageSerializer(serializers.ModelSerializer):
+    """The latest message of a timeline entry"""
+    user = UserSummarySerializer(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'user', 'body', 'created']
+        read_only_fields = fields
+
+
+class FeedEntrySerializer(serializers.ModelSerializer):
+    """A room on the user's timeline with its latest message"""
+    room = RoomListSerializer(read_only=True)
+    message = TimelineMessageSerializer(read_only=True)
+
+    class Meta:
+        model = FeedEntry
+        fields = ['room', 'message', 'activity_at']
+        read_only_fields = fields
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """State of a chunked attachment upload"""
+    url = serializers.HyperlinkedIdentityField(view_name='api-upload')
+    attachment = AttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'url', 'message', 'file_name', 'file_type', 'size', 'offset',
+            'checksum', 'attachment', 'created', 'updated'
         ]
-        read_only_fields = ['id', 'created', 'updated']
\ No newline at end of file
+        read_only_fields = fields
+
+
+# Read-only fast paths for list endpoints (see base.api.values). Each mirrors
+# the ModelSerializer above it field for field.
+
+def _file(model, field_name):
+    return Column(convert=file_url(model._meta.get_field(field_name).storage))
+
+
+class UserValuesSerializer(ValuesSerializer):
+    """Same output as ``UserSerializer``"""
+    model = User
+    fields = {
+        'id': Column(),
+        'username': Column(),
+        'name': Column(),
+        'email': Column(),
+        'bio': Column(),
+        'avatar': _file(User, 'avatar'),
+        'renditions': Column(convert=renditions_value),
+        'date_joined': Column(convert=datetime_value),
+    }
+
+
+class AttachmentValuesSerializer(ValuesSerializer):
+    """Same output as ``AttachmentSerializer``"""
+    model = Attachment
+    fields = {
+        'id': Column(),
+        'file': _file(Attachment, 'file'),
+        'renditions': Column(convert=renditions_value),
+        'file_type': Column(),
+        'file_name': Column(),
+        'file_size': Column(),
+        'uploaded_at': Column(convert=datetime_value),
+    }
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    """Same output as ``MessageSerializer``"""
+    model = Message
+    fields = {
+        'id': Column(),
+        'user': Nested(UserValuesSerializer),
+        'body': Column(),
+        'image': _file(Message, 'image'),
+        'renditions': Column(convert=renditions_value),
+        'document': _file(Message, 'document'),
+        'attachments': Related(AttachmentValuesSerializer, foreign_key='message_id'),
+        'has_attachments': Derived(('image', 'document'), lambda image, document: bool(image or document)),
+        'created': Column(convert=datetime_value),
+        'updated': Column(convert=datetime_value),
+    }
+
+
+class RoomListValuesSerializer(ValuesSerializer):
+    """Same output as ``RoomListSerializer``"""
+    model = Room
+    fields = {
+        'id': Column(),
+        # User.__str__
+        'host': Derived(
+            ('host__email', 'host__username'),
+            lambda email, username: (email or username) if username is not None else None
+        ),
+        'topic': Column('topic__name'),
+        'name': Column(),
+        'description': Column(),
+        'room_image': _file(Room, 'room_image'),
+        'renditions': Column(convert=renditions_value),
+        'participant_count': Column(),
+        'message_count': Column(),
+        'last_message_at': Column(convert=datetime_value),
+        'created': Column(convert=datetime_value),
+        'updated': Column(convert=datetime_value),
+    }
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     # API overview
@@ -8,16 +8,43 @@ urlpatterns = [
     # Rooms
     path('rooms/', views.getRooms, name='api-rooms'),
     path('rooms/<str:pk>/', views.getRoom, name='api-room'),
+    path('rooms/<str:pk>/participants/', views.roomParticipants, name='api-room-participants'),
     path('rooms/create/', views.createRoom, name='api-create-room'),
     
     # Topics
     path('topics/', views.getTopics, name='api-topics'),
+    path('topics/suggest/', views.suggestTopics, name='api-topic-suggestions'),
     
     # Messages
     path('messages/', views.getMessages, name='api-messages'),
     path('rooms/<str:room_pk>/messages/create/', views.createMessage, name='api-create-message'),
+
+    # Activity feed
+    path('activity/', views.getActivity, name='api-activity'),
+
+    # Trending rooms and topics
+    path('trending/', views.getTrending, name='api-trending'),
+
+    # The signed-in user's timeline
+    path('feed/', views.getFeed, name='api-feed'),
     
+    # Chunked attachment uploads
+    path('uploads/', views.createUploads, name='api-uploads'),
+    path('uploads/<uuid:pk>/', views.upload, name='api-upload'),
+
     # Users
     path('users/', views.getUsers, name='api-users'),
     path('users/<str:pk>/', views.getUser, name='api-user'),
+
+    # Native async variants (see base.api.async_views)
+    path('async/rooms/', async_views.getRooms, name='api-async-rooms'),
+    path('async/rooms/<str:pk>/', async_views.getRoom, name='api-async-room'),
+    path(
+        'async/rooms/<str:room_pk>/messages/create/', async_views.createMessage,
+        name='api-async-create-message'
+    ),
+    path('async/topics/', async_views.getTopics, name='api-async-topics'),
+    path('async/messages/', async_views.getMessages, name='api-async-messages'),
+    path('async/users/', async_views.getUsers, name='api-async-users'),
+    path('async/users/<str:pk>/', async_views.getUser, name='api-async-user'),
 ]
\ No newline at end of file
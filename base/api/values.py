@@ -0,0 +1,251 @@
+"""
+Read-only list serialization straight from ``.values()`` rows.
+
+A ``ValuesSerializer`` declares its output once, as a mapping of output key
+to field spec. The first time it's used the specs are compiled into a
+column list for ``QuerySet.values()`` and a flat list of per-key extractor
+functions, so serializing a row is one dict comprehension: no model
+instances, no DRF field dispatch and no ``to_representation`` chain.
+
+The output matches the equivalent ``ModelSerializer`` without a request in
+its context (relative file URLs, ISO 8601 datetimes), so views can switch
+between the two with ``API_VALUES_SERIALIZERS``.
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+
+def fast_serialization():
+    """Whether list endpoints should use ``ValuesSerializer`` subclasses"""
+    return getattr(settings, 'API_VALUES_SERIALIZERS', True)
+
+
+def datetime_value(value):
+    """Same output as DRF's DateTimeField with the default ISO 8601 format"""
+    if value is None:
+        return None
+    text = timezone.localtime(value).isoformat()
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+def renditions_value(value):
+    """Same output as ``RenditionsField`` without a request"""
+    return {
+        size: {fmt: default_storage.url(path) for fmt, path in paths.items()}
+        for size, paths in (value or {}).items()
+    }
+
+
+def file_url(storage):
+    """Converter from a stored file name to its URL, like DRF's FileField"""
+    def convert(name):
+        return storage.url(name) if name else None
+    return convert
+
+
+class Column:
+    """
+    An output key read from one column
+
+    Args:
+        source: Column name, relative to the serializer's model (defaults to
+            the output key)
+        convert: Optional function applied to the column value
+    """
+
+    def __init__(self, source=None, convert=None):
+        self.source = source
+        self.convert = convert
+
+    def columns(self, name, prefix):
+        return [prefix + (self.source or name)]
+
+    def compile(self, name, prefix):
+        column = prefix + (self.source or name)
+        convert = self.convert
+        if convert is None:
+            return lambda row: row[column]
+        return lambda row: convert(row[column])
+
+
+class Derived:
+    """
+    An output key computed from several columns
+
+    Args:
+        sources: Column names passed to ``function`` in order
+        function: Function of the column values returning the output value
+    """
+
+    def __init__(self, sources, function):
+        self.sources = tuple(sources)
+        self.function = function
+
+    def columns(self, name, prefix):
+        return [prefix + source for source in self.sources]
+
+    def compile(self, name, prefix):
+        columns = [prefix + source for source in self.sources]
+        function = self.function
+        return lambda row: function(*[row[column] for column in columns])
+
+
+class Nested:
+    """
+    A to-one relation rendered with another ``ValuesSerializer``, joined
+    into the same query
+
+    Args:
+        serializer: ValuesSerializer subclass for the related model; its
+            fields must include ``id``
+        source: Relation name (defaults to the output key)
+    """
+
+    def __init__(self, serializer, source=None):
+        self.serializer = serializer
+        self.source = source
+
+    def _prefix(self, name, prefix):
+        return f"{prefix}{self.source or name}__"
+
+    def columns(self, name, prefix):
+        return self.serializer.columns(self._prefix(name, prefix))
+
+    def compile(self, name, prefix):
+        nested_prefix = self._prefix(name, prefix)
+        extract = self.serializer.extractor(nested_prefix)
+        pk_column = nested_prefix + 'id'
+        return lambda row: None if row[pk_column] is None else extract(row)
+
+
+class Related:
+    """
+    A to-many relation rendered with another ``ValuesSerializer``, loaded
+    for the whole page in one extra query
+
+    Args:
+        serializer: ValuesSerializer subclass for the related model
+        foreign_key: Column on the related model pointing back at this one
+    """
+
+    def __init__(self, serializer, foreign_key):
+        self.serializer = serializer
+        self.foreign_key = foreign_key
+
+    def columns(self, name, prefix):
+        return []
+
+    def compile(self, name, prefix):
+        # Holds the key's place; ValuesSerializer.data fills it in
+        return lambda row: None
+
+    def load(self, pks):
+        """Map each of ``pks`` to its serialized related rows"""
+        related = {pk: [] for pk in pks}
+        if not related:
+            return related
+        extract = self.serializer.extractor()
+        queryset = self.serializer.model.objects.filter(**{f"{self.foreign_key}__in": list(related)})
+        for row in queryset.values(self.foreign_key, *self.serializer.columns()):
+            related[row[self.foreign_key]].append(extract(row))
+        return related
+
+    async def aload(self, pks):
+        """``load`` for async views"""
+        related = {pk: [] for pk in pks}
+        if not related:
+            return related
+        extract = self.serializer.extractor()
+        queryset = self.serializer.model.objects.filter(**{f"{self.foreign_key}__in": list(related)})
+        async for row in queryset.values(self.foreign_key, *self.serializer.columns()):
+            related[row[self.foreign_key]].append(extract(row))
+        return related
+
+
+class ValuesSerializer:
+    """
+    Serialize ``.values()`` rows of ``model`` as ``fields`` describes
+
+    Subclasses set ``model`` and ``fields``, a dict of output key to
+    ``Column``, ``Derived``, ``Nested`` or ``Related`` in output order.
+    ``Related`` fields are only loaded for the top-level serializer, which
+    must then include ``id``.
+
+    Args:
+        rows: Rows fetched with ``values(*Serializer.columns())``, usually
+            via ``Serializer.select(queryset)``
+    """
+    model = None
+    fields = {}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def columns(cls, prefix=''):
+        columns = []
+        for name, field in cls.fields.items():
+            for column in field.columns(name, prefix):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    @classmethod
+    def select(cls, queryset):
+        """Turn a queryset of ``model`` into the rows this serializer reads"""
+        return queryset.values(*cls.columns())
+
+    @classmethod
+    def extractor(cls, prefix=''):
+        """
+        Compile the serializer for rows whose columns start with ``prefix``
+
+        Returns:
+            Function of a row returning its representation, with to-many
+            relations left as None
+        """
+        compiled = cls.__dict__.get('_extractors')
+        if compiled is None:
+            compiled = {}
+            setattr(cls, '_extractors', compiled)
+        if prefix not in compiled:
+            extractors = [(name, field.compile(name, prefix)) for name, field in cls.fields.items()]
+            compiled[prefix] = lambda row: {name: extract(row) for name, extract in extractors}
+        return compiled[prefix]
+
+    def _related_fields(self):
+        return [(name, field) for name, field in self.fields.items() if isinstance(field, Related)]
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        extract = self.extractor()
+        data = [extract(row) for row in rows]
+        related_fields = self._related_fields()
+        if related_fields:
+            pks = [row['id'] for row in rows]
+            for name, field in related_fields:
+                related = field.load(pks)
+                for item, pk in zip(data, pks):
+                    item[name] = related[pk]
+        return data
+
+    async def adata(self):
+        """``data`` for async views; ``rows`` may be a list or a queryset"""
+        if isinstance(self.rows, list):
+            rows = self.rows
+        else:
+            rows = [row async for row in self.rows]
+        extract = self.extractor()
+        data = [extract(row) for row in rows]
+        related_fields = self._related_fields()
+        if related_fields:
+            pks = [row['id'] for row in rows]
+            for name, field in related_fields:
+                related = await field.aload(pks)
+                for item, pk in zip(data, pks):
+                    item[name] = related[pk]
+        return data
@@ -1,13 +1,37 @@
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Count, Q
-from base.models import Room, Topic, Message, User
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.views.decorators.http import condition
+from base.models import Room, Topic, Message, User, Upload
+from base.db_routers import replica_reads
+from base.pagination import decode_cursor, paginate_keyset
+from base.query_budget import query_budget
+from base import activity, autocomplete, membership, search, timelines, trending, uploads
+from . import conditional
 from .serializers import (
     RoomSerializer, RoomListSerializer, TopicSerializer, 
-    MessageSerializer, UserSerializer
+    MessageSerializer, UserSerializer, UploadSerializer,
+    RoomDetailSerializer, UserSummarySerializer,
+    RoomListValuesSerializer, MessageValuesSerializer, UserValuesSerializer, FeedEntrySerializer
 )
+from .values import fast_serialization
+
+# Embedded participants/messages in the room detail response
+ROOM_EMBED_LIMIT = 20
+ROOM_EMBED_MAX = 100
+ROOM_DEFAULT_EXPAND = frozenset({'participants', 'messages'})
+
+# Activity events returned when no limit is given
+ACTIVITY_LIMIT = 20
+
+# Trending rooms/topics returned when no limit is given
+TRENDING_LIMIT = 10
+TRENDING_KINDS = {'rooms': trending.ROOM, 'topics': trending.TOPIC}
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -16,6 +40,57 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination on (created, id), newest first.
+
+    ``next`` pages towards older messages via ``?before=<cursor>`` and
+    ``previous`` towards newer ones via ``?after=<cursor>``. Unlike page
+    numbers, the cost of a page does not grow with its depth.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            before = request.query_params.get('before')
+            after = request.query_params.get('after')
+            self.page = paginate_keyset(
+                queryset,
+                before=decode_cursor(before) if before else None,
+                after=decode_cursor(after) if after else None,
+                limit=self.get_page_size(request)
+            )
+        except ValueError as e:
+            raise ValidationError({'cursor': str(e)})
+        return list(reversed(self.page.items))
+
+    def _link(self, param, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'before')
+        url = remove_query_param(url, 'after')
+        return replace_query_param(url, param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link('before', self.page.older_cursor),
+            'previous': self._link('after', self.page.newer_cursor),
+            'results': data
+        })
+
+
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getRoutes(request):
@@ -23,70 +98,210 @@ def getRoutes(request):
     routes = [
         'GET /api/',
         'GET /api/rooms/',
-        'GET /api/rooms/:id/',
+        'GET /api/rooms/:id/?fields=&expand=participants,messages',
+        'GET /api/rooms/:id/participants/',
+        'POST /api/rooms/:id/participants/',
+        'DELETE /api/rooms/:id/participants/',
         'GET /api/topics/',
+        'GET /api/topics/suggest/?prefix=',
         'GET /api/messages/',
+        'GET /api/activity/?since=',
+        'GET /api/trending/?kind=rooms|topics&limit=',
+        'GET /api/feed/',
         'GET /api/users/',
         'GET /api/users/:id/',
+        'POST /api/uploads/',
+        'HEAD /api/uploads/:id/',
+        'PATCH /api/uploads/:id/',
+        'DELETE /api/uploads/:id/',
     ]
     return Response(routes)
 
 
+@query_budget(6)
+@replica_reads
+@condition(
+    etag_func=conditional.collection_etag(*conditional.ROOM_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.ROOM_LIST_GROUPS)
+)
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getRooms(request):
     """Get all rooms with optional search and pagination"""
     search_query = request.GET.get('q', '')
+    fast = fast_serialization()
     
-    rooms_queryset = Room.objects.select_related('host', 'topic').prefetch_related('participants')
+    rooms_queryset = Room.objects.all() if fast else Room.objects.select_related('host', 'topic')
     
     if search_query:
-        rooms_queryset = rooms_queryset.filter(
-            Q(topic__name__icontains=search_query) |
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-    
-    # Add participant count annotation
-    rooms_queryset = rooms_queryset.annotate(participant_count=Count('participants'))
-    rooms_queryset = rooms_queryset.order_by('-updated')
+        # Ranked full-text search; best match first
+        rooms_queryset = search.ranked(rooms_queryset, search.ROOM, search_query)
+    else:
+        rooms_queryset = rooms_queryset.order_by('-updated')
+    if fast:
+        rooms_queryset = RoomListValuesSerializer.select(rooms_queryset)
     
     # Pagination
     paginator = StandardResultsSetPagination()
     paginated_rooms = paginator.paginate_queryset(rooms_queryset, request)
     
-    serializer = RoomListSerializer(paginated_rooms, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    if fast:
+        serializer = RoomListValuesSerializer(paginated_rooms)
+    else:
+        serializer = RoomListSerializer(paginated_rooms, many=True)
+    response = paginator.get_paginated_response(serializer.data)
+    if search_query:
+        # Searches return at most this many of the best matches
+        response['X-Search-Limit'] = search.MAX_RESULTS
+    return response
+
+
+def _csv_param(request, name):
+    return {value.strip() for value in request.GET.get(name, '').split(',') if value.strip()}
+
+
+def _limit_param(request, name, default, maximum):
+    try:
+        return max(0, min(int(request.GET[name]), maximum))
+    except (KeyError, ValueError):
+        return default
+
+
+def room_detail_query(request):
+    """
+    Read the ``fields`` and ``expand`` parameters of a room detail request
 
+    Without ``expand`` both embeds are included, capped, as long as
+    ``fields`` doesn't leave them out; ``?expand=`` with no value omits them.
 
+    Returns:
+        Tuple of (queryset prefetching the embeds, fields, expand)
+    """
+    fields = _csv_param(request, 'fields')
+    if 'expand' in request.GET:
+        expand = _csv_param(request, 'expand')
+    else:
+        expand = ROOM_DEFAULT_EXPAND & fields if fields else set(ROOM_DEFAULT_EXPAND)
+
+    queryset = Room.objects.select_related('host', 'topic')
+    if 'participants' in expand:
+        limit = _limit_param(request, 'participants_limit', ROOM_EMBED_LIMIT, ROOM_EMBED_MAX)
+        queryset = queryset.prefetch_related(Prefetch(
+            'participants', queryset=User.objects.order_by('id')[:limit], to_attr='embedded_participants'
+        ))
+    if 'messages' in expand:
+        limit = _limit_param(request, 'messages_limit', ROOM_EMBED_LIMIT, ROOM_EMBED_MAX)
+        queryset = queryset.prefetch_related(Prefetch(
+            'messages',
+            queryset=Message.objects.select_related('user').prefetch_related('attachments')
+            .order_by('-created', '-id')[:limit],
+            to_attr='embedded_messages'
+        ))
+    return queryset, fields, expand
+
+
+@query_budget(9)
+@replica_reads
+@condition(etag_func=conditional.room_etag, last_modified_func=conditional.room_last_modified)
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getRoom(request, pk):
-    """Get a specific room with all details"""
+    """
+    Get a room
+
+    Query parameters:
+        fields: Comma-separated fields to return (default: all)
+        expand: Comma-separated embeds, ``participants`` and/or ``messages``
+            (default: both; empty for neither)
+        participants_limit: Participants to embed (default 20, max 100)
+        messages_limit: Latest messages to embed (default 20, max 100)
+    """
+    queryset, fields, expand = room_detail_query(request)
     try:
-        room = Room.objects.select_related('host', 'topic').prefetch_related(
-            'participants', 'messages__user'
-        ).annotate(participant_count=Count('participants')).get(id=pk)
-    except Room.DoesNotExist:
+        room = queryset.get(id=pk)
+    except (Room.DoesNotExist, ValueError):
         return Response(
             {'error': 'Room not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
     
-    serializer = RoomSerializer(room)
+    serializer = RoomDetailSerializer(room, fields=fields, expand=expand, context={'request': request})
     return Response(serializer.data)
 
 
+@query_budget(10)
+@replica_reads
+@api_view(['GET', 'POST', 'DELETE'])
+@permission_classes([permissions.IsAuthenticatedOrReadOnly])
+def roomParticipants(request, pk):
+    """
+    List a room's participants, paginated, or enroll and remove them in bulk
+
+    POST adds and DELETE removes the users in the body, {"users": [<id>, ...]}.
+    Only the room's host and staff may change participants.
+    """
+    try:
+        pk = int(pk)
+    except ValueError:
+        return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method != 'GET':
+        return _update_participants(request, pk)
+
+    if not Room.objects.filter(id=pk).exists():
+        return Response(
+            {'error': 'Room not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    participants = User.objects.filter(participated_rooms__id=pk).order_by('id')
+    paginator = StandardResultsSetPagination()
+    page = paginator.paginate_queryset(participants, request)
+    serializer = UserSummarySerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+def _update_participants(request, pk):
+    room = Room.objects.filter(id=pk).first()
+    if room is None:
+        return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
+    if room.host_id != request.user.pk and not request.user.is_staff:
+        return Response(
+            {'error': 'Only the host can change participants'}, status=status.HTTP_403_FORBIDDEN
+        )
+
+    user_ids = request.data.get('users')
+    if (
+        not isinstance(user_ids, list) or not user_ids
+        or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids)
+    ):
+        return Response({'error': 'users must be a non-empty list of user IDs'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.method == 'POST':
+        result = {'added': membership.add_members(room, user_ids)}
+    else:
+        result = {'removed': membership.remove_members(room, user_ids)}
+    room.refresh_from_db(fields=['participant_count'])
+    result['participant_count'] = room.participant_count
+    return Response(result)
+
+
+@query_budget(5)
+@replica_reads
+@condition(
+    etag_func=conditional.collection_etag(*conditional.TOPIC_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.TOPIC_LIST_GROUPS)
+)
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getTopics(request):
     """Get all topics with room counts"""
     search_query = request.GET.get('q', '')
     
-    topics_queryset = Topic.objects.annotate(room_count=Count('rooms'))
+    topics_queryset = Topic.objects.all()
     
     if search_query:
-        topics_queryset = topics_queryset.filter(name__icontains=search_query)
+        topics_queryset = topics_queryset.filter(pk__in=search.search_ids(search.TOPIC, search_query))
     
     topics_queryset = topics_queryset.order_by('-room_count', 'name')
     
@@ -94,27 +309,137 @@ def getTopics(request):
     return Response(serializer.data)
 
 
+@query_budget(3)
+@replica_reads
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def suggestTopics(request):
+    """Topics matching what has been typed so far, busiest first"""
+    limit = _limit_param(request, 'limit', autocomplete.SUGGESTION_LIMIT, autocomplete.SUGGESTION_MAX)
+    return Response(autocomplete.suggest(request.GET.get('prefix', ''), limit))
+
+
+@query_budget(8)
+@replica_reads
+@condition(
+    etag_func=conditional.collection_etag(*conditional.MESSAGE_LIST_GROUPS),
+    last_modified_func=conditional.collection_last_modified(*conditional.MESSAGE_LIST_GROUPS)
+)
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getMessages(request):
-    """Get recent messages with optional filtering"""
+    """Get recent messages with optional filtering and full-text search"""
     room_id = request.GET.get('room')
+    search_query = request.GET.get('q', '')
+    fast = fast_serialization()
     
-    messages_queryset = Message.objects.select_related('user', 'room', 'room__topic')
+    if fast:
+        messages_queryset = MessageValuesSerializer.select(Message.objects.all())
+    else:
+        messages_queryset = Message.objects.select_related('user').prefetch_related('attachments')
     
     if room_id:
+        try:
+            room_id = int(room_id)
+        except ValueError:
+            return Response({'room': 'A valid integer is required.'}, status=status.HTTP_400_BAD_REQUEST)
         messages_queryset = messages_queryset.filter(room_id=room_id)
     
-    messages_queryset = messages_queryset.order_by('-created')
-    
-    # Pagination
-    paginator = StandardResultsSetPagination()
+    if search_query:
+        # Ranked results are paged by number; the result set is bounded by the
+        # index limit, which applies within the room
+        messages_queryset = search.ranked(messages_queryset, search.MESSAGE, search_query, room_id=room_id or None)
+        paginator = StandardResultsSetPagination()
+    else:
+        # Keyset pagination (newest first)
+        paginator = MessageCursorPagination()
     paginated_messages = paginator.paginate_queryset(messages_queryset, request)
     
-    serializer = MessageSerializer(paginated_messages, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    if fast:
+        serializer = MessageValuesSerializer(paginated_messages)
+    else:
+        serializer = MessageSerializer(paginated_messages, many=True)
+    response = paginator.get_paginated_response(serializer.data)
+    if search_query:
+        response['X-Search-Limit'] = search.MAX_RESULTS
+    return response
+
+
+@query_budget(4)
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def getActivity(request):
+    """
+    Get activity events, oldest first
+
+    Messages only become events once they've settled (see base.activity),
+    so a cursor never skips one that committed late.
+
+    Query parameters:
+        since: Event ID to continue after; without it the latest events
+            are returned
+        limit: Maximum events (default 20, max ACTIVITY_MAX_EVENTS)
+    """
+    limit = _limit_param(request, 'limit', ACTIVITY_LIMIT, activity.max_events())
+    since = request.GET.get('since')
+    if since is None:
+        events = activity.latest_events(limit)
+    else:
+        try:
+            since = int(since)
+        except ValueError:
+            raise ValidationError({'since': 'Must be an event ID'})
+        events = activity.events_since(since, limit)
+    return Response({
+        'events': events,
+        'last_id': events[-1]['id'] if events else since,
+    })
+
+
+@query_budget(4)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def getFeed(request):
+    """
+    Get the rooms the user hosts or has joined, latest activity first
+
+    Read from the user's materialized timeline (see base.timelines).
+
+    Query parameters:
+        limit: Maximum rooms (default and max FEED_SIZE)
+    """
+    limit = _limit_param(request, 'limit', timelines.FEED_SIZE, timelines.FEED_SIZE)
+    entries = timelines.timeline(request.user, limit)
+    return Response(FeedEntrySerializer(entries, many=True, context={'request': request}).data)
 
 
+@query_budget(6)
+@replica_reads
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def getTrending(request):
+    """
+    Get the rooms and topics with the most recent activity
+
+    Served from memory (see base.trending); ``score`` decays by half every
+    TRENDING_HALF_LIFE_HOURS.
+
+    Query parameters:
+        kind: ``rooms`` or ``topics``; both when omitted
+        limit: Maximum per kind (default 10, max TRENDING_SIZE)
+    """
+    kind = request.GET.get('kind')
+    if kind is not None and kind not in TRENDING_KINDS:
+        raise ValidationError({'kind': f"Must be one of: {', '.join(TRENDING_KINDS)}"})
+    limit = _limit_param(request, 'limit', TRENDING_LIMIT, trending.TRENDING_SIZE)
+    return Response({
+        name: trending.top(code, limit)
+        for name, code in TRENDING_KINDS.items() if kind in (None, name)
+    })
+
+
+@query_budget(6)
+@replica_reads
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getUsers(request):
@@ -131,15 +456,23 @@ def getUsers(request):
         )
     
     users_queryset = users_queryset.order_by('-date_joined')
+    fast = fast_serialization()
+    if fast:
+        users_queryset = UserValuesSerializer.select(users_queryset)
     
     # Pagination
     paginator = StandardResultsSetPagination()
     paginated_users = paginator.paginate_queryset(users_queryset, request)
     
-    serializer = UserSerializer(paginated_users, many=True)
+    if fast:
+        serializer = UserValuesSerializer(paginated_users)
+    else:
+        serializer = UserSerializer(paginated_users, many=True)
     return paginator.get_paginated_response(serializer.data)
 
 
+@query_budget(5)
+@replica_reads
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def getUser(request, pk):
@@ -156,6 +489,7 @@ def getUser(request, pk):
     return Response(serializer.data)
 
 
+@query_budget(10)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def createRoom(request):
@@ -167,6 +501,7 @@ def createRoom(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(18)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def createMessage(request, room_pk):
@@ -182,6 +517,91 @@ def createMessage(request, room_pk):
     serializer = MessageSerializer(data=request.data)
     if serializer.is_valid():
         message = serializer.save(user=request.user, room=room)
-        room.participants.add(request.user)
+        membership.join(room, request.user)
         return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@query_budget(10)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def createUploads(request):
+    """
+    Start chunked uploads for one or more attachments of a message
+
+    Body: {"message": <id>, "files": [{"file_name": ..., "size": ..., "checksum": ...}]}
+    where checksum is an optional SHA-256 hex digest of the whole file.
+    """
+    try:
+        message = Message.objects.get(pk=request.data.get('message'))
+    except (Message.DoesNotExist, ValueError, TypeError):
+        return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    files = request.data.get('files')
+    if not isinstance(files, list) or not files or not all(isinstance(f, dict) for f in files):
+        return Response({'error': 'files must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        with transaction.atomic():
+            created = [
+                uploads.start(request.user, message, f.get('file_name'), f.get('size'), f.get('checksum'))
+                for f in files
+            ]
+    except uploads.UploadError as e:
+        return Response({'error': str(e)}, status=e.status)
+    serializer = UploadSerializer(created, many=True, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@query_budget(12)
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def upload(request, pk):
+    """
+    Inspect, continue or cancel a chunked upload
+
+    HEAD/GET report the current offset in ``Upload-Offset``. PATCH appends
+    the request body at ``Upload-Offset``, optionally verified against an
+    ``Upload-Checksum: <md5|sha1|sha256> <base64 digest>`` header; the chunk
+    that completes the file creates the attachment and returns 201.
+    """
+    upload = Upload.objects.filter(pk=pk, user=request.user).select_related('attachment').first()
+    if upload is None:
+        return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'DELETE':
+        uploads.cancel(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    response_status = status.HTTP_200_OK
+    if request.method == 'PATCH':
+        if request.content_type != 'application/offset+octet-stream':
+            return Response(
+                {'error': 'Content-Type must be application/offset+octet-stream'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            length = None
+
+        try:
+            checksum = uploads.parse_checksum(request.headers.get('Upload-Checksum'))
+            uploads.write_chunk(upload, offset, request.stream, length, checksum)
+            if upload.offset == upload.size:
+                uploads.finish(upload)
+                response_status = status.HTTP_201_CREATED
+        except uploads.UploadError as e:
+            response = Response({'error': str(e)}, status=e.status)
+            response['Upload-Offset'] = upload.offset
+            return response
+
+    response = Response(UploadSerializer(upload, context={'request': request}).data, status=response_status)
+    response['Upload-Offset'] = upload.offset
+    response['Upload-Length'] = upload.size
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.contrib.staticfiles.apps import StaticFilesConfig as BaseStaticFilesConfig
 
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+
+
+class StaticFilesConfig(BaseStaticFilesConfig):
+    # MEDIA_ROOT lives inside static/, so keep uploaded blobs and their
+    # renditions out of collectstatic
+    ignore_patterns = BaseStaticFilesConfig.ignore_patterns + ['blobs', 'renditions']
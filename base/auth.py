@@ -0,0 +1,101 @@
+"""
+Authentication without per-request queries.
+
+Sessions use ``base.sessions``, which writes through to the database and
+reads from a shared cache. ``AuthenticationMiddleware`` replaces Django's and
+looks the signed-in user up in the cache as well, so a steady-state
+authenticated request issues no auth-related queries.
+
+Cached users are keyed by ID and only served to a session whose auth hash
+matches the cached user's, exactly as ``django.contrib.auth.get_user``
+verifies it; a password change therefore still ends other sessions.
+Anything unusual (a missing hash, a rotated secret key, an unknown backend)
+falls back to Django's lookup. ``base.signals`` forgets a user whenever
+the row is saved or deleted.
+
+Forgetting only reaches other workers through a shared cache, so with a
+process-local one (``base.caches``) every request reads the session and the
+user from the database, and a deactivated or signed-out user can't stay
+signed in on another worker.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware as BaseAuthenticationMiddleware
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from . import caches
+
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+
+
+def _user_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def forget_user(user_id):
+    """
+    Drop a cached user, after any change to their row
+
+    The entry is dropped again on commit, in case a concurrent request
+    re-cached the row as it was before the change.
+    """
+    key = _user_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def get_user(request):
+    """
+    The request's user, from the cache when the session allows it
+
+    Returns:
+        A User, or AnonymousUser
+    """
+    if not caches.is_shared():
+        return auth.get_user(request)
+    session = request.session
+    try:
+        user_id = get_user_model()._meta.pk.to_python(session[auth.SESSION_KEY])
+        backend_path = session[auth.BACKEND_SESSION_KEY]
+    except (KeyError, ValidationError):
+        return auth.get_user(request)
+    session_hash = session.get(auth.HASH_SESSION_KEY)
+
+    if session_hash and backend_path in settings.AUTHENTICATION_BACKENDS:
+        user = cache.get(_user_key(user_id))
+        if user is not None and constant_time_compare(session_hash, user.get_session_auth_hash()):
+            return user
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(_user_key(user.pk), user, USER_CACHE_TIMEOUT)
+    return user
+
+
+def _cached_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+async def _acached_user(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await sync_to_async(get_user)(request)
+    return request._acached_user
+
+
+class AuthenticationMiddleware(BaseAuthenticationMiddleware):
+    """Django's AuthenticationMiddleware, resolving users through the cache"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: _cached_user(request))
+        request.auser = partial(_acached_user, request)
@@ -0,0 +1,224 @@
+"""
+Topic name autocomplete.
+
+The room form used to embed every topic in a ``<datalist>``; it now asks
+``/api/topics/suggest/?prefix=`` as the user types. Suggestions come from
+an in-memory index: a sorted list of every topic name, plus the tail of the
+name from each later word ("Machine Learning" is also filed under
+"learning"). A prefix is a contiguous range of that list, found by
+bisection, and the range is ranked by room count. Rankings of one- and
+two-letter prefixes, which span the most topics, are memoized until the
+next change.
+
+Each process builds its own index on first use. A version counter in the
+cache ties them together: ``base.signals`` applies every committed topic
+change and room move to the local index and bumps the counter, and any
+process that finds the counter moved past its own version rebuilds (one
+query) on its next lookup. Bulk writes that bypass signals call
+``invalidate``.
+"""
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Topic
+
+SUGGESTION_LIMIT = getattr(settings, 'TOPIC_SUGGESTION_LIMIT', 10)
+SUGGESTION_MAX = 50
+
+# Prefixes up to this long have their rankings memoized
+MEMO_PREFIX_LENGTH = 2
+
+VERSION_KEY = 'topic-index:version'
+
+WORD_START_RE = re.compile(r'(?<!\w)\w', re.UNICODE)
+
+_lock = threading.Lock()
+_index = None
+
+
+def fold(text):
+    """Normalize a name or prefix for matching"""
+    return ' '.join(text.split()).casefold()
+
+
+def _keys(name):
+    """Every suffix of ``name`` that starts a word"""
+    folded = fold(name)
+    return {folded[match.start():] for match in WORD_START_RE.finditer(folded)} or {folded}
+
+
+class TopicIndex:
+    """
+    Snapshot of topic names for prefix lookups
+
+    ``entries`` is a pair of parallel lists, keys and topic IDs, sorted by
+    key; ``topics`` maps each ID to ``[name, room_count]``. Changes replace
+    the pair rather than editing it, so lookups running in other threads
+    never see it half-changed.
+
+    Args:
+        rows: Iterable of ``(id, name, room_count)``
+        version: Value of the cache counter the rows were read at
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.topics = {}
+        entries = []
+        for pk, name, room_count in rows:
+            self.topics[pk] = [name, room_count]
+            entries.extend((key, pk) for key in _keys(name))
+        self._set_entries(sorted(entries))
+        self.memo = {}
+
+    def _set_entries(self, entries):
+        self.entries = ([key for key, _ in entries], [pk for _, pk in entries])
+
+    def _rank(self, pk):
+        name, room_count = self.topics[pk]
+        return -room_count, fold(name), pk
+
+    def suggest(self, prefix, limit):
+        """
+        Topics with a word starting with ``prefix``
+
+        Returns:
+            List of ``(id, name, room_count)``, most rooms first
+        """
+        prefix = fold(prefix)
+        memo = self.memo if len(prefix) <= MEMO_PREFIX_LENGTH else None
+        if memo is not None and (prefix, limit) in memo:
+            return memo[prefix, limit]
+
+        topics = self.topics
+        if prefix:
+            keys, ids = self.entries
+            start = bisect_left(keys, prefix)
+            end = bisect_left(keys, prefix + '\U0010ffff', start)
+            candidates = {pk for pk in ids[start:end] if pk in topics}
+        else:
+            candidates = list(topics)
+        ranked = heapq.nsmallest(limit, candidates, key=self._rank)
+        results = [(pk, *topics[pk]) for pk in ranked]
+        if memo is not None:
+            memo[prefix, limit] = results
+        return results
+
+    def save(self, pk, name, room_count):
+        """Add a topic, or pick up its new name"""
+        current = self.topics.get(pk)
+        if current is not None and current[0] == name:
+            return
+        entries = list(zip(*self.entries))
+        if current is not None:
+            stale = {(key, pk) for key in _keys(current[0])}
+            entries = [entry for entry in entries if entry not in stale]
+        for entry in sorted((key, pk) for key in _keys(name)):
+            entries.insert(bisect_left(entries, entry), entry)
+        self.topics[pk] = [name, current[1] if current else room_count]
+        self._set_entries(entries)
+        self.memo = {}
+
+    def delete(self, pk):
+        current = self.topics.pop(pk, None)
+        if current is not None:
+            stale = {(key, pk) for key in _keys(current[0])}
+            self._set_entries([entry for entry in zip(*self.entries) if entry not in stale])
+            self.memo = {}
+
+    def add_rooms(self, pk, delta):
+        current = self.topics.get(pk)
+        if current is not None:
+            current[1] = max(0, current[1] + delta)
+            self.memo = {}
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed with the clock so an evicted counter never reuses an old version
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_index():
+    """The process's index, rebuilt if another process changed topics"""
+    global _index
+    version = _current_version()
+    index = _index
+    if index is None or index.version != version:
+        index = TopicIndex(Topic.objects.values_list('pk', 'name', 'room_count').iterator(), version)
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = index
+            index = _index
+    return index
+
+
+def suggest(prefix, limit=SUGGESTION_LIMIT):
+    """
+    Suggestions for what the user has typed so far
+
+    Args:
+        prefix: Start of a topic name, or of any word in it; empty for the
+            busiest topics
+        limit: Most suggestions to return
+
+    Returns:
+        List of dicts with ``id``, ``name`` and ``room_count``
+    """
+    return [
+        {'id': pk, 'name': name, 'room_count': room_count}
+        for pk, name, room_count in get_index().suggest(prefix, limit)
+    ]
+
+
+def _apply(change):
+    """
+    Apply ``change`` to the local index and tell other processes
+
+    The local index is only edited if it was current before the change;
+    otherwise it's left stale and rebuilt on the next lookup.
+    """
+    with _lock:
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, time.time_ns(), None)
+            return
+        if _index is not None and _index.version == version - 1:
+            change(_index)
+            _index.version = version
+
+
+def topic_saved(topic):
+    _apply(lambda index: index.save(topic.pk, topic.name, topic.room_count))
+
+
+def topic_deleted(topic_id):
+    _apply(lambda index: index.delete(topic_id))
+
+
+def room_moved(from_topic_id, to_topic_id):
+    """Record a room leaving one topic and/or joining another"""
+    def change(index):
+        if from_topic_id is not None:
+            index.add_rooms(from_topic_id, -1)
+        if to_topic_id is not None:
+            index.add_rooms(to_topic_id, 1)
+    _apply(change)
+
+
+def invalidate():
+    """Make every process rebuild its index, after bulk topic writes"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
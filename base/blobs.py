@@ -0,0 +1,96 @@
+"""
+Reference counting for content-addressed media blobs.
+
+Every file field stored in ``base.storage.blob_storage`` takes a reference
+on its blob when a row starts pointing at it and drops it when the row
+changes or is deleted (see ``base.signals``). A blob whose count reaches
+zero is deleted after the transaction commits. ``recount`` rebuilds the
+counts from the database, e.g. after bulk operations that bypass signals.
+"""
+from collections import Counter
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Blob
+from .storage import BLOB_PREFIX, blob_storage, is_blob
+
+# Model label -> file fields stored as blobs
+FILE_FIELDS = {
+    'base.User': ['avatar'],
+    'base.Room': ['room_image'],
+    'base.Message': ['image', 'document'],
+    'base.Attachment': ['file'],
+}
+
+
+def acquire(name):
+    """Take a reference on a blob"""
+    if not is_blob(name):
+        return
+    if Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(name=name, size=blob_storage.size(name), ref_count=1)
+    except IntegrityError:
+        # Created concurrently
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release(name):
+    """Drop a reference on a blob, deleting it once unreferenced"""
+    if not is_blob(name):
+        return
+    Blob.objects.filter(name=name).update(ref_count=Greatest(F('ref_count') - 1, 0))
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Delete a blob and its row if nothing references it"""
+    with transaction.atomic():
+        deleted, _ = Blob.objects.filter(name=name, ref_count=0).delete()
+        if deleted:
+            blob_storage.delete(name)
+    return bool(deleted)
+
+
+def count_references():
+    """
+    Count the rows pointing at each blob
+
+    Returns:
+        Counter mapping blob name to number of references
+    """
+    references = Counter()
+    for model_label, fields in FILE_FIELDS.items():
+        model = apps.get_model(model_label)
+        for field in fields:
+            names = model.objects.filter(**{f'{field}__startswith': f'{BLOB_PREFIX}/'}).values_list(field, flat=True)
+            references.update(names.iterator())
+    return references
+
+
+def recount():
+    """
+    Rebuild every blob's reference count from the database and collect orphans
+
+    Returns:
+        Tuple of (number of blobs tracked, number of orphans deleted)
+    """
+    references = count_references()
+    with transaction.atomic():
+        existing = {blob.name: blob for blob in Blob.objects.select_for_update()}
+        for name, count in references.items():
+            blob = existing.pop(name, None)
+            if blob is None:
+                if blob_storage.exists(name):
+                    Blob.objects.create(name=name, size=blob_storage.size(name), ref_count=count)
+            elif blob.ref_count != count:
+                Blob.objects.filter(pk=blob.pk).update(ref_count=count)
+        Blob.objects.filter(pk__in=[blob.pk for blob in existing.values()]).update(ref_count=0)
+
+    orphans = sum(collect(name) for name in existing)
+    return len(references), orphans
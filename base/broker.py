@@ -0,0 +1,151 @@
+"""
+Pub/sub brokers used to fan out room events to WebSocket connections.
+
+``publish`` is synchronous so it can be called from views and signal
+handlers; ``subscribe`` is a coroutine used by the ASGI WebSocket handler.
+The backend is chosen with the ``REALTIME_BROKER`` setting::
+
+    REALTIME_BROKER = {
+        'BACKEND': 'base.broker.RedisBroker',
+        'LOCATION': 'redis://localhost:6379/0',
+    }
+
+``InProcessBroker`` (the default) only reaches connections served by the
+same process. ``RedisBroker`` publishes through Redis so every worker
+process receives every event; each process keeps a single pattern
+subscription and fans events out to its own connections locally.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per connection before the oldest are dropped
+SUBSCRIPTION_BUFFER = 100
+
+
+class Subscription:
+    """A single consumer's view of one channel"""
+
+    def __init__(self, broker, channel, maxsize=SUBSCRIPTION_BUFFER):
+        self.broker = broker
+        self.channel = channel
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+
+    def deliver(self, message):
+        # May be called from any thread, e.g. a sync view's worker thread
+        self._loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self._queue.full():
+            # Slow consumer: drop the oldest event rather than block publishers
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+    async def get(self):
+        return await self._queue.get()
+
+    async def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Delivers events to subscribers living in the current process"""
+
+    def __init__(self, location=''):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # The subscriber's event loop has been closed
+                self.unsubscribe(subscription)
+
+    async def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+class RedisBroker(InProcessBroker):
+    """Publishes through Redis (or any server speaking its pub/sub protocol)"""
+
+    prefix = 'studybud:'
+
+    def __init__(self, location='redis://localhost:6379/0'):
+        super().__init__(location)
+        try:
+            import redis
+        except ImportError as e:
+            raise ImproperlyConfigured("RedisBroker requires the 'redis' package.") from e
+        self._location = location
+        self._client = redis.Redis.from_url(location)
+        self._listener = None
+
+    def publish(self, channel, message):
+        self._client.publish(self.prefix + channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    async def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not loop:
+            self._listener = loop.create_task(self._listen())
+        return await super().subscribe(channel)
+
+    async def _listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self._location)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(self.prefix + '*')
+            async for item in pubsub.listen():
+                if item['type'] != 'pmessage':
+                    continue
+                channel = item['channel'].decode()[len(self.prefix):]
+                try:
+                    message = json.loads(item['data'])
+                except ValueError:
+                    logger.warning(f"Dropping malformed event on {channel}")
+                    continue
+                self.dispatch(channel, message)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the process-wide broker configured by ``REALTIME_BROKER``"""
+    global _broker
+    if _broker is None:
+        config = getattr(settings, 'REALTIME_BROKER', {})
+        backend = import_string(config.get('BACKEND', 'base.broker.InProcessBroker'))
+        _broker = backend(config['LOCATION']) if 'LOCATION' in config else backend()
+    return _broker
@@ -0,0 +1,426 @@
+"""
+Bulk import and export of users, topics, rooms and messages.
+
+Data is exchanged as a stream of flat records, each tagged with its
+``type``, written as NDJSON (one JSON object per line) or CSV (one column
+per field in ``COLUMNS``)::
+
+    {"type": "user", "username": "ada", "email": "ada@example.com", ...}
+    {"type": "topic", "name": "Python", "created": "..."}
+    {"type": "room", "id": 7, "name": "Async IO", "host": "ada", "topic": "Python", ...}
+    {"type": "participant", "room": 7, "user": "ada"}
+    {"type": "message", "room": 7, "user": "ada", "body": "...", "created": "...", ...}
+
+Users are identified by username, topics by name and rooms by the ``id``
+they had in the exporting database. A record may only refer to rows that
+either exist already or appear earlier in the stream; exports are written
+in that order. Existing users and topics are matched rather than
+duplicated, but rooms and messages have no natural key, so importing the
+same data twice copies them twice. Files, images and passwords are not
+exported; imported users get unusable passwords.
+
+``Importer`` writes rows with batched ``bulk_create``, so no per-row
+signals fire. It resolves usernames, topic names and room IDs through
+in-memory caches. Counters and search documents are updated once per batch;
+at the end fragment caches are invalidated and timelines and trending
+scores rebuilt. Readers and writers work on streams, so memory use does not
+grow with the size of the data.
+"""
+import csv
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import autocomplete, counters, fragments, membership, search, timelines, trending
+from .models import Message, Room, Topic, User
+
+# In dependency order; batches are flushed in this order
+RECORD_TYPES = ('user', 'topic', 'room', 'participant', 'message')
+
+COLUMNS = [
+    'type', 'id', 'username', 'email', 'name', 'bio', 'date_joined', 'host', 'topic',
+    'room', 'user', 'description', 'body', 'created', 'updated',
+]
+
+FORMATS = ('ndjson', 'csv')
+
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+
+Participant = Room.participants.through
+
+
+class RecordError(ValueError):
+    """A record that can't be imported"""
+
+
+# Export
+
+def export_records(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield every user, topic, room, participant and message as a record
+
+    Each table is read with a server-side cursor where the database
+    supports one, ``chunk_size`` rows at a time.
+    """
+    users = User.objects.order_by('pk').values('username', 'email', 'name', 'bio', 'date_joined')
+    for row in users.iterator(chunk_size=chunk_size):
+        yield {'type': 'user', **row}
+
+    for row in Topic.objects.order_by('pk').values('name', 'created').iterator(chunk_size=chunk_size):
+        yield {'type': 'topic', **row}
+
+    rooms = Room.objects.order_by('pk').values(
+        'id', 'name', 'description', 'host__username', 'topic__name', 'created', 'updated'
+    )
+    for row in rooms.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'room', 'id': row['id'], 'name': row['name'], 'description': row['description'],
+            'host': row['host__username'], 'topic': row['topic__name'],
+            'created': row['created'], 'updated': row['updated'],
+        }
+
+    participants = Participant.objects.order_by('pk').values_list('room_id', 'user__username')
+    for room_id, username in participants.iterator(chunk_size=chunk_size):
+        yield {'type': 'participant', 'room': room_id, 'user': username}
+
+    messages = Message.objects.order_by('pk').values_list('room_id', 'user__username', 'body', 'created', 'updated')
+    for room_id, username, body, created, updated in messages.iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'message', 'room': room_id, 'user': username, 'body': body,
+            'created': created, 'updated': updated,
+        }
+
+
+def _plain(record):
+    # Full precision; DjangoJSONEncoder would cut datetimes to milliseconds
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in record.items()}
+
+
+def write_ndjson(records, stream):
+    """
+    Write records to a text stream, one JSON object per line
+
+    Returns:
+        Number of records written
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    count = 0
+    for record in records:
+        # One write per line; Django's OutputWrapper would end a bare record
+        # with a newline of its own
+        stream.write(encoder.encode(_plain(record)) + '\n')
+        count += 1
+    return count
+
+
+def write_csv(records, stream):
+    """
+    Write records to a text stream as CSV with a ``COLUMNS`` header
+
+    Returns:
+        Number of records written
+    """
+    writer = csv.DictWriter(stream, fieldnames=COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(_plain(record))
+        count += 1
+    return count
+
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise RecordError(f"Line {line_number}: {e}") from e
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        # CSV can't tell None from an empty string
+        yield {key: value for key, value in row.items() if key and value != ''}
+
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv}
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+
+
+# Import
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let rows keep the ``auto_now``/``auto_now_add`` values they are given
+
+    Only safe in a process that isn't serving requests, e.g. a management
+    command.
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+def _datetime(value, default):
+    if not value:
+        return default
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            raise RecordError(f"Invalid datetime {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Importer:
+    """
+    Import records in batches
+
+    Call ``add`` for each record and ``finish`` at the end. ``counts``
+    holds the rows imported (or, for users, matched) per type and
+    ``skipped`` the records that were dropped, with a reason each in
+    ``errors`` (first 100 only). A malformed value raises RecordError;
+    batches written before it stay committed.
+
+    Args:
+        batch_size: Records of one type collected before everything pending
+            is written
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.batches = {record_type: [] for record_type in RECORD_TYPES}
+        # Resolution caches
+        self.user_ids = {}
+        self.topic_ids = {}
+        self.room_ids = {}
+        self.counts = Counter()
+        self.skipped = Counter()
+        self.errors = []
+        self.started = time.monotonic()
+        self._unusable_password = make_password(None)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def rate(self):
+        """Rows imported per second so far"""
+        elapsed = time.monotonic() - self.started
+        return self.total / elapsed if elapsed else 0.0
+
+    def add(self, record):
+        record_type = record.get('type')
+        if record_type not in self.batches:
+            self._skip(record_type or '?', f"Unknown record type {record_type!r}")
+            return
+        batch = self.batches[record_type]
+        batch.append(record)
+        if len(batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every pending batch, in dependency order"""
+        with explicit_timestamps(Topic, Room, Message), transaction.atomic():
+            for record_type in RECORD_TYPES:
+                batch = self.batches[record_type]
+                if batch:
+                    getattr(self, f"_import_{record_type}s")(batch)
+                    self.batches[record_type] = []
+
+    def finish(self):
+        self.flush()
+        fragments.bump(fragments.ROOMS, fragments.TOPICS, fragments.MESSAGES, fragments.USERS)
+        autocomplete.invalidate()
+        if self.room_ids:
+            timelines.rebuild(set(self.room_ids.values()))
+        if self.counts['room'] or self.counts['message']:
+            # Scores are recomputed from recent activity rather than per row
+            trending.rebuild()
+
+    def _skip(self, record_type, reason):
+        self.skipped[record_type] += 1
+        if len(self.errors) < 100:
+            self.errors.append(f"{record_type}: {reason}")
+
+    # Resolution
+
+    def _resolve_users(self, usernames):
+        missing = {name for name in usernames if name and name not in self.user_ids}
+        if missing:
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+
+    def _resolve_topics(self, names, created=None):
+        """Look up topics by name, creating missing ones"""
+        missing = {name for name in names if name and name not in self.topic_ids}
+        if not missing:
+            return
+        self.topic_ids.update(Topic.objects.filter(name__in=missing).values_list('name', 'pk'))
+        new = missing - set(self.topic_ids)
+        if new:
+            now = timezone.now()
+            Topic.objects.bulk_create(
+                [Topic(name=name, created=(created or {}).get(name, now)) for name in new],
+                ignore_conflicts=True
+            )
+            topics = list(Topic.objects.filter(name__in=new))
+            self.topic_ids.update((topic.name, topic.pk) for topic in topics)
+            search.index_many(topics)
+            self.counts['topic'] += len(topics)
+
+    # Record types
+
+    def _import_users(self, batch):
+        users = []
+        for record in batch:
+            username = (record.get('username') or '').strip()
+            if not username:
+                self._skip('user', 'Missing username')
+                continue
+            users.append(User(
+                username=username[:150], email=record.get('email') or None, name=record.get('name'),
+                bio=record.get('bio'), date_joined=_datetime(record.get('date_joined'), timezone.now()),
+                password=self._unusable_password
+            ))
+        # Existing usernames or emails are kept as they are
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        before = len(self.user_ids)
+        self._resolve_users(user.username for user in users)
+        self.counts['user'] += len(self.user_ids) - before
+
+    def _import_topics(self, batch):
+        created = {}
+        for record in batch:
+            name = (record.get('name') or '').strip()
+            if not name:
+                self._skip('topic', 'Missing name')
+                continue
+            created[name[:200]] = _datetime(record.get('created'), timezone.now())
+        self._resolve_topics(created, created)
+
+    def _import_rooms(self, batch):
+        self._resolve_users(record.get('host') for record in batch)
+        self._resolve_topics((record.get('topic') or '').strip() for record in batch)
+        rooms, source_ids = [], []
+        topic_rooms = Counter()
+        now = timezone.now()
+        for record in batch:
+            if record.get('id') in (None, '') or not record.get('name'):
+                self._skip('room', 'Missing id or name')
+                continue
+            topic_name = (record.get('topic') or '').strip()
+            topic_id = self.topic_ids.get(topic_name)
+            room = Room(
+                name=record['name'][:200], description=record.get('description'),
+                host_id=self.user_ids.get(record.get('host')),
+                created=_datetime(record.get('created'), now), updated=_datetime(record.get('updated'), now),
+            )
+            if topic_id is not None:
+                # Assigning an instance lets the search index read its name without a query
+                room.topic = Topic(pk=topic_id, name=topic_name)
+                topic_rooms[topic_id] += 1
+            rooms.append(room)
+            source_ids.append(str(record['id']))
+        Room.objects.bulk_create(rooms, batch_size=self.batch_size)
+        self.room_ids.update((source_id, room.pk) for source_id, room in zip(source_ids, rooms))
+        self.counts['room'] += len(rooms)
+
+        search.index_many(rooms)
+        for topic_id, count in topic_rooms.items():
+            Topic.objects.filter(pk=topic_id).update(room_count=F('room_count') + count)
+
+    def _import_participants(self, batch):
+        self._resolve_users(record.get('user') for record in batch)
+        links = []
+        for record in batch:
+            room_id = self.room_ids.get(str(record.get('room')))
+            user_id = self.user_ids.get(record.get('user'))
+            if room_id is None or user_id is None:
+                self._skip('participant', f"Unknown room {record.get('room')!r} or user {record.get('user')!r}")
+                continue
+            links.append(Participant(room_id=room_id, user_id=user_id))
+        Participant.objects.bulk_create(links, ignore_conflicts=True)
+        self.counts['participant'] += len(links)
+        # Duplicates were ignored, so count rather than add
+        room_ids = {link.room_id for link in links}
+        if room_ids:
+            counters.recount_rooms(Room.objects.filter(pk__in=room_ids), messages=False)
+        membership.forget((link.room_id, link.user_id) for link in links)
+
+    def _import_messages(self, batch):
+        self._resolve_users(record.get('user') for record in batch)
+        messages = []
+        now = timezone.now()
+        for record in batch:
+            room_id = self.room_ids.get(str(record.get('room')))
+            user_id = self.user_ids.get(record.get('user'))
+            if room_id is None or user_id is None:
+                self._skip('message', f"Unknown room {record.get('room')!r} or user {record.get('user')!r}")
+                continue
+            created = _datetime(record.get('created'), now)
+            messages.append(Message(
+                room_id=room_id, user_id=user_id, body=record.get('body') or '',
+                created=created, updated=_datetime(record.get('updated'), created),
+            ))
+        Message.objects.bulk_create(messages, batch_size=self.batch_size)
+        self.counts['message'] += len(messages)
+
+        search.index_many(messages)
+        per_room = {}
+        for message in messages:
+            count, latest = per_room.get(message.room_id, (0, message.created))
+            per_room[message.room_id] = (count + 1, max(latest, message.created))
+        for room_id, (count, latest) in per_room.items():
+            Room.objects.filter(pk=room_id).update(
+                message_count=F('message_count') + count,
+                last_message_at=Greatest(Coalesce('last_message_at', Value(latest)), Value(latest)),
+            )
+
+
+def import_records(records, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Import an iterable of records
+
+    Args:
+        records: Iterable of record dicts
+        batch_size: Records per batch
+        progress: Optional function called with the Importer after each
+            ``batch_size`` records
+
+    Returns:
+        The finished Importer
+    """
+    importer = Importer(batch_size)
+    for number, record in enumerate(records, 1):
+        importer.add(record)
+        if progress and number % batch_size == 0:
+            progress(importer)
+    importer.finish()
+    return importer
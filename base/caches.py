@@ -0,0 +1,30 @@
+"""
+Whether the default cache is shared between worker processes.
+
+Some cached state is only safe when every process sees the same cache:
+page fragments (``base.fragments``), API validators
+(``base.api.conditional``), sessions and signed-in users (``base.sessions``,
+``base.auth``) and room membership (``base.membership``) are invalidated by
+the process that makes a change, so with a process-local cache the other
+workers would keep serving stale entries. Those features check ``is_shared`` and fall
+back to the database when it's False, and the ``base.W001`` system check
+says so at startup.
+
+``CACHE_SHARED`` overrides the guess, e.g. True for a single worker process
+using the local-memory cache.
+"""
+from django.conf import settings
+
+# Backends whose entries live in (or never leave) one process
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared():
+    """Whether a write to the default cache is seen by every worker"""
+    shared = getattr(settings, 'CACHE_SHARED', None)
+    if shared is not None:
+        return shared
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
@@ -0,0 +1,21 @@
+"""
+System checks for StudyBud's settings.
+"""
+from django.core import checks
+
+from . import caches
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Say so when the cache-backed features are switched off"""
+    if caches.is_shared():
+        return []
+    return [checks.Warning(
+        "The default cache isn't shared between worker processes, so page "
+        "fragments, API validators (ETag/Last-Modified) and the session, user "
+        "and membership caches are disabled and every request reads the database.",
+        hint="Use a shared backend (STUDYBUD_CACHE_BACKEND=redis), or set "
+             "CACHE_SHARED = True when a single process serves every request.",
+        id='base.W001',
+    )]
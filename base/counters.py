@@ -0,0 +1,109 @@
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Room, Topic, Message
+
+
+def _count_subquery(queryset, field):
+    """Correlated COUNT(*) subquery grouped on ``field``"""
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(n=Count('*')).values('n'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+def room_participant_count():
+    return _count_subquery(
+        Room.participants.through.objects.filter(room_id=OuterRef('pk')), 'room_id'
+    )
+
+
+def room_message_count():
+    return _count_subquery(Message.objects.filter(room_id=OuterRef('pk')), 'room_id')
+
+
+def room_last_message_at():
+    return Subquery(
+        Message.objects.filter(room_id=OuterRef('pk')).order_by()
+        .values('room_id').annotate(last=Max('created')).values('last')
+    )
+
+
+def topic_room_count():
+    return _count_subquery(Room.objects.filter(topic_id=OuterRef('pk')), 'topic_id')
+
+
+def recount_rooms(queryset=None, participants=True, messages=True):
+    """
+    Recompute the stored counters of rooms from the source tables
+
+    Args:
+        queryset: Rooms to update (defaults to every room)
+        participants: Whether to recount ``participant_count``
+        messages: Whether to recount ``message_count`` and ``last_message_at``
+
+    Returns:
+        Number of rows updated
+    """
+    fields = {}
+    if participants:
+        fields['participant_count'] = room_participant_count()
+    if messages:
+        fields['message_count'] = room_message_count()
+        fields['last_message_at'] = room_last_message_at()
+    if queryset is None:
+        queryset = Room.objects.all()
+    return queryset.order_by().update(**fields)
+
+
+def recount_topics(queryset=None):
+    """
+    Recompute ``Topic.room_count`` from the rooms table
+
+    Args:
+        queryset: Topics to update (defaults to every topic)
+
+    Returns:
+        Number of rows updated
+    """
+    if queryset is None:
+        queryset = Topic.objects.all()
+    return queryset.order_by().update(room_count=topic_room_count())
+
+
+def find_drift():
+    """
+    Compare stored counters against freshly computed values
+
+    Returns:
+        List of ``(model_name, pk, field, stored, actual)`` tuples, one per
+        counter that disagrees with the source tables
+    """
+    drift = []
+
+    rooms = Room.objects.order_by('pk').values_list(
+        'pk', 'participant_count', 'message_count', 'last_message_at'
+    ).annotate(
+        actual_participants=room_participant_count(),
+        actual_messages=room_message_count(),
+        actual_last_message_at=room_last_message_at()
+    )
+    for pk, participants, messages, last_at, actual_participants, actual_messages, actual_last_at in rooms.iterator():
+        if participants != actual_participants:
+            drift.append(('room', pk, 'participant_count', participants, actual_participants))
+        if messages != actual_messages:
+            drift.append(('room', pk, 'message_count', messages, actual_messages))
+        if last_at != actual_last_at:
+            drift.append(('room', pk, 'last_message_at', last_at, actual_last_at))
+
+    topics = Topic.objects.order_by('pk').values_list('pk', 'room_count').annotate(
+        actual_rooms=topic_room_count()
+    )
+    for pk, room_count, actual_rooms in topics.iterator():
+        if room_count != actual_rooms:
+            drift.append(('topic', pk, 'room_count', room_count, actual_rooms))
+
+    return drift
@@ -0,0 +1,54 @@
+"""
+Primary/replica database routing.
+
+Reads go to a replica only while a view decorated with ``replica_reads``
+is handling a safe request that isn't pinned to the primary (see
+``base.middleware.ReadYourWritesMiddleware``). Everything else, and every
+write, uses ``default``.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_reads(view_func):
+    """Mark a read-only view as safe to serve from a read replica"""
+    view_func.replica_reads = True
+    return view_func
+
+
+def set_replica_reads(enabled):
+    """Allow or forbid replica reads for the current request context"""
+    _use_replica.set(enabled)
+
+
+@contextmanager
+def primary_reads():
+    """Send the block's reads to the primary, e.g. while filling a cache"""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if replicas and _use_replica.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any alias may relate
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -34,7 +34,9 @@ class RoomForm(forms.ModelForm):
     
     class Meta:
         model = Room
-        fields = ['name', 'topic', 'description', 'room_image']
+        # The views resolve the topic name to a Topic; left out here so the
+        # form doesn't assign the name to the foreign key itself
+        fields = ['name', 'description', 'room_image']
         exclude = ['host', 'participants']
         widgets = {
             'name': forms.TextInput(attrs={
@@ -0,0 +1,147 @@
+"""
+Versioned fragment caching for expensive page sections.
+
+Each cached fragment declares the data groups it depends on (``ROOMS``,
+``TOPICS``, ``MESSAGES``, ``USERS``). Every group has a version counter
+stored in the cache and the counters are part of the fragment's key, so
+bumping a group from a model signal makes every dependent fragment miss on
+its next read. Nothing is deleted explicitly; stale entries simply age out.
+
+Only a shared cache (``base.caches``) carries a bump to every worker, so
+with a process-local one fragments are rendered on every request instead.
+A fragment filled soon after its groups were bumped is rendered from the
+primary database, since a lagging replica could still return the data the
+bump invalidated and it would be cached under the new version.
+
+The same counters version the REST API's ETags (``base.api.conditional``)
+when the cache is shared between workers.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import caches, metrics
+from .db_routers import primary_reads
+
+ROOMS = 'rooms'
+TOPICS = 'topics'
+MESSAGES = 'messages'
+USERS = 'users'
+
+FRAGMENT_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300)
+
+# How long after a bump fills read from the primary; replicas may lag this much
+REPLICA_LAG = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def _version_key(group):
+    return f"fragment-version:{group}"
+
+
+def _modified_key(group):
+    return f"fragment-modified:{group}"
+
+
+def get_versions(groups):
+    """
+    Fetch the current version of each group in one cache round trip
+
+    Args:
+        groups: Iterable of group names
+
+    Returns:
+        Dict mapping group name to version
+    """
+    keys = {_version_key(group): group for group in groups}
+    found = cache.get_many(keys)
+    versions = {keys[key]: value for key, value in found.items()}
+    for key, group in keys.items():
+        if group not in versions:
+            # Seed with the clock so an evicted counter never reuses an old version
+            cache.add(key, time.time_ns(), None)
+            versions[group] = cache.get(key)
+    return versions
+
+
+def bump(*groups):
+    """
+    Invalidate every fragment depending on any of ``groups``
+
+    Inside a transaction this waits for the commit; bumping earlier would
+    let a concurrent request re-cache the old data under the new version.
+    """
+    transaction.on_commit(lambda: _bump(groups))
+
+
+def _bump(groups):
+    for group in groups:
+        try:
+            cache.incr(_version_key(group))
+        except ValueError:
+            cache.set(_version_key(group), time.time_ns(), None)
+    cache.set_many({_modified_key(group): time.time() for group in groups}, None)
+
+
+def last_modified(groups):
+    """
+    When any of ``groups`` last changed
+
+    Returns:
+        Unix timestamp, or None if none of the groups has changed since the
+        cache was last cleared
+    """
+    found = cache.get_many([_modified_key(group) for group in groups])
+    return max(found.values(), default=None)
+
+
+def cached(name, depends_on, vary_on, render):
+    """
+    Return a cached value, computing it with ``render`` on a miss
+
+    Args:
+        name: Fragment name, used as the key prefix
+        depends_on: Groups whose versions are folded into the key
+        vary_on: Extra values (query string, user id, ...) the value depends on
+        render: Zero-argument callable producing the value
+
+    Returns:
+        The cached or freshly rendered value
+    """
+    if not caches.is_shared():
+        return render()
+    versions = get_versions(depends_on)
+    parts = [f"{group}={versions[group]}" for group in sorted(versions)]
+    parts.extend(str(value) for value in vary_on)
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    key = f"fragment:{name}:{digest}"
+
+    value = cache.get(key)
+    metrics.record_cache_lookup(name, value is not None)
+    if value is None:
+        changed = last_modified(depends_on)
+        if changed is not None and time.time() - changed < REPLICA_LAG:
+            with primary_reads():
+                value = render()
+        else:
+            value = render()
+        cache.set(key, value, FRAGMENT_TIMEOUT)
+    return value
+
+
+def render_fragment(request, name, template_name, depends_on, vary_on, get_context):
+    """
+    Render a template fragment through the cache
+
+    ``get_context`` is only called on a miss, so any queries it builds are
+    skipped entirely when the fragment is served from cache.
+    """
+    html = cached(
+        name, depends_on, vary_on,
+        lambda: str(render_to_string(template_name, get_context(), request))
+    )
+    return mark_safe(html)
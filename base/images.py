@@ -0,0 +1,200 @@
+"""
+Resized renditions of uploaded images.
+
+Uploads are stored untouched; afterwards a background worker renders each
+size listed in ``RENDITIONS`` as WebP (and AVIF when the installed Pillow
+can encode it) plus a JPEG fallback, with EXIF and other metadata
+stripped. Storage paths are recorded in the model's ``renditions`` field:
+
+    {"small": {"webp": "renditions/...", "jpeg": "renditions/..."}, ...}
+
+Templates pick a rendition with the ``picture`` tag from ``media_tags`` and
+fall back to the original file until the worker has finished.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import fragments
+from .auth import forget_user
+
+logger = logging.getLogger(__name__)
+
+# size name -> (width, height, crop). Cropped sizes fill the box exactly;
+# the others are scaled down to fit inside it.
+RENDITIONS = {
+    'base.User.avatar': {
+        'small': (96, 96, True),
+        'large': (256, 256, True),
+    },
+    'base.Room.room_image': {
+        'banner': (1200, 400, True),
+    },
+    'base.Message.image': {
+        'thumbnail': (480, 480, False),
+    },
+    'base.Attachment.file': {
+        'thumbnail': (480, 480, False),
+    },
+}
+
+FORMATS = [
+    ('avif', 'AVIF', {'quality': 60}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+
+_executor = None
+
+
+def image_field_key(instance, field_name):
+    return f"{instance._meta.label}.{field_name}"
+
+
+def available_formats():
+    Image.init()
+    return [spec for spec in FORMATS if spec[1] in Image.SAVE]
+
+
+def rendition_url(obj, field_name, size, fmt='jpeg'):
+    """
+    URL of one rendition, falling back to the original file
+
+    Returns:
+        URL string, or None when the field is empty
+    """
+    path = (obj.renditions or {}).get(size, {}).get(fmt)
+    if path:
+        return default_storage.url(path)
+    file = getattr(obj, field_name)
+    return file.url if file else None
+
+
+def render(source, width, height, crop):
+    """
+    Produce encoded renditions of one size
+
+    Args:
+        source: Open PIL image
+        width, height: Target box
+        crop: Fill the box exactly instead of fitting inside it
+
+    Returns:
+        Dict mapping format name to encoded bytes
+    """
+    if crop:
+        image = ImageOps.fit(source, (width, height), Image.LANCZOS)
+    else:
+        image = source.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+
+    outputs = {}
+    for name, pil_format, options in available_formats():
+        buffer = io.BytesIO()
+        # Saving a fresh image without exif/icc arguments drops all metadata
+        if pil_format == 'JPEG' and image.mode == 'RGBA':
+            flat = Image.new('RGB', image.size, 'white')
+            flat.paste(image, mask=image.getchannel('A'))
+            flat.save(buffer, pil_format, **options)
+        else:
+            image.save(buffer, pil_format, **options)
+        outputs[name] = buffer.getvalue()
+    return outputs
+
+
+def generate_renditions(model_label, pk, field_name):
+    """
+    Render and store every size of one image field, replacing old renditions
+
+    Args:
+        model_label: Model label such as ``base.User``
+        pk: Primary key of the instance
+        field_name: Name of the image field
+    """
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    file = getattr(instance, field_name)
+    sizes = RENDITIONS[image_field_key(instance, field_name)]
+
+    renditions = {}
+    if file:
+        try:
+            with file.open('rb') as f:
+                source = Image.open(f)
+                source = ImageOps.exif_transpose(source)
+                source = source.convert('RGBA' if source.has_transparency_data else 'RGB')
+        except (FileNotFoundError, UnidentifiedImageError, OSError) as e:
+            # SVG defaults and missing files keep being served as-is
+            logger.info(f"Skipping renditions for {model_label} {pk}: {e}")
+        else:
+            # Blobs are shared between rows, so renditions are stored per row
+            digest = hashlib.sha1(file.name.encode()).hexdigest()[:16]
+            for size, (width, height, crop) in sizes.items():
+                for fmt, data in render(source, width, height, crop).items():
+                    path = f"renditions/{model._meta.model_name}/{pk}/{digest}_{size}.{fmt}"
+                    if default_storage.exists(path):
+                        default_storage.delete(path)
+                    renditions.setdefault(size, {})[fmt] = default_storage.save(path, ContentFile(data))
+
+    delete_renditions(instance.renditions, keep=renditions)
+
+    # update() avoids re-triggering save signals
+    model.objects.filter(pk=pk).update(renditions=renditions)
+    if model_label == settings.AUTH_USER_MODEL:
+        # Signed-in users are cached with their avatar renditions
+        forget_user(pk)
+    fragments.bump(fragments.ROOMS, fragments.MESSAGES, fragments.USERS)
+
+
+def delete_renditions(renditions, keep=None):
+    """
+    Remove stored rendition files
+
+    Args:
+        renditions: A ``renditions`` field value
+        keep: Optional ``renditions`` value whose files must survive
+    """
+    kept = {path for paths in (keep or {}).values() for path in paths.values()}
+    for paths in renditions.values():
+        for path in paths.values():
+            if path not in kept:
+                default_storage.delete(path)
+
+
+def _run(model_label, pk, field_name):
+    close_old_connections()
+    try:
+        generate_renditions(model_label, pk, field_name)
+    except Exception:
+        logger.exception(f"Failed to generate renditions for {model_label} {pk}")
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(instance, field_name):
+    """Generate renditions in the worker pool once the transaction commits"""
+    args = (instance._meta.label, instance.pk, field_name)
+
+    def submit():
+        global _executor
+        if getattr(settings, 'IMAGE_RENDITIONS_SYNC', False):
+            generate_renditions(*args)
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_RENDITION_WORKERS', 2),
+                thread_name_prefix='renditions'
+            )
+        _executor.submit(_run, *args)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,192 @@
+import asyncio
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+
+from base import seed
+from base.models import Message, Room, User
+
+from .benchmark_studybud import percentile
+
+
+def slow_database(latency):
+    """
+    Execute wrapper adding ``latency`` seconds to every query, standing in
+    for a database across the network
+    """
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(latency)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the sync and async API views through the ASGI handler under concurrent load and '
+        'compare their latency, throughput and thread use'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint (default: 200)')
+        parser.add_argument(
+            '--concurrency', type=int, default=50, help='Requests in flight at once (default: 50)'
+        )
+        parser.add_argument(
+            '--db-latency',
+            type=float,
+            default=20.0,
+            help='Milliseconds added to every query to simulate a remote database (default: 20)',
+        )
+        parser.add_argument(
+            '--scale', type=int, default=5000, help='Messages to seed the benchmark database with (default: 5000)'
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the benchmark database between runs, like "test --keepdb"',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+        verbosity = max(0, options['verbosity'] - 1)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity, interactive=False, keepdb=options['keepdb'])
+        wrapper = slow_database(options['db_latency'] / 1000)
+
+        def install(sender, connection, **kwargs):
+            connection.execute_wrappers.append(wrapper)
+
+        try:
+            self.grow(options['scale'], options['seed'])
+            endpoints = self.endpoints()
+            # Each request's queries run on a connection opened in its own thread
+            connection_created.connect(install)
+            application = get_asgi_application()
+            self.stdout.write(
+                f"{options['requests']} requests per endpoint, {options['concurrency']} concurrent, "
+                f"{options['db_latency']:g}ms per query"
+            )
+            for name, sync_path, async_path in endpoints:
+                for mode, path in (('sync', sync_path), ('async', async_path)):
+                    result = asyncio.run(
+                        self.measure(application, path, options['requests'], options['concurrency'])
+                    )
+                    self.report(name, mode, result)
+        finally:
+            connection_created.disconnect(install)
+            teardown_databases(old_config, verbosity, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def grow(self, scale, random_seed):
+        missing = scale - Message.objects.count()
+        if missing <= 0:
+            return
+        rooms = max(5, scale // 200)
+        seed.seed(
+            users=max(10, scale // 50),
+            topics=28 if not Room.objects.exists() else 0,
+            rooms=rooms,
+            participants=rooms * 8,
+            messages=missing,
+            attachments=missing // 20,
+            random_seed=random_seed + scale,
+        )
+
+    def endpoints(self):
+        """Read endpoints to compare, as (name, sync path, async path) tuples"""
+        room = Room.objects.order_by('-message_count').only('pk').first()
+        user = User.objects.order_by('pk').only('pk').first()
+        endpoints = [
+            ('rooms', reverse('api-rooms'), reverse('api-async-rooms')),
+            ('topics', reverse('api-topics'), reverse('api-async-topics')),
+            ('messages', reverse('api-messages'), reverse('api-async-messages')),
+            ('users', reverse('api-users'), reverse('api-async-users')),
+        ]
+        if room is not None:
+            endpoints.append((
+                'room expanded',
+                f"{reverse('api-room', args=[room.pk])}?expand=participants,messages",
+                f"{reverse('api-async-room', args=[room.pk])}?expand=participants,messages",
+            ))
+        if user is not None:
+            endpoints.append(('user', reverse('api-user', args=[user.pk]), reverse('api-async-user', args=[user.pk])))
+        return endpoints
+
+    async def measure(self, application, path, requests, concurrency):
+        """
+        Send ``requests`` GETs for ``path`` straight to the ASGI application
+
+        Returns:
+            Dict of sorted timings in seconds, wall time, error count and
+            the most threads alive at once
+        """
+        url = urlsplit(path)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': url.path,
+            'raw_path': url.path.encode(),
+            'query_string': url.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'accept', b'application/json')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        limit = asyncio.Semaphore(concurrency)
+        peak_threads = threading.active_count()
+        timings = []
+        errors = 0
+
+        async def request():
+            nonlocal peak_threads, errors
+            sent_body = False
+            status = None
+
+            async def receive():
+                nonlocal sent_body
+                if not sent_body:
+                    sent_body = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; Django stops listening once it has responded
+                await asyncio.Event().wait()
+
+            async def send(message):
+                nonlocal status, peak_threads
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                    peak_threads = max(peak_threads, threading.active_count())
+
+            async with limit:
+                started = time.perf_counter()
+                await application(dict(scope), receive, send)
+                timings.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+        wall = time.perf_counter() - started
+        timings.sort()
+        return {'timings': timings, 'wall': wall, 'errors': errors, 'threads': peak_threads}
+
+    def report(self, name, mode, result):
+        timings = result['timings']
+        self.stdout.write(
+            f"{name:<14} {mode:<5} p50 {statistics.median(timings) * 1000:>8.2f}ms  "
+            f"p90 {percentile(timings, 0.90) * 1000:>8.2f}ms  p99 {percentile(timings, 0.99) * 1000:>8.2f}ms  "
+            f"max {timings[-1] * 1000:>8.2f}ms  {len(timings) / result['wall']:>7.1f} req/s  "
+            f"{result['errors']} errors  {result['threads']} threads"
+        )
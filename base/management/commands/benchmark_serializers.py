@@ -0,0 +1,88 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from base.api import views
+from base.api.renderers import FastJSONRenderer, orjson
+
+ENDPOINTS = {
+    'getMessages': (views.getMessages, '/api/messages/'),
+    'getRooms': (views.getRooms, '/api/rooms/'),
+}
+
+# name -> (API_VALUES_SERIALIZERS, renderer class)
+PATHS = {
+    'current': (False, JSONRenderer),
+    'fast': (True, FastJSONRenderer),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare the ModelSerializer/JSONRenderer path with the .values()/fast renderer path'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-sizes',
+            default='10,100',
+            help='Comma-separated page sizes to measure (default: 10,100)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Timed requests per endpoint, page size and path (default: 200)',
+        )
+
+    def run(self, view, path, page_size, values_serializers, renderer_class):
+        """
+        Serve one request and render it like a real response would be
+
+        Returns:
+            Tuple of (rendered body, seconds taken)
+        """
+        request = RequestFactory().get(path, {'page_size': page_size}, HTTP_ACCEPT='application/json')
+        with override_settings(API_VALUES_SERIALIZERS=values_serializers):
+            started = time.perf_counter()
+            response = view(request)
+            response.accepted_renderer = renderer_class()
+            response.render()
+            elapsed = time.perf_counter() - started
+        return response.content, elapsed
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        iterations = options['iterations']
+        self.stdout.write(f"JSON encoder: {'orjson' if orjson else 'json'}")
+        self.stdout.write(
+            f"{'endpoint':<12} {'size':>5} {'path':<8} {'rows':>5} {'queries':>7} "
+            f"{'median ms':>10} {'p95 ms':>8} {'speedup':>8}"
+        )
+
+        for name, (view, path) in ENDPOINTS.items():
+            for page_size in page_sizes:
+                bodies = {}
+                medians = {}
+                for path_name, (values_serializers, renderer_class) in PATHS.items():
+                    # Warm up caches and the compiled extractors, and count queries
+                    with CaptureQueriesContext(connection) as queries:
+                        body, _ = self.run(view, path, page_size, values_serializers, renderer_class)
+                    timings = sorted(
+                        self.run(view, path, page_size, values_serializers, renderer_class)[1]
+                        for _ in range(iterations)
+                    )
+                    bodies[path_name] = json.loads(body)
+                    medians[path_name] = statistics.median(timings)
+                    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                    speedup = medians['current'] / medians[path_name]
+                    self.stdout.write(
+                        f"{name:<12} {page_size:>5} {path_name:<8} {len(bodies[path_name]['results']):>5} "
+                        f"{len(queries):>7} {medians[path_name] * 1000:>10.2f} {p95 * 1000:>8.2f} {speedup:>7.2f}x"
+                    )
+                if bodies['fast'] != bodies['current']:
+                    self.stderr.write(self.style.ERROR(f"{name} page_size={page_size}: responses differ"))
@@ -0,0 +1,338 @@
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from base import seed, uploads
+from base.models import Message, Room, Topic, Upload, User
+
+# Dataset shape per message, used to size every scale
+USERS_PER_MESSAGE = 1 / 50
+ROOMS_PER_MESSAGE = 1 / 200
+PARTICIPANTS_PER_ROOM = 8
+ATTACHMENTS_PER_MESSAGE = 1 / 20
+TOPICS = 28
+
+# Chunked upload measured by the benchmark, sized so it never completes
+UPLOAD_FILE_NAME = 'benchmark.pdf'
+UPLOAD_CHUNK = b'\0' * (64 * 1024)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency percentiles and query counts of the main pages and the API at several '
+        'dataset sizes, and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='1000,100000,1000000',
+            help='Comma-separated message counts to measure at (default: 1000,100000,1000000)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=30,
+            help='Timed requests per endpoint and scale (default: 30)',
+        )
+        parser.add_argument(
+            '--output',
+            help='JSON file for the results (default: benchmarks/<commit>.json)',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Earlier results file to compare against',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20.0,
+            help='Median slowdown in percent reported as a regression (default: 20)',
+        )
+        parser.add_argument(
+            '--current-db',
+            action='store_true',
+            help='Measure the configured database as it is, without seeding; --scales is ignored',
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the benchmark database between runs, like "test --keepdb"',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        scales = sorted(int(scale) for scale in options['scales'].split(','))
+        commit = git_commit()
+        results = []
+
+        setup_test_environment()
+        # Seeded attachments, their renditions and upload chunks go to a
+        # scratch directory rather than the project's media
+        media_root = Path(tempfile.mkdtemp(prefix='studybud-benchmark-'))
+        media = override_settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=media_root / 'uploads')
+        media.enable()
+        old_config = None
+        try:
+            if not options['current_db']:
+                # A throwaway database, created and migrated like the test runner's
+                old_config = setup_databases(self.db_verbosity(options), interactive=False, keepdb=options['keepdb'])
+            # Failures are recorded by status code rather than stopping the run
+            client = Client(raise_request_exception=False)
+            if options['current_db']:
+                results.extend(self.measure(client, Message.objects.count(), options['requests']))
+            else:
+                for scale in scales:
+                    self.grow(scale, options['seed'])
+                    results.extend(self.measure(client, scale, options['requests']))
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, self.db_verbosity(options), keepdb=options['keepdb'])
+            media.disable()
+            shutil.rmtree(media_root, ignore_errors=True)
+            teardown_test_environment()
+
+        report = {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'requests': options['requests'],
+            'results': results,
+        }
+        output = Path(options['output'] or settings.BASE_DIR / 'benchmarks' / f"{commit or 'results'}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def db_verbosity(self, options):
+        return max(0, options['verbosity'] - 1)
+
+    def grow(self, scale, random_seed):
+        """Seed the benchmark database up to ``scale`` messages"""
+        current = {
+            'messages': Message.objects.count(),
+            'users': User.objects.count(),
+            'rooms': Room.objects.count(),
+        }
+        if current['messages'] >= scale:
+            return
+        started = time.monotonic()
+        rooms = max(5, int(scale * ROOMS_PER_MESSAGE)) - current['rooms']
+        importer, _ = seed.seed(
+            users=max(10, max(10, int(scale * USERS_PER_MESSAGE)) - current['users']),
+            topics=TOPICS if not current['rooms'] else 0,
+            rooms=max(0, rooms),
+            participants=max(0, rooms) * PARTICIPANTS_PER_ROOM,
+            messages=scale - current['messages'],
+            attachments=int((scale - current['messages']) * ATTACHMENTS_PER_MESSAGE),
+            random_seed=random_seed + scale,
+        )
+        self.stdout.write(
+            f"Seeded to {scale} messages in {time.monotonic() - started:.1f}s ({importer.rate:.0f} rows/s)"
+        )
+
+    def endpoints(self):
+        """
+        Requests to measure, as (name, method, path, options) tuples
+
+        ``options`` are keyword arguments for the test client's method, or a
+        function returning them for requests that can't simply be repeated.
+        Detail pages use the busiest room and user, where costs show first.
+        """
+        room = Room.objects.order_by('-message_count').only('pk').first()
+        user = User.objects.annotate(message_total=Count('messages')).order_by('-message_total').only('pk').first()
+        word = Message.objects.order_by('-id').values_list('body', flat=True).first()
+        word = (word or 'study').split()[0].lower()
+        prefix = (Topic.objects.order_by('-room_count').values_list('name', flat=True).first() or 'py')[:2]
+        endpoints = [
+            ('home', 'get', reverse('home'), None),
+            ('home search', 'get', f"{reverse('home')}?q={word}", None),
+            ('topicsPage', 'get', reverse('topics'), None),
+            ('activityPage', 'get', reverse('activity'), None),
+            ('api routes', 'get', reverse('api-routes'), None),
+            ('api rooms', 'get', reverse('api-rooms'), None),
+            ('api rooms search', 'get', f"{reverse('api-rooms')}?q={word}", None),
+            ('api topics', 'get', reverse('api-topics'), None),
+            ('api messages', 'get', reverse('api-messages'), None),
+            ('api messages page 100', 'get', f"{reverse('api-messages')}?page_size=100", None),
+            ('api messages search', 'get', f"{reverse('api-messages')}?q={word}", None),
+            ('api activity', 'get', reverse('api-activity'), None),
+            ('api users', 'get', reverse('api-users'), None),
+            ('api trending', 'get', reverse('api-trending'), None),
+            ('api feed', 'get', reverse('api-feed'), None),
+            ('api topic suggestions', 'get', f"{reverse('api-topic-suggestions')}?prefix={prefix}", None),
+            ('api async rooms', 'get', reverse('api-async-rooms'), None),
+            ('api async topics', 'get', reverse('api-async-topics'), None),
+            ('api async messages', 'get', reverse('api-async-messages'), None),
+            ('api async users', 'get', reverse('api-async-users'), None),
+        ]
+        if room is not None:
+            endpoints += [
+                ('room', 'get', reverse('room', args=[room.pk]), None),
+                ('api room', 'get', reverse('api-room', args=[room.pk]), None),
+                ('api room expanded', 'get', f"{reverse('api-room', args=[room.pk])}?expand=participants,messages", None),
+                ('api room participants', 'get', reverse('api-room-participants', args=[room.pk]), None),
+                ('api room messages', 'get', f"{reverse('api-messages')}?room={room.pk}", None),
+                (
+                    'api create message', 'post', reverse('api-create-message', args=[room.pk]),
+                    {'data': {'body': 'Benchmark message'}},
+                ),
+                ('api async room', 'get', reverse('api-async-room', args=[room.pk]), None),
+                (
+                    'api async create message', 'post', reverse('api-async-create-message', args=[room.pk]),
+                    {'data': {'body': 'Benchmark message'}},
+                ),
+            ]
+        if user is not None:
+            endpoints += [
+                ('userProfile', 'get', reverse('user-profile', args=[user.pk]), None),
+                ('api user', 'get', reverse('api-user', args=[user.pk]), None),
+                ('api async user', 'get', reverse('api-async-user', args=[user.pk]), None),
+            ]
+            message = Message.objects.filter(user=user).only('pk', 'user_id').first()
+            if message is not None:
+                endpoints += self.upload_endpoints(user, message)
+        return sorted(endpoints, key=lambda endpoint: endpoint[0]), user
+
+    def upload_endpoints(self, user, message):
+        """Starting uploads, and appending chunks to one that stays open"""
+        upload = uploads.start(user, message, UPLOAD_FILE_NAME, uploads.max_size('document'))
+        offset = [0]
+
+        def chunk():
+            options = {
+                'data': UPLOAD_CHUNK,
+                'content_type': 'application/offset+octet-stream',
+                'headers': {'Upload-Offset': str(offset[0])},
+            }
+            offset[0] += len(UPLOAD_CHUNK)
+            return options
+
+        return [
+            (
+                'api start upload', 'post', reverse('api-uploads'),
+                {
+                    'data': {
+                        'message': message.pk,
+                        'files': [{'file_name': UPLOAD_FILE_NAME, 'size': len(UPLOAD_CHUNK)}],
+                    },
+                    'content_type': 'application/json',
+                },
+            ),
+            ('api upload status', 'get', reverse('api-upload', args=[upload.pk]), None),
+            ('api upload chunk', 'patch', reverse('api-upload', args=[upload.pk]), chunk),
+        ]
+
+    def measure(self, client, scale, requests):
+        endpoints, user = self.endpoints()
+        if user is not None:
+            client.force_login(user)
+        results = []
+        for name, method, path, options in endpoints:
+            method_func = getattr(client, method)
+
+            def send():
+                return method_func(path, **(options() if callable(options) else options or {}))
+
+            # First request with empty caches, then the steady state
+            cache.clear()
+            started = time.perf_counter()
+            response = send()
+            cold = time.perf_counter() - started
+
+            timings = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                send()
+                timings.append(time.perf_counter() - started)
+            with CaptureQueriesContext(connection) as queries:
+                send()
+            timings.sort()
+
+            result = {
+                'scale': scale,
+                'name': name,
+                'method': method.upper(),
+                'path': path,
+                'status': response.status_code,
+                'queries': len(queries),
+                'cold_ms': round(cold * 1000, 3),
+                'p50_ms': round(statistics.median(timings) * 1000, 3),
+                'p90_ms': round(percentile(timings, 0.90) * 1000, 3),
+                'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+                'max_ms': round(timings[-1] * 1000, 3),
+            }
+            results.append(result)
+            self.stdout.write(
+                f"{scale:>8} {name:<24} {result['status']:>3} {result['queries']:>3}q "
+                f"p50 {result['p50_ms']:>8.2f}ms  p90 {result['p90_ms']:>8.2f}ms  "
+                f"p99 {result['p99_ms']:>8.2f}ms  cold {result['cold_ms']:>8.2f}ms"
+            )
+        # Partial files of the uploads measured above
+        for upload in Upload.objects.filter(file_name=UPLOAD_FILE_NAME, attachment__isnull=True):
+            uploads.cancel(upload)
+        return results
+
+    def compare(self, results, baseline_path, threshold):
+        try:
+            baseline = json.loads(Path(baseline_path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can't read {baseline_path}: {e}")
+        previous = {(result['scale'], result['name']): result for result in baseline['results']}
+        self.stdout.write(f"Compared with {baseline.get('commit') or baseline_path}:")
+        regressions = 0
+        for result in results:
+            before = previous.get((result['scale'], result['name']))
+            if before is None:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+            queries = result['queries'] - before['queries']
+            regressed = change > threshold or queries > 0
+            regressions += regressed
+            line = (
+                f"{result['scale']:>8} {result['name']:<24} p50 {change:+7.1f}%  "
+                f"queries {queries:+d}"
+            )
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"{regressions} regression(s)."))
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base import blobs
+from base.storage import BLOB_PREFIX, blob_name, blob_storage
+
+# Suffix Django appends when an upload's name is already taken
+COLLISION_SUFFIX = re.compile(r'^(?P<stem>.+)_[a-zA-Z0-9]{7}$')
+
+SKIP_DIRS = {BLOB_PREFIX, 'renditions'}
+
+
+def read_chunks(path, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Move uploaded files under MEDIA_ROOT into the content-addressed blob store, '
+        'delete byte-identical upload copies and rebuild blob reference counts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would change',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        referenced = self.referenced_names()
+        groups = defaultdict(list)
+        for name in self.legacy_files():
+            groups[self.digest(name)].append(name)
+
+        moved = removed = 0
+        for digest, names in groups.items():
+            keep = [name for name in names if name in referenced]
+            if keep:
+                # Referenced uploads become one blob; other copies are redundant
+                extension = os.path.splitext(keep[0])[1]
+                target = blob_name(digest, extension)
+                if not dry_run:
+                    target = blob_storage.adopt(blob_storage.path(keep[0]), extension)
+                for name in keep:
+                    self.stdout.write(f"{name} -> {target}")
+                    if not dry_run:
+                        self.repoint(name, target)
+                        blob_storage.delete(name)
+                    moved += 1
+
+            # Unreferenced files are left alone (MEDIA_ROOT also holds static
+            # assets) unless they are upload copies of another file
+            redundant = [
+                name for name in names
+                if name not in keep and any(self.is_copy_of(name, other) for other in names)
+            ]
+
+            for name in redundant:
+                self.stdout.write(f"{name}: duplicate, removed")
+                if not dry_run:
+                    blob_storage.delete(name)
+                removed += 1
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"Dry run: {moved} file(s) would move into the blob store, {removed} duplicate(s) would be removed."
+            ))
+            return
+
+        tracked, orphans = blobs.recount()
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} file(s) into the blob store and removed {removed} duplicate(s); "
+            f"{tracked} blob(s) tracked, {orphans} orphan(s) deleted."
+        ))
+
+    def referenced_names(self):
+        names = set()
+        for model_label, fields in blobs.FILE_FIELDS.items():
+            model = apps.get_model(model_label)
+            for field in fields:
+                default = model._meta.get_field(field).get_default()
+                values = model.objects.exclude(**{f'{field}__startswith': f'{BLOB_PREFIX}/'})
+                names.update(
+                    name for name in values.values_list(field, flat=True).distinct()
+                    # The bundled default is shared by new rows and must stay put
+                    if name and name != default
+                )
+        return names
+
+    def legacy_files(self):
+        root = blob_storage.location
+        for directory, subdirs, files in os.walk(root):
+            if directory == root:
+                subdirs[:] = [d for d in subdirs if d not in SKIP_DIRS]
+            for filename in files:
+                yield os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, '/')
+
+    def digest(self, name):
+        digest = hashlib.sha256()
+        for chunk in read_chunks(blob_storage.path(name)):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def repoint(self, name, target):
+        with transaction.atomic():
+            for model_label, fields in blobs.FILE_FIELDS.items():
+                model = apps.get_model(model_label)
+                for field in fields:
+                    # update() skips the signals; recount() fixes the counts afterwards
+                    model.objects.filter(**{field: name}).update(**{field: target})
+
+    def is_copy_of(self, name, original):
+        stem, extension = os.path.splitext(name)
+        match = COLLISION_SUFFIX.match(stem)
+        return bool(match) and match.group('stem') + extension == original
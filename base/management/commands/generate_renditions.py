@@ -0,0 +1,31 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from base import images
+
+
+class Command(BaseCommand):
+    help = 'Generate resized renditions for every uploaded image'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Only process images that have no renditions yet'
+        )
+
+    def handle(self, *args, **options):
+        for key in images.RENDITIONS:
+            model_label, field_name = key.rsplit('.', 1)
+            model = apps.get_model(model_label)
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            if options['missing']:
+                queryset = queryset.filter(renditions={})
+            if model_label == 'base.Attachment':
+                queryset = queryset.filter(file_type='image')
+
+            count = 0
+            for pk in queryset.values_list('pk', flat=True).iterator():
+                images.generate_renditions(model_label, pk, field_name)
+                count += 1
+            self.stdout.write(f"{key}: {count} processed")
+        self.stdout.write(self.style.SUCCESS('Renditions generated.'))
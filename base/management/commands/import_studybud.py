@@ -0,0 +1,54 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base import bulk
+
+
+class Command(BaseCommand):
+    help = 'Import users, topics, rooms, participants and messages from NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File to read ('-' for standard input)")
+        parser.add_argument(
+            '--format',
+            choices=bulk.FORMATS,
+            help='Input format (default: from the file extension, else ndjson)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=bulk.IMPORT_BATCH_SIZE,
+            help=f"Records of one type written per bulk insert (default: {bulk.IMPORT_BATCH_SIZE})",
+        )
+
+    def progress(self, importer):
+        if self.verbosity >= 2:
+            self.stdout.write(f"  {importer.total} rows ({importer.rate:.0f} rows/s)")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        source = options['input']
+        fmt = options['format'] or ('csv' if source.endswith('.csv') else 'ndjson')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        stream = sys.stdin if source == '-' else open(source, encoding='utf-8', newline='')
+        try:
+            importer = bulk.import_records(
+                bulk.READERS[fmt](stream), batch_size=options['batch_size'], progress=self.progress
+            )
+        except bulk.RecordError as e:
+            raise CommandError(f"Import stopped: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in importer.errors:
+            self.stderr.write(f"Skipped {error}")
+        summary = ', '.join(f"{importer.counts[record_type]} {record_type}s" for record_type in bulk.RECORD_TYPES)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary} ({importer.rate:.0f} rows/s)."
+        ))
+        if importer.skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {sum(importer.skipped.values())} record(s)."))
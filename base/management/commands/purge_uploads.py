@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from base import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions that have been idle too long'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            help='Idle time after which a session is deleted (default: UPLOAD_EXPIRY_HOURS)',
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        count = uploads.purge_expired(max_age)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} upload session(s)."))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base import autocomplete
+from base.counters import find_drift, recount_rooms, recount_topics
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized room and topic counters and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift; exit with status 1 if any counter is wrong',
+        )
+
+    def handle(self, *args, **options):
+        drift = find_drift()
+        for model_name, pk, field, stored, actual in drift:
+            self.stdout.write(f"{model_name} {pk}: {field} is {stored}, expected {actual}")
+
+        if options['check']:
+            if drift:
+                self.stderr.write(self.style.ERROR(f"{len(drift)} counter(s) have drifted."))
+                raise SystemExit(1)
+            self.stdout.write(self.style.SUCCESS('All counters are consistent.'))
+            return
+
+        with transaction.atomic():
+            rooms = recount_rooms()
+            topics = recount_topics()
+        # Suggestions are ranked by the topic room counts
+        autocomplete.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt counters for {rooms} room(s) and {topics} topic(s); fixed {len(drift)} drifted value(s)."
+        ))
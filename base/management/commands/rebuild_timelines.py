@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base import timelines
+
+
+class Command(BaseCommand):
+    help = 'Recreate every personal home timeline from room membership and messages'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = timelines.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} timeline entries in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base import trending
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute trending room and topic scores from recent rooms and messages; run after '
+        'changing TRENDING_HALF_LIFE_HOURS or writing rows without signals'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scored = trending.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {scored} room(s) and topic(s) in {time.monotonic() - started:.1f}s."
+        ))
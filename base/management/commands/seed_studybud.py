@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base import bulk, seed
+
+
+class Command(BaseCommand):
+    help = 'Add synthetic users, topics, rooms, participants, messages and attachments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Users to add (default: 50)')
+        parser.add_argument('--topics', type=int, default=12, help='Topics to add (default: 12)')
+        parser.add_argument('--rooms', type=int, default=40, help='Rooms to add (default: 40)')
+        parser.add_argument('--messages', type=int, default=1000, help='Messages to add (default: 1000)')
+        parser.add_argument(
+            '--participants', type=int, default=300,
+            help='Room memberships to draw (default: 300)',
+        )
+        parser.add_argument('--attachments', type=int, default=50, help='Attachments to add (default: 50)')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Zipf exponent of room and user activity; higher is more skewed (default: 1.1)',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Days of history to spread messages over in an empty database (default: 365)',
+        )
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible data')
+        parser.add_argument(
+            '--batch-size', type=int, default=bulk.IMPORT_BATCH_SIZE,
+            help=f"Rows per bulk insert (default: {bulk.IMPORT_BATCH_SIZE})",
+        )
+
+    def progress(self, importer):
+        if self.verbosity >= 2:
+            self.stdout.write(f"  {importer.total} rows ({importer.rate:.0f} rows/s)")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        counts = ['users', 'topics', 'rooms', 'messages', 'participants', 'attachments']
+        if any(options[name] < 0 for name in counts) or options['batch_size'] < 1:
+            raise CommandError('Counts must not be negative and --batch-size must be positive')
+
+        importer, attachments = seed.seed(
+            **{name: options[name] for name in counts},
+            exponent=options['zipf'], days=options['days'], random_seed=options['seed'],
+            batch_size=options['batch_size'], progress=self.progress,
+        )
+        summary = ', '.join(f"{importer.counts[record_type]} {record_type}s" for record_type in bulk.RECORD_TYPES)
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {summary}, {attachments} attachments ({importer.rate:.0f} rows/s)."
+        ))
@@ -0,0 +1,189 @@
+"""
+Serving uploaded media.
+
+``serve_media`` replaces ``django.views.static.serve`` for ``MEDIA_URL``. It
+answers conditional requests (ETag/If-None-Match, Last-Modified/
+If-Modified-Since), single byte ranges (so audio and video attachments can
+seek) and marks content-addressed paths as immutable so browsers never
+revalidate them.
+
+With ``MEDIA_SENDFILE`` set, the response body is left to the front-end
+server instead of a Python worker:
+
+    'x-sendfile'        X-Sendfile: <absolute path> (Apache, lighttpd)
+    'x-accel-redirect'  X-Accel-Redirect: MEDIA_ACCEL_REDIRECT_PREFIX + quoted path (nginx)
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .query_budget import query_budget
+from .storage import BLOB_PREFIX
+
+READ_SIZE = 64 * 1024
+
+# Names under these prefixes change whenever their content does
+IMMUTABLE_PREFIXES = (f"{BLOB_PREFIX}/", 'renditions/')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def etag_for(path, stat):
+    if path.startswith(f"{BLOB_PREFIX}/"):
+        # Blob names are the SHA-256 of their content
+        return quote_etag(os.path.splitext(os.path.basename(path))[0])
+    return quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+
+
+def is_fresh(request, etag, last_modified):
+    """Whether the client's cached copy is current (RFC 9110 section 13.2.2)"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since'))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``Range: bytes=...`` header
+
+    Returns:
+        Tuple of (start, end) inclusive, None to serve the whole file (no
+        header, or a multi-range request), or False if unsatisfiable
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def content_type_for(path):
+    content_type, encoding = mimetypes.guess_type(path)
+    if content_type is None or encoding:
+        # Compressed files are served as they are stored
+        return 'application/octet-stream'
+    return content_type
+
+
+def sendfile_response(path, name, content_type):
+    backend = getattr(settings, 'MEDIA_SENDFILE', None)
+    if not backend:
+        return None
+    response = HttpResponse(content_type=content_type)
+    if backend == 'x-sendfile':
+        response['X-Sendfile'] = path
+    elif backend == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        # nginx decodes the URI; raw spaces, ? or # would break it
+        response['X-Accel-Redirect'] = prefix + quote(name)
+    else:
+        raise ValueError(f"Unknown MEDIA_SENDFILE backend '{backend}'")
+    # The front-end server answers range requests itself
+    return response
+
+
+def file_response(request, full_path, size, content_type, etag, last_modified):
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range and if_range != etag and parse_http_date_safe(if_range) != int(last_modified):
+        # The client's partial copy is stale; send everything
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            read_range(full_path, start, length), status=206, content_type=content_type
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+@query_budget(0)
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT
+
+    Args:
+        path: Path relative to MEDIA_ROOT
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    name = path.replace(os.sep, '/')
+    etag = etag_for(name, stat)
+    last_modified = stat.st_mtime
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            IMMUTABLE_CACHE_CONTROL if name.startswith(IMMUTABLE_PREFIXES)
+            else f"public, max-age={getattr(settings, 'MEDIA_CACHE_SECONDS', 3600)}"
+        ),
+        'X-Content-Type-Options': 'nosniff',
+    }
+
+    if is_fresh(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        content_type = content_type_for(full_path)
+        response = sendfile_response(full_path, name, content_type)
+        if response is None:
+            response = file_response(request, full_path, stat.st_size, content_type, etag, last_modified)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
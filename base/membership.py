@@ -0,0 +1,130 @@
+"""
+Room membership.
+
+Every message post, join and leave needs to know whether the user already
+belongs to the room. Asking ``room.participants.add()`` costs a SELECT plus
+an INSERT attempt each time, so membership is looked up directly instead:
+with a shared cache (``base.caches``) from a small entry per room and user,
+otherwise with an indexed ``exists()`` query on the participant table.
+Repeated joins and leaves are answered without writing, and only real
+changes reach the m2m manager. Batch changes ask the database about just
+the users involved.
+
+``base.signals`` drops the entries of every room and user pair whose link
+changes (``m2m_changed``) and a bulk import drops those it adds, once right
+away and again after the change commits. Only a shared cache carries that
+to every worker, which is why a process-local one is never used: a stale
+entry could turn a join or leave into a no-op. Room and user IDs aren't
+reused, so deleting either leaves nothing to drop.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import caches
+from .models import Room, User
+
+MEMBERSHIP_CACHE_TIMEOUT = getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 300)
+
+Participant = Room.participants.through
+
+
+def _member_key(room_id, user_id):
+    return f"room-member:{room_id}:{user_id}"
+
+
+def _exists(room_id, user_id):
+    return Participant.objects.filter(room_id=room_id, user_id=user_id).exists()
+
+
+def is_member(room_id, user_id):
+    if not caches.is_shared():
+        return _exists(room_id, user_id)
+    key = _member_key(room_id, user_id)
+    member = cache.get(key)
+    if member is None:
+        member = _exists(room_id, user_id)
+        cache.set(key, member, MEMBERSHIP_CACHE_TIMEOUT)
+    return member
+
+
+def forget(pairs):
+    """
+    Drop the cached membership of ``(room_id, user_id)`` pairs that changed
+
+    The entries are dropped again on commit, in case a concurrent request
+    cached them as they were before the change.
+    """
+    keys = [_member_key(room_id, user_id) for room_id, user_id in pairs]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _members_among(room, user_ids):
+    return set(Participant.objects.filter(room_id=room.pk, user_id__in=user_ids).values_list('user_id', flat=True))
+
+
+def join(room, user):
+    """
+    Add a user to a room unless they already belong to it
+
+    Returns:
+        Whether the user was added
+    """
+    if is_member(room.pk, user.pk):
+        return False
+    room.participants.add(user)
+    return True
+
+
+def leave(room, user):
+    """
+    Remove a user from a room if they belong to it
+
+    Returns:
+        Whether the user was removed
+    """
+    if not is_member(room.pk, user.pk):
+        return False
+    room.participants.remove(user)
+    return True
+
+
+def add_members(room, user_ids):
+    """
+    Enroll many users at once, e.g. a whole class
+
+    Args:
+        room: Room instance
+        user_ids: IDs of the users to add; members and unknown IDs are skipped
+
+    Returns:
+        Number of users added
+    """
+    new = set(user_ids)
+    new -= _members_among(room, new)
+    if not new:
+        return 0
+    new = list(User.objects.filter(pk__in=new).values_list('pk', flat=True))
+    if new:
+        room.participants.add(*new)
+    return len(new)
+
+
+def remove_members(room, user_ids):
+    """
+    Remove many users at once
+
+    Args:
+        room: Room instance
+        user_ids: IDs of the users to remove; non-members are skipped
+
+    Returns:
+        Number of users removed
+    """
+    gone = list(_members_among(room, set(user_ids)))
+    if gone:
+        room.participants.remove(*gone)
+    return len(gone)
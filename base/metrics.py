@@ -0,0 +1,314 @@
+"""
+Per-request performance metrics.
+
+``MetricsMiddleware`` times every request and records, per route:
+
+- a latency histogram and a request counter by status code
+- the number of SQL queries and the time spent in them
+- template render time (through ``InstrumentedDjangoTemplates``)
+
+``base.fragments`` adds fragment cache hits and misses. Everything is
+exported in the Prometheus text format on ``/metrics``. Routes are labelled
+by URL pattern (``/room/<str:pk>/``), not path, and methods outside the
+standard few as ``OTHER``, so the number of series stays bounded.
+
+Recording costs a few ``perf_counter`` calls and dictionary updates per
+request, cheap enough to leave on. Requests slower than
+``METRICS_SLOW_REQUEST_SECONDS`` are logged, with their SQL, for a sampled
+``METRICS_SLOW_REQUEST_SAMPLE_RATE`` fraction of them.
+
+Metrics are kept per process. With several workers, each one reports its
+own totals; scrape every worker or aggregate them in Prometheus.
+"""
+import bisect
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+
+from .query_budget import QueryCounter
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; chosen around the latencies of page and API requests
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+# Any other method, which clients can make up, is labelled OTHER_METHOD
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+OTHER_METHOD = 'OTHER'
+
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with _lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self.values.get(labels)
+            if state is None:
+                # Per-bucket counts, with +Inf last, and the sum
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with _lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+REQUEST_DURATION = Histogram(
+    'studybud_request_duration_seconds', 'Time to produce a response', ('route', 'method'), LATENCY_BUCKETS
+)
+REQUESTS = Counter('studybud_requests_total', 'Responses sent', ('route', 'method', 'status'))
+DB_QUERIES = Histogram(
+    'studybud_db_queries_per_request', 'SQL queries issued per request', ('route', 'method'), QUERY_BUCKETS
+)
+DB_DURATION = Counter(
+    'studybud_db_query_seconds_total', 'Time spent executing SQL queries', ('route', 'method')
+)
+TEMPLATE_DURATION = Histogram(
+    'studybud_template_render_seconds', 'Time to render a template, including queries it triggers',
+    ('template',), LATENCY_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    'studybud_cache_lookups_total', 'Fragment cache lookups by result', ('fragment', 'result')
+)
+
+METRICS = [REQUEST_DURATION, REQUESTS, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION, CACHE_LOOKUPS]
+
+
+def export():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        for metric in METRICS:
+            metric.values.clear()
+
+
+def record_cache_lookup(fragment, hit):
+    CACHE_LOOKUPS.inc((fragment, 'hit' if hit else 'miss'))
+
+
+# Timings of the request being handled, if any
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.template_seconds = 0.0
+        self.templates = []
+        self.render_depth = 0
+
+
+class InstrumentedTemplate:
+    """Wraps a Django template to time its renders"""
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        current = _current.get()
+        if current is not None:
+            current.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            elapsed = time.perf_counter() - started
+            name = self.template.origin.template_name or '<string>'
+            TEMPLATE_DURATION.observe((name,), elapsed)
+            if current is not None:
+                current.render_depth -= 1
+                # Templates rendered from within another are already timed
+                if not current.render_depth:
+                    current.template_seconds += elapsed
+                    current.templates.append(name)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render times recorded as metrics"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
+
+
+class MetricsMiddleware:
+    """
+    Record latency, query and template metrics for every request
+
+    Place it before ``QueryBudgetMiddleware``, which then reuses its query
+    counter instead of installing a second one.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.slow_seconds = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', None)
+        self.sample_rate = getattr(settings, 'METRICS_SLOW_REQUEST_SAMPLE_RATE', 1.0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        current = RequestMetrics()
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            with QueryCounter() as counter:
+                request.query_counter = counter
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, time.perf_counter() - started, counter, current)
+
+    async def __acall__(self, request):
+        current = RequestMetrics()
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            async with QueryCounter() as counter:
+                request.query_counter = counter
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, time.perf_counter() - started, counter, current)
+
+    def record(self, request, response, elapsed, counter, current):
+        match = request.resolver_match
+        route = f"/{match.route}" if match is not None else UNMATCHED_ROUTE
+        labels = (route, request.method if request.method in METHODS else OTHER_METHOD)
+        REQUEST_DURATION.observe(labels, elapsed)
+        REQUESTS.inc((*labels, str(response.status_code)))
+        DB_QUERIES.observe(labels, counter.count)
+        DB_DURATION.inc(labels, counter.duration)
+
+        if self.slow_seconds is not None and elapsed >= self.slow_seconds and random.random() < self.sample_rate:
+            self.log_slow_request(request, response, elapsed, counter, current)
+        return response
+
+    def log_slow_request(self, request, response, elapsed, counter, current):
+        statements = '\n'.join(f"  {sql}" for sql in counter.sql)
+        if counter.count > len(counter.sql):
+            statements += f"\n  ... and {counter.count - len(counter.sql)} more"
+        logger.warning(
+            f"Slow request: {request.method} {request.get_full_path()} -> {response.status_code} "
+            f"in {elapsed * 1000:.0f}ms; {counter.count} queries in {counter.duration * 1000:.0f}ms, "
+            f"templates {', '.join(current.templates) or 'none'} in {current.template_seconds * 1000:.0f}ms:\n"
+            f"{statements}"
+        )
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Export metrics for Prometheus
+
+    Route names, latencies and SQL timings aren't public. Scrapers send
+    ``METRICS_TOKEN`` as a bearer token or connect from one of
+    ``METRICS_ALLOWED_IPS``; signed-in staff may also look, and anyone can
+    while ``DEBUG`` is on.
+    """
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(export(), content_type=CONTENT_TYPE)
+
+
+def _may_scrape(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and constant_time_compare(credentials, token):
+            return True
+    if settings.DEBUG or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
@@ -0,0 +1,220 @@
+import logging
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+
+from .db_routers import set_replica_reads
+from .media import IMMUTABLE_CACHE_CONTROL, content_type_for, etag_for, is_fresh
+from .query_budget import QueryBudgetExceeded, QueryCounter, check_budget
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReadYourWritesMiddleware:
+    """
+    Send replica-safe views to read replicas, except right after a write.
+
+    Any unsafe request (a message post, a room edit, a login) sets a short
+    lived cookie; while it is present every read goes to the primary, so
+    users always see their own writes despite replication lag.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, 'REPLICA_PIN_COOKIE', 'studybud_primary')
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            # Worker threads are reused across requests
+            set_replica_reads(False)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            set_replica_reads(False)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            getattr(view_func, 'replica_reads', False)
+            and request.method in SAFE_METHODS
+            and self.cookie_name not in request.COOKIES
+        ):
+            set_replica_reads(True)
+
+
+class QueryBudgetMiddleware:
+    """Enforce the query budgets declared with ``base.query_budget.query_budget``"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if getattr(settings, 'QUERY_BUDGET_MODE', 'log') == 'off':
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.query_budget = None
+        counter = getattr(request, 'query_counter', None)
+        if counter is not None:
+            # MetricsMiddleware is already counting this request's queries
+            response = self.get_response(request)
+        else:
+            with QueryCounter() as counter:
+                response = self.get_response(request)
+        return self.check(request, counter, response)
+
+    async def __acall__(self, request):
+        request.query_budget = None
+        counter = getattr(request, 'query_counter', None)
+        if counter is not None:
+            response = await self.get_response(request)
+        else:
+            async with QueryCounter() as counter:
+                response = await self.get_response(request)
+        return self.check(request, counter, response)
+
+    def check(self, request, counter, response):
+        error = check_budget(f"{request.method} {request.path}", counter, request.query_budget)
+        if error:
+            # Read per request so tests can switch it with override_settings
+            if getattr(settings, 'QUERY_BUDGET_MODE', 'log') == 'raise':
+                raise QueryBudgetExceeded(error)
+            logger.warning(error)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
+
+
+def accepted_encodings(header):
+    """Content codings a client accepts, ignoring those with q=0"""
+    encodings = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        name, _, value = params.partition('=')
+        try:
+            if name.strip().lower() == 'q' and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+class StaticFilesMiddleware:
+    """
+    Serve collected static files without a front-end server.
+
+    Files are looked up in STATIC_ROOT. When the client accepts it, the
+    precompressed ``.br`` or ``.gz`` sibling written by
+    ``base.staticfiles.CompressedManifestStaticFilesStorage`` is sent
+    instead of the original. Content-hashed names from the manifest are
+    cached as immutable; anything else is revalidated after a minute.
+    """
+
+    ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.root = str(settings.STATIC_ROOT)
+        self.prefix = settings.STATIC_URL
+        self.max_age = getattr(settings, 'STATIC_CACHE_SECONDS', 60)
+        self._hashed_names = None
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @property
+    def hashed_names(self):
+        if self._hashed_names is None:
+            hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+            self._hashed_names = set(hashed_files.values())
+        return self._hashed_names
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            # File system calls; keep them off the event loop
+            response = await sync_to_async(self.serve)(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        served_path, encoding = path, None
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding'))
+        for coding, suffix in self.ENCODINGS:
+            if coding in accepted and os.path.isfile(path + suffix):
+                served_path, encoding = path + suffix, coding
+                break
+
+        stat = os.stat(served_path)
+        etag = etag_for(name, stat)
+        if is_fresh(request, etag, stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(served_path, 'rb'), content_type=content_type_for(path))
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Vary'] = 'Accept-Encoding'
+        response['X-Content-Type-Options'] = 'nosniff'
+        response['Cache-Control'] = (
+            IMMUTABLE_CACHE_CONTROL if name in self.hashed_names
+            else f"public, max-age={self.max_age}"
+        )
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_alter_attachment_options_alter_message_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'created', 'id'], name='message_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created', 'id'], name='message_created_idx'),
+        ),
+    ]
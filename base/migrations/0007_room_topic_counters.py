@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Room = apps.get_model('base', 'Room')
+    Topic = apps.get_model('base', 'Topic')
+    Message = apps.get_model('base', 'Message')
+
+    def count_of(queryset, field):
+        return Coalesce(
+            Subquery(queryset.order_by().values(field).annotate(n=Count('*')).values('n'),
+                     output_field=IntegerField()),
+            Value(0)
+        )
+
+    messages = Message.objects.filter(room_id=OuterRef('pk'))
+    Room.objects.update(
+        participant_count=count_of(Room.participants.through.objects.filter(room_id=OuterRef('pk')), 'room_id'),
+        message_count=count_of(messages, 'room_id'),
+        last_message_at=Subquery(
+            messages.order_by().values('room_id').annotate(last=Max('created')).values('last')
+        )
+    )
+    Topic.objects.update(room_count=count_of(Room.objects.filter(topic_id=OuterRef('pk')), 'topic_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_message_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='room_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['-room_count', 'name'], name='topic_room_count_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+SQLITE_SQL = [
+    "CREATE VIRTUAL TABLE base_search_index USING fts5("
+    "title, body, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO base_search_index (rowid, title, body) "
+    "SELECT r.id * 4 + 1, r.name, COALESCE(r.description, '') || ' ' || COALESCE(t.name, '') "
+    "FROM base_room r LEFT JOIN base_topic t ON t.id = r.topic_id",
+    "INSERT INTO base_search_index (rowid, title, body) SELECT id * 4 + 2, name, '' FROM base_topic",
+    "INSERT INTO base_search_index (rowid, title, body) SELECT id * 4 + 3, '', body FROM base_message",
+]
+
+POSTGRES_SQL = [
+    "CREATE TABLE base_search_index ("
+    "kind varchar(16) NOT NULL, "
+    "object_id bigint NOT NULL, "
+    "title text NOT NULL DEFAULT '', "
+    "body text NOT NULL DEFAULT '', "
+    "document tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')"
+    ") STORED, "
+    "PRIMARY KEY (kind, object_id))",
+    "CREATE INDEX base_search_index_document_idx ON base_search_index USING GIN (document)",
+    "INSERT INTO base_search_index (kind, object_id, title, body) "
+    "SELECT 'room', r.id, r.name, COALESCE(r.description, '') || ' ' || COALESCE(t.name, '') "
+    "FROM base_room r LEFT JOIN base_topic t ON t.id = r.topic_id",
+    "INSERT INTO base_search_index (kind, object_id, title, body) SELECT 'topic', id, name, '' FROM base_topic",
+    "INSERT INTO base_search_index (kind, object_id, title, body) SELECT 'message', id, '', body FROM base_message",
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {
+        'sqlite': SQLITE_SQL,
+        'postgresql': POSTGRES_SQL,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS base_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_room_topic_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
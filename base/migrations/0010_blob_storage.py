@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:56
+
+import base.models
+import base.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Blob',
+                'verbose_name_plural': 'Blobs',
+                'db_table': 'base_blob',
+            },
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(storage=base.storage.ContentAddressedStorage(), upload_to=base.models.message_attachment_path),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='document',
+            field=models.FileField(blank=True, help_text='Document attachment (PDF, DOC, etc.)', null=True, storage=base.storage.ContentAddressedStorage(), upload_to=base.models.message_attachment_path),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Image attachment', null=True, storage=base.storage.ContentAddressedStorage(), upload_to=base.models.message_attachment_path),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='room_image',
+            field=models.ImageField(blank=True, help_text='Room banner or thumbnail image', null=True, storage=base.storage.ContentAddressedStorage(), upload_to=base.models.room_media_path),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, default='avatar.svg', null=True, storage=base.storage.ContentAddressedStorage(), upload_to=base.models.user_avatar_path),
+        ),
+    ]
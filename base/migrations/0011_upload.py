@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:58
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_type', models.CharField(choices=[('image', 'Image'), ('document', 'Document'), ('video', 'Video'), ('audio', 'Audio')], max_length=20)),
+                ('size', models.PositiveBigIntegerField(help_text='Declared file size in bytes')),
+                ('offset', models.PositiveBigIntegerField(default=0, help_text='Bytes received so far')),
+                ('checksum', models.CharField(blank=True, help_text='SHA-256 of the whole file', max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('attachment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='base.attachment')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='base.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Upload',
+                'verbose_name_plural': 'Uploads',
+                'db_table': 'base_upload',
+                'ordering': ['created'],
+            },
+        ),
+    ]
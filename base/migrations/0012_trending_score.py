@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Room'), (2, 'Topic')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'Trending score',
+                'verbose_name_plural': 'Trending scores',
+                'db_table': 'base_trending_score',
+                'indexes': [models.Index(fields=['kind', '-score'], name='trending_score_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='trending_score_object_uniq')],
+            },
+        ),
+    ]
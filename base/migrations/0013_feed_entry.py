@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_timelines(apps, schema_editor):
+    Room = apps.get_model('base', 'Room')
+    Message = apps.get_model('base', 'Message')
+    FeedEntry = apps.get_model('base', 'FeedEntry')
+
+    latest = Message.objects.filter(room_id=OuterRef('pk')).order_by('-created', '-id')
+    activity = {
+        pk: (latest_id, activity_at)
+        for pk, latest_id, activity_at in Room.objects.annotate(
+            latest_id=Subquery(latest.values('id')[:1]),
+            activity_at=Coalesce(Subquery(latest.values('created')[:1]), 'created'),
+        ).values_list('pk', 'latest_id', 'activity_at').iterator()
+    }
+    members = set(Room.participants.through.objects.values_list('room_id', 'user_id'))
+    members.update(Room.objects.filter(host__isnull=False).values_list('pk', 'host_id'))
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, room_id=room_id, message_id=activity[room_id][0],
+                   activity_at=activity[room_id][1])
+         for room_id, user_id in members],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_at', models.DateTimeField()),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='base.message')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='base.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Feed entry',
+                'verbose_name_plural': 'Feed entries',
+                'db_table': 'base_feed_entry',
+                'indexes': [models.Index(fields=['user', '-activity_at', '-id'], name='feed_entry_timeline_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'room'), name='feed_entry_user_room_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,167 @@
+"""
+Conservative CSS and JavaScript minifiers used by the static pipeline.
+
+Both work on a small tokenizer that understands strings, comments and (for
+JavaScript) template and regular expression literals, so they never touch
+the inside of a literal. They only drop comments and redundant whitespace;
+JavaScript keeps its line breaks so automatic semicolon insertion behaves
+exactly as in the source.
+"""
+import re
+
+IDENTIFIER = re.compile(r'[\w$\\]')
+
+# Characters around which CSS never needs whitespace. ':' is excluded because
+# "a :hover" and "a:hover" are different selectors.
+CSS_PUNCTUATION = set('{};,>')
+
+# Tokens after which a '/' starts a regular expression rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else'}
+
+
+def _scan_string(text, i):
+    """Index just past the quoted literal starting at ``text[i]``"""
+    quote = text[i]
+    i += 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == quote:
+            return i + 1
+        if quote == '`' and text.startswith('${', i):
+            i = _scan_template_expression(text, i + 2)
+            continue
+        i += 1
+    return i
+
+
+def _scan_template_expression(text, i):
+    depth = 1
+    while i < len(text) and depth:
+        char = text[i]
+        if char in '\'"`':
+            i = _scan_string(text, i)
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        i += 1
+    return i
+
+
+def _scan_regex(text, i):
+    in_class = False
+    i += 1
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            return i
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            while i < len(text) and IDENTIFIER.match(text[i]):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _tokens(text, regex=False):
+    """
+    Split source into literals, whitespace runs and other characters
+
+    Yields:
+        Tuples of (kind, text) where kind is 'literal', 'space' or 'code'.
+        Comments are dropped; a comment spanning lines becomes a newline.
+    """
+    i = 0
+    last = ''
+    while i < len(text):
+        char = text[i]
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = len(text) if end == -1 else end + 2
+            yield 'space', '\n' if '\n' in text[i:end] else ' '
+            i = end
+        elif regex and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = len(text) if end == -1 else end
+        elif char in '\'"' or (regex and char == '`'):
+            end = _scan_string(text, i)
+            yield 'literal', text[i:end]
+            last = text[end - 1]
+            i = end
+        elif regex and char == '/' and (not last or last in REGEX_PRECEDERS or _ends_with_keyword(text, i)):
+            end = _scan_regex(text, i)
+            yield 'literal', text[i:end]
+            last = text[end - 1]
+            i = end
+        elif char.isspace():
+            end = i
+            while end < len(text) and text[end].isspace():
+                end += 1
+            yield 'space', text[i:end]
+            i = end
+        else:
+            yield 'code', char
+            last = char
+            i += 1
+
+
+def _ends_with_keyword(text, i):
+    match = re.search(r'(\w+)\s*$', text[max(0, i - 12):i])
+    return bool(match) and match.group(1) in REGEX_KEYWORDS
+
+
+def _needs_space(before, after):
+    if not before or not after:
+        return False
+    if IDENTIFIER.match(before) and IDENTIFIER.match(after):
+        return True
+    # Keep "a + +b", "a - -b" and friends apart
+    return before in '+-' and after in '+-'
+
+
+def minify_css(text):
+    out = []
+    pending = False
+    for kind, value in _tokens(text):
+        if kind == 'space':
+            pending = True
+            continue
+        if pending and out:
+            previous = out[-1][-1]
+            if previous not in CSS_PUNCTUATION and previous != ':' and value[0] not in CSS_PUNCTUATION:
+                out.append(' ')
+        pending = False
+        if value == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(value)
+    return ''.join(out).strip()
+
+
+def minify_js(text):
+    out = []
+    pending = None
+    for kind, value in _tokens(text, regex=True):
+        if kind == 'space':
+            pending = '\n' if '\n' in value or pending == '\n' else ' '
+            continue
+        if pending and out:
+            if pending == '\n':
+                if out[-1] != '\n':
+                    out.append('\n')
+            elif _needs_space(out[-1][-1], value[0]):
+                out.append(' ')
+        pending = None
+        out.append(value)
+    return ''.join(out).strip() + '\n'
@@ -1,8 +1,12 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from pathlib import Path
 
+from .storage import blob_storage
+
 
 def message_attachment_path(instance, filename):
     """
@@ -49,11 +53,39 @@ def user_avatar_path(instance, filename):
     return Path('avatars') / timezone.now().strftime('%Y') / timezone.now().strftime('%m') / filename
 
 
-class User(AbstractUser):
+class MaintainedFieldsMixin:
+    """
+    Keep fields maintained outside of ``save()`` out of ordinary saves
+
+    A full save writes every column back, so an instance loaded before a
+    counter was bumped with F() or renditions were written in the
+    background would undo those writes. Saving an existing row updates all
+    other loaded fields; ``maintained_fields`` are only written when named
+    in ``update_fields`` (inserts write everything).
+    """
+    maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.maintained_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(MaintainedFieldsMixin, AbstractUser):
     name = models.CharField(max_length=200, null=True, blank=True)
     email = models.EmailField(unique=True, null=True)
     bio = models.TextField(null=True, blank=True)
-    avatar = models.ImageField(null=True, blank=True, default="avatar.svg", upload_to=user_avatar_path)
+    avatar = models.ImageField(null=True, blank=True, default="avatar.svg", upload_to=user_avatar_path,
+                               storage=blob_storage)
+    # Resized copies of avatar, maintained by base.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    maintained_fields = ('renditions',)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -67,31 +99,46 @@ class User(AbstractUser):
         return self.email or self.username
 
 
-class Topic(models.Model):
+class Topic(MaintainedFieldsMixin, models.Model):
     name = models.CharField(max_length=200, unique=True)
+    # Denormalized counter, maintained by base.signals
+    room_count = models.PositiveIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
 
+    maintained_fields = ('room_count',)
+
     class Meta:
         db_table = 'base_topic'
         verbose_name = 'Topic'
         verbose_name_plural = 'Topics'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['-room_count', 'name'], name='topic_room_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Room(models.Model):
+class Room(MaintainedFieldsMixin, models.Model):
     host = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='hosted_rooms')
     topic = models.ForeignKey(Topic, on_delete=models.SET_NULL, null=True, related_name='rooms')
     name = models.CharField(max_length=200)
     description = models.TextField(null=True, blank=True)
     participants = models.ManyToManyField(User, related_name='participated_rooms', blank=True)
-    room_image = models.ImageField(null=True, blank=True, upload_to=room_media_path, 
+    room_image = models.ImageField(null=True, blank=True, upload_to=room_media_path, storage=blob_storage,
                                   help_text='Room banner or thumbnail image')
+    # Resized copies of room_image, maintained by base.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Denormalized counters, maintained by base.signals
+    participant_count = models.PositiveIntegerField(default=0, editable=False)
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
 
+    maintained_fields = ('renditions', 'participant_count', 'message_count', 'last_message_at')
+
     class Meta:
         db_table = 'base_room'
         verbose_name = 'Room'
@@ -101,27 +148,32 @@ class Room(models.Model):
     def __str__(self):
         return self.name
 
-    @property
-    def participant_count(self):
-        return self.participants.count()
-
 
-class Message(models.Model):
+class Message(MaintainedFieldsMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
     body = models.TextField()
-    image = models.ImageField(null=True, blank=True, upload_to=message_attachment_path, 
+    image = models.ImageField(null=True, blank=True, upload_to=message_attachment_path, storage=blob_storage,
                              help_text='Image attachment')
-    document = models.FileField(null=True, blank=True, upload_to=message_attachment_path, 
+    document = models.FileField(null=True, blank=True, upload_to=message_attachment_path, storage=blob_storage,
                                help_text='Document attachment (PDF, DOC, etc.)')
+    # Resized copies of image, maintained by base.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
 
+    maintained_fields = ('renditions',)
+
     class Meta:
         db_table = 'base_message'
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['-updated', '-created']
+        indexes = [
+            # Keyset pagination of a room's history and of the global feed
+            models.Index(fields=['room', 'created', 'id'], name='message_room_created_idx'),
+            models.Index(fields=['created', 'id'], name='message_created_idx'),
+        ]
 
     def __str__(self):
         return self.body[:50] + ('...' if len(self.body) > 50 else '')
@@ -131,7 +183,7 @@ class Message(models.Model):
         return bool(self.image or self.document)
 
 
-class Attachment(models.Model):
+class Attachment(MaintainedFieldsMixin, models.Model):
     FILE_TYPE_CHOICES = [
         ('image', 'Image'),
         ('document', 'Document'),
@@ -140,12 +192,16 @@ class Attachment(models.Model):
     ]
     
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to=message_attachment_path)
+    file = models.FileField(upload_to=message_attachment_path, storage=blob_storage)
     file_type = models.CharField(max_length=20, choices=FILE_TYPE_CHOICES)
     file_name = models.CharField(max_length=255)
     file_size = models.PositiveIntegerField(help_text='File size in bytes')
+    # Resized copies of image files, maintained by base.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    maintained_fields = ('renditions',)
+
     class Meta:
         db_table = 'base_attachment'
         verbose_name = 'Attachment'
@@ -153,4 +209,103 @@ class Attachment(models.Model):
         ordering = ['uploaded_at']
 
     def __str__(self):
-        return f"{self.file_name} ({self.get_file_type_display()})"
\ No newline at end of file
+        return f"{self.file_name} ({self.get_file_type_display()})"
+
+
+class Blob(models.Model):
+    """A content-addressed media file and the number of rows referencing it"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    # Maintained by base.signals; rebuilt by ``manage.py dedupe_media``
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'base_blob'
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
+
+    def __str__(self):
+        return self.name
+
+
+class Upload(models.Model):
+    """An attachment being uploaded in chunks, see base.uploads"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='uploads')
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=20, choices=Attachment.FILE_TYPE_CHOICES)
+    size = models.PositiveBigIntegerField(help_text='Declared file size in bytes')
+    offset = models.PositiveBigIntegerField(default=0, help_text='Bytes received so far')
+    checksum = models.CharField(max_length=64, blank=True, help_text='SHA-256 of the whole file')
+    attachment = models.OneToOneField(Attachment, on_delete=models.SET_NULL, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'base_upload'
+        verbose_name = 'Upload'
+        verbose_name_plural = 'Uploads'
+        ordering = ['created']
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.size})"
+
+
+class TrendingScore(models.Model):
+    """
+    Time-decayed activity of one room or topic, see base.trending
+
+    ``score`` holds log(sum of weight * e^(rate * t)) over the times ``t`` of
+    the activity, which only changes when there's new activity; ordering by
+    it is ordering by current decayed activity.
+    """
+    ROOM = 1
+    TOPIC = 2
+    KIND_CHOICES = [
+        (ROOM, 'Room'),
+        (TOPIC, 'Topic'),
+    ]
+
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        db_table = 'base_trending_score'
+        verbose_name = 'Trending score'
+        verbose_name_plural = 'Trending scores'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='trending_score_object_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', '-score'], name='trending_score_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}: {self.score:.3f}"
+
+
+class FeedEntry(models.Model):
+    """A room on one user's home timeline, see base.timelines"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='feed_entries')
+    # Latest message in the room, maintained by base.signals
+    message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    activity_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'base_feed_entry'
+        verbose_name = 'Feed entry'
+        verbose_name_plural = 'Feed entries'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], name='feed_entry_user_room_uniq'),
+        ]
+        indexes = [
+            # One user's timeline, newest activity first
+            models.Index(fields=['user', '-activity_at', '-id'], name='feed_entry_timeline_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} / {self.room}"
@@ -0,0 +1,126 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj):
+    """
+    Encode the ``(created, id)`` position of a row as an opaque cursor
+
+    Args:
+        obj: A model instance with ``created`` and ``pk`` attributes, or a
+            ``.values()`` row with ``created`` and ``id`` keys
+
+    Returns:
+        URL-safe string identifying the row's position in the ordering
+    """
+    if isinstance(obj, dict):
+        created, pk = obj['created'], obj['id']
+    else:
+        created, pk = obj.created, obj.pk
+    raw = f"{created.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by ``encode_cursor``
+
+    Args:
+        cursor: The opaque cursor string taken from the query string
+
+    Returns:
+        Tuple of ``(created, id)``
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        created = parse_datetime(created)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+    if created is None:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return created, pk
+
+
+class KeysetPage:
+    """A page of rows in ascending ``(created, id)`` order with cursors to its neighbours"""
+
+    def __init__(self, items, has_older, has_newer):
+        self.items = items
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def older_cursor(self):
+        if self.has_older and self.items:
+            return encode_cursor(self.items[0])
+        return None
+
+    @property
+    def newer_cursor(self):
+        if self.has_newer and self.items:
+            return encode_cursor(self.items[-1])
+        return None
+
+
+def _keyset_slice(queryset, before, after, limit):
+    """The rows to fetch for a page, one more than ``limit`` to detect more"""
+    if after is not None:
+        created, pk = after
+        return (
+            queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+            .order_by('created', 'id')[:limit + 1]
+        )
+    if before is not None:
+        created, pk = before
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+    return queryset.order_by('-created', '-id')[:limit + 1]
+
+
+def _keyset_page(rows, before, after, limit):
+    if after is not None:
+        return KeysetPage(rows[:limit], has_older=True, has_newer=len(rows) > limit)
+    items = rows[:limit]
+    items.reverse()
+    return KeysetPage(items, has_older=len(rows) > limit, has_newer=before is not None)
+
+
+def paginate_keyset(queryset, before=None, after=None, limit=50):
+    """
+    Slice a queryset by ``(created, id)`` without using OFFSET
+
+    Every page is a bounded range scan on the ``(created, id)`` index, so
+    fetching the oldest page of a room costs the same as fetching the newest.
+
+    Args:
+        queryset: Queryset of rows with ``created`` and ``id`` columns
+        before: Decoded cursor; return the rows immediately older than it
+        after: Decoded cursor; return the rows immediately newer than it
+        limit: Maximum number of rows in the page
+
+    Returns:
+        KeysetPage with rows in ascending order. Without a cursor the
+        newest ``limit`` rows are returned.
+    """
+    rows = list(_keyset_slice(queryset, before, after, limit))
+    return _keyset_page(rows, before, after, limit)
+
+
+async def apaginate_keyset(queryset, before=None, after=None, limit=50):
+    """``paginate_keyset`` for async views"""
+    rows = [row async for row in _keyset_slice(queryset, before, after, limit)]
+    return _keyset_page(rows, before, after, limit)
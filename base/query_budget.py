@@ -0,0 +1,109 @@
+"""
+Per-view query budgets.
+
+Views declare how many SQL queries a request may issue with
+``@query_budget(n)``. ``QueryBudgetMiddleware`` counts the queries of each
+request and, depending on ``QUERY_BUDGET_MODE``, raises
+``QueryBudgetExceeded`` (``'raise'``, used in development and under
+``manage.py test``), logs a warning (``'log'``, used in production) or does
+nothing (``'off'``).
+
+Tests can also check a block of code directly with ``assert_max_queries``.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of queries a view may issue per request"""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryCounter:
+    """
+    Context manager counting and timing queries on every database connection
+
+    Args:
+        keep_sql: Number of SQL statements to retain for reporting
+    """
+
+    def __init__(self, keep_sql=50):
+        self.count = 0
+        self.duration = 0.0
+        self.sql = []
+        self.keep_sql = keep_sql
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if len(self.sql) < self.keep_sql:
+            self.sql.append(sql)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        return False
+
+    # Database connections belong to threads. Under ASGI, sync views and the
+    # async ORM of one request all run in that request's thread-sensitive
+    # executor thread, so that is where the wrappers go.
+
+    async def __aenter__(self):
+        await sync_to_async(self.__enter__)()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await sync_to_async(self.__exit__)(*exc_info)
+
+
+def check_budget(label, counter, budget):
+    """
+    Compare a counter against a budget
+
+    Returns:
+        Error message if the budget was exceeded, otherwise None
+    """
+    if budget is None or counter.count <= budget:
+        return None
+    statements = '\n'.join(f"  {sql}" for sql in counter.sql)
+    return f"{label} issued {counter.count} queries (budget {budget}):\n{statements}"
+
+
+@contextmanager
+def assert_max_queries(budget, label='Block'):
+    """
+    Fail if the block issues more than ``budget`` queries
+
+    Works whatever ``QUERY_BUDGET_MODE`` is, for use in tests::
+
+        with assert_max_queries(6):
+            self.client.get('/api/rooms/')
+
+    Raises:
+        QueryBudgetExceeded: With the offending SQL
+    """
+    with QueryCounter() as counter:
+        yield counter
+    error = check_budget(label, counter, budget)
+    if error:
+        raise QueryBudgetExceeded(error)
@@ -0,0 +1,107 @@
+"""
+Live room updates over WebSockets.
+
+Clients connect to ``/ws/rooms/<id>/`` and receive JSON events whenever a
+message is posted to or deleted from the room::
+
+    {"type": "message.created", "message": {...}}
+    {"type": "message.deleted", "id": 42}
+
+The connection is push-only; messages are still posted over HTTP.
+"""
+import asyncio
+import json
+import logging
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import images
+from .broker import get_broker
+from .models import Room
+
+logger = logging.getLogger(__name__)
+
+ROOM_PATH_RE = re.compile(r'^/ws/rooms/(?P<pk>\d+)/$')
+
+
+def room_channel(room_id):
+    return f"room.{room_id}"
+
+
+def message_payload(message):
+    """Compact JSON-ready representation of a message for live clients"""
+    user = message.user
+    return {
+        'id': message.id,
+        'room': message.room_id,
+        'body': message.body,
+        'created': message.created,
+        'image': images.rendition_url(message, 'image', 'thumbnail'),
+        'document': message.document.url if message.document else None,
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'avatar': images.rendition_url(user, 'avatar', 'small'),
+        },
+    }
+
+
+def publish(room_id, event):
+    """Publish an event to a room's subscribers; never raises"""
+    try:
+        get_broker().publish(room_channel(room_id), event)
+    except Exception as e:
+        logger.error(f"Failed to publish realtime event for room {room_id}: {e}")
+
+
+def publish_message_created(message):
+    publish(message.room_id, {'type': 'message.created', 'message': message_payload(message)})
+
+
+def publish_message_deleted(room_id, message_id):
+    publish(room_id, {'type': 'message.deleted', 'id': message_id})
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application handling ``websocket`` scopes"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = ROOM_PATH_RE.match(scope['path'])
+    if not match or not await Room.objects.filter(pk=match['pk']).aexists():
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    subscription = await get_broker().subscribe(room_channel(match['pk']))
+    try:
+        await send({'type': 'websocket.accept'})
+        await _relay(receive, send, subscription)
+    finally:
+        await subscription.close()
+
+
+async def _relay(receive, send, subscription):
+    """Forward broker events to the client until it disconnects"""
+    client_event = asyncio.ensure_future(receive())
+    broker_event = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {client_event, broker_event}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if client_event in done:
+                if client_event.result()['type'] == 'websocket.disconnect':
+                    return
+                # Incoming frames are ignored; messages are posted over HTTP
+                client_event = asyncio.ensure_future(receive())
+            if broker_event in done:
+                await send({
+                    'type': 'websocket.send',
+                    'text': json.dumps(broker_event.result(), cls=DjangoJSONEncoder),
+                })
+                broker_event = asyncio.ensure_future(subscription.get())
+    finally:
+        client_event.cancel()
+        broker_event.cancel()
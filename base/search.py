@@ -0,0 +1,311 @@
+"""
+Full-text search over rooms, topics and messages.
+
+Documents live in a single ``base_search_index`` table whose shape depends
+on the database:
+
+* SQLite: an FTS5 virtual table keyed by ``rowid = object_id * 4 + kind``
+* PostgreSQL: a regular table with a generated, weighted ``tsvector`` column
+  and a GIN index
+
+Both expose the same interface (``index``, ``remove``,
+``remove_room_messages``, ``search``, ``rebuild``). Other databases fall back to ``icontains`` filtering. Room
+names and topic names are weighted above descriptions and message bodies,
+and every search term is prefix-matched.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+
+from .models import Room, Topic, Message
+
+SEARCH_TABLE = 'base_search_index'
+
+ROOM = 'room'
+TOPIC = 'topic'
+MESSAGE = 'message'
+
+KIND_CODES = {ROOM: 1, TOPIC: 2, MESSAGE: 3}
+MODEL_KINDS = {Room: ROOM, Topic: TOPIC, Message: MESSAGE}
+
+# Upper bound on ranked ids pulled from the index for a single query; searches
+# say when they reach it (the X-Search-Limit header, a note on the home page)
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a user query into lower-cased search terms"""
+    return TERM_RE.findall(query.lower())
+
+
+def document_for(instance):
+    """
+    Build the searchable document for a model instance
+
+    Args:
+        instance: A Room, Topic or Message
+
+    Returns:
+        Tuple of ``(kind, title, body)``
+    """
+    if isinstance(instance, Room):
+        topic_name = instance.topic.name if instance.topic_id else ''
+        body = ' '.join(filter(None, [instance.description, topic_name]))
+        return ROOM, instance.name, body
+    if isinstance(instance, Topic):
+        return TOPIC, instance.name, ''
+    if isinstance(instance, Message):
+        return MESSAGE, '', instance.body
+    raise TypeError(f"{type(instance).__name__} is not searchable")
+
+
+class SQLiteSearchBackend:
+    """FTS5 backend; bm25 ranking with the title weighted 10:1 over the body"""
+
+    def index(self, kind, pk, title, body):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)",
+                [pk * 4 + KIND_CODES[kind], title or '', body or '']
+            )
+
+    def index_many(self, kind, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)",
+                [(pk * 4 + KIND_CODES[kind], title or '', body or '') for pk, title, body in documents]
+            )
+
+    def remove(self, kind, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk * 4 + KIND_CODES[kind]]
+            )
+
+    def remove_room_messages(self, room_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN "
+                f"(SELECT id * 4 + {KIND_CODES[MESSAGE]} FROM base_message WHERE room_id = %s)",
+                [room_id]
+            )
+
+    def search(self, kind, terms, limit, room_id=None):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        join, params = '', [match, KIND_CODES[kind]]
+        if room_id is not None:
+            join = f" JOIN base_message m ON m.id = {SEARCH_TABLE}.rowid / 4 AND m.room_id = %s"
+            params.insert(0, room_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE}{join} "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND {SEARCH_TABLE}.rowid %% 4 = %s "
+                f"ORDER BY bm25({SEARCH_TABLE}, 10.0, 1.0) LIMIT %s",
+                params + [limit]
+            )
+            return [rowid // 4 for rowid, in cursor.fetchall()]
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) "
+                "SELECT r.id * 4 + 1, r.name, COALESCE(r.description, '') || ' ' || COALESCE(t.name, '') "
+                "FROM base_room r LEFT JOIN base_topic t ON t.id = r.topic_id"
+            )
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) SELECT id * 4 + 2, name, '' FROM base_topic")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) SELECT id * 4 + 3, '', body FROM base_message")
+
+
+class PostgresSearchBackend:
+    """tsvector/GIN backend; ts_rank_cd ranking over weighted title (A) and body (B)"""
+
+    def index(self, kind, pk, title, body):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (kind, object_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body",
+                [kind, pk, title or '', body or '']
+            )
+
+    def index_many(self, kind, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (kind, object_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body",
+                [(kind, pk, title or '', body or '') for pk, title, body in documents]
+            )
+
+    def remove(self, kind, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE kind = %s AND object_id = %s", [kind, pk]
+            )
+
+    def remove_room_messages(self, room_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE kind = %s AND object_id IN "
+                "(SELECT id FROM base_message WHERE room_id = %s)",
+                [MESSAGE, room_id]
+            )
+
+    def search(self, kind, terms, limit, room_id=None):
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        join, params = '', [tsquery, kind]
+        if room_id is not None:
+            join = " JOIN base_message m ON m.id = s.object_id AND m.room_id = %s"
+            params.insert(0, room_id)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT s.object_id FROM {SEARCH_TABLE} s{join}, to_tsquery('simple', %s) query "
+                "WHERE s.kind = %s AND s.document @@ query "
+                "ORDER BY ts_rank_cd(s.document, query) DESC LIMIT %s",
+                params + [limit]
+            )
+            return [object_id for object_id, in cursor.fetchall()]
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) "
+                "SELECT 'room', r.id, r.name, COALESCE(r.description, '') || ' ' || COALESCE(t.name, '') "
+                "FROM base_room r LEFT JOIN base_topic t ON t.id = r.topic_id"
+            )
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) SELECT 'topic', id, name, '' FROM base_topic")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) SELECT 'message', id, '', body FROM base_message")
+
+
+class LikeSearchBackend:
+    """Fallback for databases without a full-text backend: unranked icontains scans"""
+
+    lookups = {
+        ROOM: (Room, ['name', 'description', 'topic__name']),
+        TOPIC: (Topic, ['name']),
+        MESSAGE: (Message, ['body']),
+    }
+
+    def index(self, kind, pk, title, body):
+        pass
+
+    def index_many(self, kind, documents):
+        pass
+
+    def remove(self, kind, pk):
+        pass
+
+    def remove_room_messages(self, room_id):
+        pass
+
+    def search(self, kind, terms, limit, room_id=None):
+        model, fields = self.lookups[kind]
+        queryset = model.objects.all()
+        if room_id is not None:
+            queryset = queryset.filter(room_id=room_id)
+        for term in terms:
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{f"{field}__icontains": term})
+            queryset = queryset.filter(condition)
+        return list(queryset.order_by('-pk').values_list('pk', flat=True)[:limit])
+
+    def rebuild(self):
+        pass
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, LikeSearchBackend)()
+
+
+def index(instance):
+    """Add or refresh the search document for a Room, Topic or Message"""
+    kind, title, body = document_for(instance)
+    get_backend().index(kind, instance.pk, title, body)
+
+
+def index_many(instances):
+    """
+    Add or refresh the search documents for many saved instances at once
+
+    Args:
+        instances: Rooms, Topics and/or Messages; a room's topic must be
+            loaded or assigned, or each one costs a query
+    """
+    documents = {}
+    for instance in instances:
+        kind, title, body = document_for(instance)
+        documents.setdefault(kind, []).append((instance.pk, title, body))
+    backend = get_backend()
+    for kind, kind_documents in documents.items():
+        backend.index_many(kind, kind_documents)
+
+
+def remove(instance):
+    """Drop the search document for a Room, Topic or Message"""
+    get_backend().remove(MODEL_KINDS[type(instance)], instance.pk)
+
+
+def remove_room_messages(room):
+    """
+    Drop the search documents of every message in a room, in one statement
+
+    Call before the room is deleted, while its messages can still be found.
+    """
+    get_backend().remove_room_messages(room.pk)
+
+
+def rebuild():
+    """Rebuild every search document from the source tables"""
+    get_backend().rebuild()
+
+
+def search_ids(kind, query, limit=MAX_RESULTS, room_id=None):
+    """
+    Run a ranked, prefix-matching search
+
+    Only the best ``limit`` matches are returned, so filters must be applied
+    here rather than to the ids afterwards or a narrow filter can come back
+    empty.
+
+    Args:
+        kind: One of ``ROOM``, ``TOPIC`` or ``MESSAGE``
+        query: Raw user query; every term must match
+        limit: Maximum number of ids returned
+        room_id: Only match messages in this room (``MESSAGE`` only)
+
+    Returns:
+        List of primary keys, best match first
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    if room_id is not None and kind != MESSAGE:
+        raise ValueError(f"Only {MESSAGE} searches can be scoped to a room")
+    return get_backend().search(kind, terms, limit, room_id=room_id)
+
+
+def order_by_ids(queryset, ids):
+    """Restrict ``queryset`` to ``ids`` and keep their order"""
+    if not ids:
+        return queryset.none()
+    ranking = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+        output_field=IntegerField()
+    )
+    return queryset.filter(pk__in=ids).order_by(ranking)
+
+
+def ranked(queryset, kind, query, room_id=None):
+    """Filter ``queryset`` to search matches, best match first"""
+    return order_by_ids(queryset, search_ids(kind, query, room_id=room_id))
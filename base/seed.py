@@ -0,0 +1,186 @@
+"""
+Synthetic data for development and benchmarks.
+
+``seed`` generates users, topics, rooms, participants, messages and
+attachments and writes them through ``base.bulk.Importer``. Everything is
+bulk-inserted, and counters and search documents stay consistent.
+
+Activity follows a Zipf distribution, like real communities: a few rooms
+and users account for most messages and memberships, and there is a long
+tail of quiet ones. Message timestamps rise steadily over the last ``days``
+days, so IDs and creation times agree. Seeding again adds to what's there;
+new messages reuse existing users and rooms and are dated after the newest
+existing message.
+"""
+import bisect
+import io
+import itertools
+import random
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db.models import F, Max
+from django.utils import timezone
+from PIL import Image
+
+from . import blobs, bulk
+from .models import Attachment, Blob, Message, Room, User
+from .storage import blob_storage
+
+TOPIC_NAMES = [
+    'Python', 'JavaScript', 'Django', 'React', 'Machine Learning', 'Data Science', 'Algorithms',
+    'Databases', 'Linear Algebra', 'Calculus', 'Statistics', 'Physics', 'Chemistry', 'Biology',
+    'History', 'Philosophy', 'Economics', 'Design', 'DevOps', 'Security', 'Rust', 'Go',
+    'Writing', 'Spanish', 'Japanese', 'Music Theory', 'Interview Prep', 'Open Source',
+]
+
+WORDS = (
+    'the a to and of in is it that for on with as this we you be are can have how what why '
+    'study group exam notes question answer help idea example code function class module test '
+    'chapter lecture homework project deadline review problem solution proof theorem data model '
+    'query index cache server client request response error bug fix deploy branch merge commit '
+    'week tomorrow tonight meeting session practice quiz paper draft slides video link book'
+).split()
+
+
+def zipf_sampler(count, exponent, rng):
+    """
+    Build a sampler for indexes ``0..count-1`` with Zipf weights
+
+    Index ``i`` is drawn with probability proportional to ``1 / (i + 1) ** exponent``.
+
+    Returns:
+        Function of no arguments returning an index
+    """
+    cumulative = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+    total = cumulative[-1]
+    return lambda: bisect.bisect_left(cumulative, rng.random() * total)
+
+
+def _sentence(rng, low, high):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize()
+
+
+def _placeholder_files():
+    """Store one small image and one document to share between attachments"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (90, 110, 200)).save(buffer, 'PNG')
+    image = blob_storage.save('seed.png', ContentFile(buffer.getvalue()))
+    document = blob_storage.save('seed.txt', ContentFile(b'Seed attachment\n'))
+    return {'image': (image, 'notes.png'), 'document': (document, 'notes.txt')}
+
+
+def seed(users=0, topics=0, rooms=0, messages=0, participants=0, attachments=0,
+         exponent=1.1, days=365, random_seed=None, batch_size=bulk.IMPORT_BATCH_SIZE, progress=None):
+    """
+    Add synthetic data
+
+    Args:
+        users, topics, rooms, messages, participants, attachments: How many
+            of each to add. Participants are drawn with repetition, so
+            slightly fewer memberships may result.
+        exponent: Zipf exponent for room and user activity
+        days: Span of message timestamps for a fresh database
+        random_seed: Seed for reproducible data
+        batch_size: Records per bulk insert
+        progress: Optional function called with the Importer per batch
+
+    Returns:
+        Tuple of (Importer, number of attachments created)
+    """
+    rng = random.Random(random_seed)
+    importer = bulk.Importer(batch_size)
+
+    # Existing users and rooms take part in new activity too
+    usernames = list(User.objects.order_by('pk').values_list('username', flat=True))
+    room_ids = [str(pk) for pk in Room.objects.order_by('pk').values_list('pk', flat=True)]
+    importer.room_ids.update((room_id, int(room_id)) for room_id in room_ids)
+    first_message_id = (Message.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def records():
+        offset = len(usernames)
+        for number in range(offset, offset + users):
+            username = f"user{number}"
+            usernames.append(username)
+            yield {
+                'type': 'user', 'username': username, 'email': f"{username}@example.com",
+                'name': f"User {number}", 'bio': _sentence(rng, 5, 20),
+            }
+
+        topic_names = TOPIC_NAMES[:topics] + [f"Topic {number}" for number in range(len(TOPIC_NAMES), topics)]
+        for name in topic_names:
+            yield {'type': 'topic', 'name': name}
+
+        if not usernames:
+            return
+        pick_user = zipf_sampler(len(usernames), exponent, rng)
+        pick_topic = zipf_sampler(len(topic_names), exponent, rng) if topic_names else None
+        for number in range(rooms):
+            room_id = f"seed-{number}"
+            room_ids.append(room_id)
+            yield {
+                'type': 'room', 'id': room_id, 'name': _sentence(rng, 2, 5),
+                'description': _sentence(rng, 8, 30), 'host': usernames[pick_user()],
+                'topic': topic_names[pick_topic()] if pick_topic else None,
+            }
+
+        if not room_ids:
+            return
+        pick_room = zipf_sampler(len(room_ids), exponent, rng)
+        for _ in range(participants):
+            yield {'type': 'participant', 'room': room_ids[pick_room()], 'user': usernames[pick_user()]}
+
+        now = timezone.now()
+        latest = Message.objects.aggregate(latest=Max('created'))['latest']
+        start = latest if latest and latest < now else now - timedelta(days=days)
+        step = (now - start) / max(messages, 1)
+        for number in range(messages):
+            created = start + step * (number + 1)
+            yield {
+                'type': 'message', 'room': room_ids[pick_room()], 'user': usernames[pick_user()],
+                # Mostly short chat lines with the odd long explanation
+                'body': _sentence(rng, 3, 12 if rng.random() < 0.9 else 80),
+                'created': created, 'updated': created,
+            }
+
+    for number, record in enumerate(records(), 1):
+        importer.add(record)
+        if progress and number % batch_size == 0:
+            progress(importer)
+    importer.finish()
+
+    created_attachments = 0
+    message_ids = range(first_message_id, first_message_id + importer.counts['message'])
+    if attachments and message_ids:
+        created_attachments = _seed_attachments(rng, list(message_ids), attachments, batch_size)
+    return importer, created_attachments
+
+
+def _seed_attachments(rng, message_ids, count, batch_size):
+    files = _placeholder_files()
+    sizes = {name: blob_storage.size(name) for name, _ in files.values()}
+    references = dict.fromkeys(sizes, 0)
+    for start in range(0, count, batch_size):
+        sample = rng.choices(message_ids, k=min(batch_size, count - start))
+        # IDs in the range may belong to messages deleted since
+        existing = set(Message.objects.filter(id__in=sample).values_list('id', flat=True))
+        batch = []
+        for message_id in sample:
+            if message_id not in existing:
+                continue
+            file_type = 'image' if rng.random() < 0.6 else 'document'
+            name, file_name = files[file_type]
+            references[name] += 1
+            batch.append(Attachment(
+                message_id=message_id, file=name, file_type=file_type, file_name=file_name,
+                file_size=sizes[name]
+            ))
+        Attachment.objects.bulk_create(batch)
+
+    # bulk_create skips the signals that keep blob reference counts
+    for name, count in references.items():
+        if count:
+            blobs.acquire(name)
+            Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count - 1)
+    return sum(references.values())
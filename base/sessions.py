@@ -0,0 +1,25 @@
+"""
+Session engine that caches sessions only in a shared cache.
+
+With ``SESSION_ENGINE = 'base.sessions'`` sessions are read from the cache
+and written through to the database, like Django's ``cached_db`` engine,
+when the default cache is shared between workers (``base.caches``).
+Otherwise a logout or key rotation on one worker would leave the session
+alive in the others' caches, so every read goes to the database, as with
+the ``db`` engine.
+"""
+from django.contrib.sessions.backends import cached_db
+from django.core.cache.backends.dummy import DummyCache
+
+from . import caches
+
+# Misses every lookup, so cached_db falls through to the database
+_NO_CACHE = DummyCache('', {})
+
+
+class SessionStore(cached_db.SessionStore):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        if not caches.is_shared():
+            self._cache = _NO_CACHE
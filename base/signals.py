@@ -0,0 +1,367 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import activity, auth, autocomplete, blobs, fragments, images, membership, realtime, search, timelines, trending
+from .counters import recount_rooms, room_last_message_at
+from .models import Room, Topic, Message, Attachment, User
+
+
+# Counter maintenance
+#
+# Room.participant_count, Room.message_count, Room.last_message_at and
+# Topic.room_count are updated in place with F() expressions so concurrent
+# writers never lose increments. Bulk operations that bypass signals can be
+# reconciled with ``manage.py rebuild_counters``.
+
+def _decrement(field):
+    return Greatest(F(field) - 1, 0)
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def update_participant_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # Remember which rooms the user belonged to before the rows disappear
+        instance._cleared_room_ids = list(
+            sender.objects.filter(user_id=instance.pk).values_list('room_id', flat=True)
+        )
+        return
+
+    if action == 'post_add' and pk_set:
+        # pk_set only holds rows that were actually inserted
+        if reverse:
+            Room.objects.filter(pk__in=pk_set).update(participant_count=F('participant_count') + 1)
+        else:
+            Room.objects.filter(pk=instance.pk).update(
+                participant_count=F('participant_count') + len(pk_set)
+            )
+    elif action in ('post_remove', 'post_clear'):
+        # pk_set for removals is whatever the caller passed in, not what was
+        # deleted, so recount the affected rooms instead of decrementing
+        if reverse:
+            room_ids = pk_set if action == 'post_remove' else getattr(instance, '_cleared_room_ids', [])
+        else:
+            room_ids = [instance.pk]
+        if room_ids:
+            recount_rooms(Room.objects.filter(pk__in=room_ids), messages=False)
+
+
+@receiver(post_save, sender=Message)
+def increment_message_count(sender, instance, created, **kwargs):
+    if created:
+        Room.objects.filter(pk=instance.room_id).update(
+            message_count=F('message_count') + 1,
+            last_message_at=Greatest(Coalesce('last_message_at', Value(instance.created)), Value(instance.created))
+        )
+
+
+def _deleting_room(origin):
+    """Whether a cascaded delete started from the room(s) themselves"""
+    return isinstance(origin, Room) or getattr(origin, 'model', None) is Room
+
+
+@receiver(post_delete, sender=Message)
+def decrement_message_count(sender, instance, origin=None, **kwargs):
+    if _deleting_room(origin):
+        return
+    rooms = Room.objects.filter(pk=instance.room_id)
+    rooms.update(message_count=_decrement('message_count'))
+    rooms.filter(last_message_at=instance.created).update(
+        last_message_at=room_last_message_at()
+    )
+
+
+@receiver(post_init, sender=Room)
+def remember_room_topic(sender, instance, **kwargs):
+    # Read from __dict__ so deferred loads don't trigger a query per instance
+    instance._loaded_topic_id = instance.__dict__.get('topic_id')
+
+
+@receiver(post_save, sender=Room)
+def update_topic_room_count(sender, instance, created, **kwargs):
+    previous = None if created else instance._loaded_topic_id
+    if previous != instance.topic_id:
+        if previous is not None:
+            Topic.objects.filter(pk=previous).update(room_count=_decrement('room_count'))
+        if instance.topic_id is not None:
+            Topic.objects.filter(pk=instance.topic_id).update(room_count=F('room_count') + 1)
+        topic_id = instance.topic_id
+        transaction.on_commit(lambda: autocomplete.room_moved(previous, topic_id))
+    instance._loaded_topic_id = instance.topic_id
+
+
+@receiver(post_delete, sender=Room)
+def decrement_topic_room_count(sender, instance, **kwargs):
+    if instance.topic_id is not None:
+        Topic.objects.filter(pk=instance.topic_id).update(room_count=_decrement('room_count'))
+        topic_id = instance.topic_id
+        transaction.on_commit(lambda: autocomplete.room_moved(topic_id, None))
+
+
+# Search index maintenance
+
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Message)
+def index_document(sender, instance, **kwargs):
+    search.index(instance)
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, created, **kwargs):
+    search.index(instance)
+    if not created:
+        # Room documents embed the topic name
+        for room in instance.rooms.select_related('topic').iterator():
+            search.index(room)
+
+
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Topic)
+@receiver(post_delete, sender=Message)
+def remove_document(sender, instance, origin=None, **kwargs):
+    # A deleted room's messages go in one statement (below)
+    if sender is Message and _deleting_room(origin):
+        return
+    search.remove(instance)
+
+
+@receiver(pre_delete, sender=Room)
+def remove_room_message_documents(sender, instance, **kwargs):
+    search.remove_room_messages(instance)
+
+
+# Uploaded files: blob reference counts and image renditions
+
+FILE_FIELDS = {apps.get_model(label): fields for label, fields in blobs.FILE_FIELDS.items()}
+
+IMAGE_FIELDS = {
+    User: 'avatar',
+    Room: 'room_image',
+    Message: 'image',
+    Attachment: 'file',
+}
+
+
+def _file_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Room)
+@receiver(post_init, sender=Message)
+@receiver(post_init, sender=Attachment)
+def remember_files(sender, instance, **kwargs):
+    # Read from __dict__ so deferred loads don't trigger a query per instance
+    instance._loaded_files = {
+        field: _file_name(instance.__dict__.get(field)) for field in FILE_FIELDS[sender]
+    }
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Attachment)
+def update_files(sender, instance, created, update_fields=None, **kwargs):
+    for field_name in FILE_FIELDS[sender]:
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        if field_name not in instance.__dict__:
+            # Deferred and therefore not saved
+            continue
+        previous = '' if created else instance._loaded_files[field_name]
+        current = _file_name(getattr(instance, field_name))
+        if current == previous:
+            continue
+        blobs.acquire(current)
+        blobs.release(previous)
+        instance._loaded_files[field_name] = current
+
+        if IMAGE_FIELDS[sender] != field_name:
+            continue
+        if sender is Attachment and instance.file_type != 'image':
+            continue
+        # The bundled default avatar is an SVG and needs no renditions
+        if current != sender._meta.get_field(field_name).get_default() or instance.renditions:
+            images.schedule_renditions(instance, field_name)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Attachment)
+def release_files(sender, instance, **kwargs):
+    for field_name in FILE_FIELDS[sender]:
+        blobs.release(instance._loaded_files.get(field_name, ''))
+    if instance.renditions:
+        renditions = instance.renditions
+        transaction.on_commit(lambda: images.delete_renditions(renditions))
+
+
+# Live updates for connected WebSocket clients and the activity feed
+
+@receiver(post_save, sender=Message)
+def publish_message_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: realtime.publish_message_created(instance))
+        transaction.on_commit(lambda: activity.record_message(instance))
+
+
+@receiver(post_delete, sender=Message)
+def publish_message_deleted(sender, instance, **kwargs):
+    room_id, message_id = instance.room_id, instance.pk
+    transaction.on_commit(lambda: realtime.publish_message_deleted(room_id, message_id))
+    transaction.on_commit(lambda: activity.record_deletion(message_id))
+
+
+# Fragment cache invalidation
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_room_fragments(sender, **kwargs):
+    # Room names appear in the activity feed; topic room counts change too
+    fragments.bump(fragments.ROOMS, fragments.TOPICS, fragments.MESSAGES)
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def invalidate_participant_fragments(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        fragments.bump(fragments.ROOMS)
+
+
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def invalidate_topic_fragments(sender, **kwargs):
+    fragments.bump(fragments.TOPICS, fragments.ROOMS)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message_fragments(sender, **kwargs):
+    fragments.bump(fragments.MESSAGES)
+
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_attachment_fragments(sender, **kwargs):
+    fragments.bump(fragments.MESSAGES)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_fragments(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no fragment renders
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    fragments.bump(fragments.ROOMS, fragments.MESSAGES, fragments.USERS)
+
+
+# Cached users (see base.auth)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    auth.forget_user(instance.pk)
+
+
+# Cached room members (see base.membership)
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def forget_room_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_user_ids = list(
+            sender.objects.filter(room_id=instance.pk).values_list('user_id', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_room_ids' if reverse else '_cleared_user_ids', [])
+    if reverse:
+        membership.forget((room_id, instance.pk) for room_id in pk_set or ())
+    else:
+        membership.forget((instance.pk, user_id) for user_id in pk_set or ())
+
+
+# Topic autocomplete index (see base.autocomplete)
+
+@receiver(post_save, sender=Topic)
+def update_topic_suggestions(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.topic_saved(instance))
+
+
+@receiver(post_delete, sender=Topic)
+def remove_topic_suggestion(sender, instance, **kwargs):
+    topic_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.topic_deleted(topic_id))
+
+
+# Trending scores (see base.trending)
+
+@receiver(post_save, sender=Message)
+def record_message_activity(sender, instance, created, **kwargs):
+    if not created:
+        return
+    if Message.room.is_cached(instance):
+        topic_id = instance.room.topic_id
+    else:
+        topic_id = Room.objects.filter(pk=instance.room_id).values_list('topic_id', flat=True).first()
+    trending.record(trending.MESSAGE_WEIGHT, instance.created, room_id=instance.room_id, topic_id=topic_id)
+
+
+@receiver(post_save, sender=Room)
+def record_room_activity(sender, instance, created, **kwargs):
+    if created:
+        trending.record(trending.ROOM_WEIGHT, instance.created, room_id=instance.pk, topic_id=instance.topic_id)
+
+
+@receiver(post_delete, sender=Room)
+def forget_room_trending(sender, instance, **kwargs):
+    trending.forget(trending.ROOM, instance.pk)
+
+
+@receiver(post_delete, sender=Topic)
+def forget_topic_trending(sender, instance, **kwargs):
+    trending.forget(trending.TOPIC, instance.pk)
+
+
+# Personal timelines (see base.timelines)
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def update_member_timelines(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        if reverse:
+            timelines.add_rooms(instance.pk, pk_set)
+        else:
+            timelines.add_members(instance.pk, pk_set)
+    elif action == 'post_remove' and pk_set:
+        if reverse:
+            timelines.remove(room_ids=pk_set, user_ids=[instance.pk])
+        else:
+            timelines.remove(room_ids=[instance.pk], user_ids=pk_set)
+    elif action == 'post_clear':
+        if reverse:
+            timelines.remove(user_ids=[instance.pk])
+        else:
+            timelines.remove(room_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Room)
+def add_host_timeline(sender, instance, created, **kwargs):
+    if created:
+        timelines.add_host(instance)
+
+
+@receiver(post_save, sender=Message)
+def publish_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        timelines.publish(instance)
+
+
+@receiver(post_delete, sender=Message)
+def retract_from_timelines(sender, instance, origin=None, **kwargs):
+    # Deleting the room deletes its entries too; nothing to point elsewhere
+    if _deleting_room(origin):
+        return
+    timelines.retract(instance.room_id)
@@ -0,0 +1,101 @@
+"""
+Static asset pipeline.
+
+``CompressedManifestStaticFilesStorage`` extends Django's manifest storage
+so that ``collectstatic``:
+
+* minifies the project's own CSS and JavaScript (``base.minify``),
+* writes content-hashed copies and ``staticfiles.json`` as usual, and
+* stores precompressed ``.gz`` and, when the ``brotli`` package is
+  installed, ``.br`` siblings of every compressible file.
+
+``base.middleware.StaticFilesMiddleware`` serves the result.
+"""
+import gzip
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+from .minify import minify_css, minify_js
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map', '.ico'}
+
+# Below this size compression overhead outweighs the savings
+MIN_COMPRESS_SIZE = 256
+
+
+def compressed_variants(data):
+    """
+    Compress ``data`` with every available encoding
+
+    Returns:
+        Dict mapping file suffix to compressed bytes, omitting encodings
+        that don't make the file smaller
+    """
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: value for suffix, value in variants.items() if len(value) < len(data)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.update(n for n in (name, hashed_name) if n)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        project_dirs = {
+            os.path.abspath(entry[1] if isinstance(entry, (list, tuple)) else entry)
+            for entry in settings.STATICFILES_DIRS
+        }
+        for name, (source_storage, _) in paths.items():
+            # Only the project's own assets; app assets ship their own builds.
+            # Hashes stay derived from the source, which minifying can't change.
+            if os.path.abspath(getattr(source_storage, 'location', '')) in project_dirs:
+                self.minify(name)
+                self.minify(self.stored_name(name))
+        for name in sorted(names):
+            self.compress(name)
+
+    def minify(self, name):
+        """Minify a collected CSS or JavaScript file in place"""
+        minifier = MINIFIERS.get(os.path.splitext(name)[1])
+        if minifier is None or '.min.' in name:
+            return
+        with self.open(name) as f:
+            try:
+                text = f.read().decode('utf-8')
+            except UnicodeDecodeError:
+                return
+        self.delete(name)
+        self._save(name, ContentFile(minifier(text).encode('utf-8')))
+
+    def compress(self, name):
+        """Write precompressed siblings of a stored file"""
+        if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        for suffix, compressed in compressed_variants(data).items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
@@ -0,0 +1,114 @@
+"""
+Content-addressed media storage.
+
+Uploads are hashed while they are streamed to disk and stored once under
+their SHA-256 digest, so identical files share one blob no matter how
+often or under which name they are uploaded:
+
+    blobs/3f/a9/3fa9...e1.jpg
+
+The ``upload_to`` path only contributes the file extension. Blobs are
+reference counted by ``base.blobs`` and removed once nothing points at
+them any more.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs'
+
+
+def blob_name(digest, extension):
+    """Storage name of the blob with the given hex digest"""
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f"{BLOB_PREFIX}/")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed in _save
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1]
+        return self.save_stream(content.chunks(), extension)
+
+    def save_stream(self, chunks, extension):
+        """
+        Store a stream of bytes as a blob
+
+        The data goes to a temporary file next to the blob directory while it
+        is hashed, then is atomically moved into place, or discarded if a blob
+        with the same digest already exists.
+
+        Args:
+            chunks: Iterable of byte strings
+            extension: File extension, including the leading dot
+
+        Returns:
+            Storage name of the blob
+        """
+        directory = self.path(BLOB_PREFIX)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            name = blob_name(digest.hexdigest(), extension)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def adopt(self, path, extension):
+        """
+        Move a local file into the store as a blob
+
+        Args:
+            path: Absolute path of the file; it no longer exists afterwards
+            extension: File extension, including the leading dot
+
+        Returns:
+            Storage name of the blob
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(64 * 1024):
+                digest.update(chunk)
+
+        name = blob_name(digest.hexdigest(), extension)
+        target = self.path(name)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+            # A rename when on the same filesystem, a copy otherwise
+            shutil.move(path, target)
+        return name
+
+
+blob_storage = ContentAddressedStorage()
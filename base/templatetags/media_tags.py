@@ -0,0 +1,38 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from base.images import rendition_url
+
+register = template.Library()
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+
+
+@register.simple_tag
+def picture(obj, field_name, size, alt=''):
+    """
+    Render a ``<picture>`` element for one rendition of an image field
+
+    Modern formats are offered as ``<source>`` elements and the JPEG
+    rendition is the ``<img>`` fallback. Until renditions exist (or for
+    files that have none, such as the SVG default avatar) the original file
+    is used.
+
+    Usage:
+        {% picture message.user 'avatar' 'small' %}
+    """
+    src = rendition_url(obj, field_name, size)
+    if src is None:
+        return ''
+    paths = (obj.renditions or {}).get(size, {})
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" />',
+        ((mime, default_storage.url(paths[fmt])) for fmt, mime in MIME_TYPES.items() if fmt in paths)
+    )
+    return format_html(
+        '<picture>{}<img src="{}" alt="{}" loading="lazy" /></picture>', sources, src, alt
+    )
@@ -1,3 +1,1277 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from base import activity, autocomplete, blobs, fragments, images, membership, metrics, realtime, search, timelines, trending
+from base.api.renderers import FastJSONRenderer
+from base.db_routers import ReplicaRouter, replica_reads, set_replica_reads
+from base.middleware import ReadYourWritesMiddleware
+from base.checks import check_shared_cache
+from base.counters import find_drift
+from base.minify import minify_css, minify_js
+from base.models import Attachment, Blob, FeedEntry, Message, Room, Topic, Upload, User
+from base.storage import blob_storage
+from base.pagination import encode_cursor
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from base.query_budget import QueryBudgetExceeded, assert_max_queries
+
+# Pages render {% static %} URLs, which need a manifest outside of tests
+PLAIN_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class StudyBudTestCase(TestCase):
+    """Starts every test with an empty cache, one user and one topic"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='host@example.com', username='host')
+        self.topic = Topic.objects.create(name='Python')
+
+    def make_room(self, name='Study group'):
+        return Room.objects.create(host=self.user, topic=self.topic, name=name)
+
+
+class TempMediaMixin:
+    """Stores uploads, blobs and renditions in a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS_SYNC=True)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+
+def image_upload(name='photo.png', size=(640, 480), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class CounterTests(StudyBudTestCase):
+    """Stored counters match the source tables after every kind of write"""
+
+    def assertNoDrift(self):
+        self.assertEqual(find_drift(), [])
+
+    def test_create_and_delete(self):
+        room = self.make_room()
+        first = Message.objects.create(user=self.user, room=room, body='first')
+        last = Message.objects.create(user=self.user, room=room, body='last')
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 2)
+        self.assertEqual(room.last_message_at, last.created)
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).room_count, 1)
+        self.assertNoDrift()
+
+        last.delete()
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 1)
+        self.assertEqual(room.last_message_at, first.created)
+        self.assertNoDrift()
+
+        room.delete()
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).room_count, 0)
+        self.assertNoDrift()
+
+    def test_room_delete_skips_message_counters(self):
+        room = self.make_room()
+        for i in range(5):
+            Message.objects.create(user=self.user, room=room, body=f"Message {i}")
+        with CaptureQueriesContext(connection) as queries:
+            room.delete()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "base_room"')])
+        self.assertNoDrift()
+
+    def test_join_and_leave(self):
+        room = self.make_room()
+        guest = User.objects.create(email='guest@example.com', username='guest')
+
+        self.assertTrue(membership.join(room, guest))
+        self.assertFalse(membership.join(room, guest))
+        self.assertEqual(Room.objects.get(pk=room.pk).participant_count, 1)
+        self.assertNoDrift()
+
+        self.assertTrue(membership.leave(room, guest))
+        self.assertFalse(membership.leave(room, guest))
+        self.assertEqual(Room.objects.get(pk=room.pk).participant_count, 0)
+        self.assertNoDrift()
+
+        room.participants.add(self.user, guest)
+        guest.participated_rooms.clear()
+        self.assertEqual(Room.objects.get(pk=room.pk).participant_count, 1)
+        self.assertNoDrift()
+
+    def test_save_keeps_counters(self):
+        room = self.make_room()
+        stale = Room.objects.get(pk=room.pk)
+        Message.objects.create(user=self.user, room=room, body='hello')
+        room.participants.add(self.user)
+
+        # A full save of an instance loaded before the counters moved
+        stale.name = 'Renamed'
+        stale.save()
+        room = Room.objects.get(pk=room.pk)
+        self.assertEqual((room.name, room.message_count, room.participant_count), ('Renamed', 1, 1))
+        self.assertNoDrift()
+
+    def test_topic_change(self):
+        room = self.make_room()
+        other = Topic.objects.create(name='Django')
+        room.topic = other
+        room.save()
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).room_count, 0)
+        self.assertEqual(Topic.objects.get(pk=other.pk).room_count, 1)
+        self.assertNoDrift()
+
+
+class MessageCursorTests(StudyBudTestCase):
+    """Keyset pages of the messages endpoints cover every message exactly once"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room()
+        Message.objects.bulk_create([
+            Message(user=self.user, room=self.room, body=f"Message {i}") for i in range(25)
+        ])
+        self.expected = list(
+            Message.objects.filter(room=self.room).order_by('-created', '-id').values_list('id', flat=True)
+        )
+
+    def pages(self, url, direction):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([message['id'] for message in response.json()['results']])
+            url = response.json()[direction]
+        return pages
+
+    def test_round_trip(self):
+        for name in ('api-messages', 'api-async-messages'):
+            with self.subTest(name):
+                older = self.pages(f"{reverse(name)}?room={self.room.pk}&page_size=10", 'next')
+                self.assertEqual([len(page) for page in older], [10, 10, 5])
+                self.assertEqual(sum(older, []), self.expected)
+
+                # And back from the oldest page to the newest
+                response = self.client.get(f"{reverse(name)}?room={self.room.pk}&page_size=10")
+                while response.json()['next']:
+                    last = response
+                    response = self.client.get(response.json()['next'])
+                newer = self.pages(last.json()['next'], 'previous')
+                self.assertEqual(sum(reversed(newer), []), self.expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"{reverse('api-messages')}?before=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class RoomPageTests(StudyBudTestCase):
+    """The room page pages its messages and lists a bounded number of participants"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room()
+
+    def test_message_pages(self):
+        Message.objects.bulk_create([
+            Message(user=self.user, room=self.room, body=f"Message {i}") for i in range(55)
+        ])
+        page = self.client.get(reverse('room', args=[self.room.pk])).context['room_messages']
+        self.assertEqual(len(page.items), 50)
+        self.assertTrue(page.has_older)
+
+        oldest_shown = page.items[0]
+        older = self.client.get(reverse('room', args=[self.room.pk]), {'before': encode_cursor(oldest_shown)})
+        self.assertEqual(len(older.context['room_messages'].items), 5)
+        self.assertFalse(older.context['room_messages'].has_older)
+
+    def test_participants_bounded(self):
+        guests = User.objects.bulk_create([
+            User(email=f"guest{i}@example.com", username=f"guest{i}") for i in range(60)
+        ])
+        self.room.participants.add(*guests)
+        response = self.client.get(reverse('room', args=[self.room.pk]))
+        self.assertEqual(len(response.context['participants']), 50)
+        self.assertContains(response, 'and 10 more')
+        self.assertContains(response, '(60 Joined)')
+
+
+class RealtimeTests(StudyBudTestCase):
+    """Room pages get new messages over WebSockets and from their own posts"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room()
+
+    def post_message(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(user=self.user, room=self.room, body=body)
+
+    def delete_message(self, message):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.get(pk=message.pk).delete()
+
+    async def connect(self, path):
+        """Run the WebSocket application; returns its task and both queues"""
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        await incoming.put({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': path}
+        task = asyncio.ensure_future(realtime.websocket_application(scope, incoming.get, outgoing.put))
+        return task, incoming, outgoing
+
+    async def test_unknown_room_closed(self):
+        task, incoming, outgoing = await self.connect('/ws/rooms/999999/')
+        self.assertEqual(await asyncio.wait_for(outgoing.get(), 1), {'type': 'websocket.close', 'code': 4404})
+        await asyncio.wait_for(task, 1)
+
+    async def test_message_events(self):
+        task, incoming, outgoing = await self.connect(f"/ws/rooms/{self.room.pk}/")
+        self.assertEqual((await asyncio.wait_for(outgoing.get(), 1))['type'], 'websocket.accept')
+
+        message = await sync_to_async(self.post_message)('hello')
+        event = json.loads((await asyncio.wait_for(outgoing.get(), 1))['text'])
+        self.assertEqual(event['type'], 'message.created')
+        self.assertEqual((event['message']['id'], event['message']['body']), (message.pk, 'hello'))
+
+        await sync_to_async(self.delete_message)(message)
+        event = json.loads((await asyncio.wait_for(outgoing.get(), 1))['text'])
+        self.assertEqual(event, {'type': 'message.deleted', 'id': message.pk})
+
+        await incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(task, 1)
+
+    @override_settings(STORAGES=PLAIN_STORAGES)
+    def test_ajax_post(self):
+        self.client.force_login(self.user)
+        url = reverse('room', args=[self.room.pk])
+        response = self.client.post(url, {'body': 'from fetch'}, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['message']['body'], 'from fetch')
+        self.assertEqual(response.json()['message']['id'], response.json()['id'])
+
+        response = self.client.post(url, {'body': ''}, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('body', response.json()['errors'])
+
+
+@override_settings(CACHE_SHARED=True)
+class FragmentTests(StudyBudTestCase):
+    """Fragments are re-rendered once the data they depend on changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.renders = []
+
+    def render(self):
+        self.renders.append(ReplicaRouter().db_for_read(Room))
+        return f"render {len(self.renders)}"
+
+    def fragment(self):
+        return fragments.cached('test', [fragments.ROOMS], ['vary'], self.render)
+
+    def test_bump_invalidates(self):
+        self.assertEqual(self.fragment(), 'render 1')
+        self.assertEqual(self.fragment(), 'render 1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fragments.bump(fragments.ROOMS)
+            # Not before the change commits
+            self.assertEqual(self.fragment(), 'render 1')
+        self.assertEqual(self.fragment(), 'render 2')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fragments.bump(fragments.TOPICS)
+        self.assertEqual(self.fragment(), 'render 2')
+
+    @override_settings(CACHE_SHARED=False)
+    def test_not_cached_without_shared_cache(self):
+        self.fragment()
+        self.fragment()
+        self.assertEqual(len(self.renders), 2)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_fill_after_bump_reads_primary(self):
+        set_replica_reads(True)
+        self.addCleanup(set_replica_reads, False)
+        self.fragment()
+        with self.captureOnCommitCallbacks(execute=True):
+            fragments.bump(fragments.ROOMS)
+        self.fragment()
+        # Outside the fill, reads go back to the replica
+        self.assertEqual(self.renders, ['replica', 'default'])
+        self.assertEqual(ReplicaRouter().db_for_read(Room), 'replica')
+
+    @override_settings(STORAGES=PLAIN_STORAGES)
+    def test_home_page(self):
+        self.make_room('First room')
+        self.assertContains(self.client.get(reverse('home')), 'First room')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_room('Second room')
+        self.assertContains(self.client.get(reverse('home')), 'Second room')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """Only safe requests to replica_reads views read from a replica"""
+
+    def setUp(self):
+        self.seen = []
+
+        def view(request):
+            self.seen.append(ReplicaRouter().db_for_read(Room))
+            return HttpResponse()
+        self.view = view
+        self.replica_view = replica_reads(lambda request: view(request))
+
+    def request(self, view, method='get', cookies=None):
+        middleware = ReadYourWritesMiddleware(
+            lambda request: middleware.process_view(request, view, (), {}) or view(request)
+        )
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return middleware(request)
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Room), 'default')
+        self.assertEqual(router.db_for_write(Room), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'base'))
+
+        self.request(self.replica_view)
+        self.request(self.view)
+        self.assertEqual(self.seen, ['replica', 'default'])
+        # Reset once the request is over
+        self.assertEqual(router.db_for_read(Room), 'default')
+
+    def test_writes_pin_to_primary(self):
+        response = self.request(self.replica_view, method='post')
+        cookie = response.cookies['studybud_primary']
+        self.assertEqual(cookie['max-age'], 5)
+        self.request(self.replica_view, cookies={'studybud_primary': cookie.value})
+        self.assertEqual(self.seen, ['default', 'default'])
+
+
+class ImageRenditionTests(TempMediaMixin, StudyBudTestCase):
+    """Uploaded images get resized renditions once their row commits"""
+
+    def set_avatar(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.avatar = upload
+            self.user.save()
+        self.user.refresh_from_db()
+
+    def test_avatar_renditions(self):
+        self.set_avatar(image_upload())
+        self.assertEqual(set(self.user.renditions), {'small', 'large'})
+        for size, (width, height, crop) in images.RENDITIONS['base.User.avatar'].items():
+            self.assertIn('jpeg', self.user.renditions[size])
+            with default_storage.open(self.user.renditions[size]['jpeg']) as f, Image.open(f) as rendition:
+                self.assertEqual(rendition.size, (width, height))
+                self.assertFalse(rendition.info.get('exif'))
+        self.assertEqual(
+            images.rendition_url(self.user, 'avatar', 'small'),
+            default_storage.url(self.user.renditions['small']['jpeg'])
+        )
+
+    def test_fit_inside_box(self):
+        room = self.make_room()
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(user=self.user, room=room, body='pic', image=image_upload(size=(960, 240)))
+        message.refresh_from_db()
+        with default_storage.open(message.renditions['thumbnail']['jpeg']) as f, Image.open(f) as rendition:
+            self.assertEqual(rendition.size, (480, 120))
+
+    def test_replaced_and_deleted(self):
+        self.set_avatar(image_upload())
+        old = [path for paths in self.user.renditions.values() for path in paths.values()]
+        self.set_avatar(image_upload(color='blue'))
+        self.assertTrue(all(not default_storage.exists(path) for path in old))
+
+        current = [path for paths in self.user.renditions.values() for path in paths.values()]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertTrue(all(not default_storage.exists(path) for path in current))
+
+    def test_original_until_rendered(self):
+        room = self.make_room()
+        message = Message.objects.create(user=self.user, room=room, body='pic', image=image_upload())
+        self.assertEqual(message.renditions, {})
+        self.assertEqual(images.rendition_url(message, 'image', 'thumbnail'), message.image.url)
+
+
+class BlobStorageTests(TempMediaMixin, StudyBudTestCase):
+    """Identical uploads share one reference-counted blob"""
+
+    def upload_document(self, room, content=b'%PDF-1.4 notes'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                user=self.user, room=room, body='doc', document=SimpleUploadedFile('notes.pdf', content)
+            )
+
+    def test_shared_and_collected(self):
+        room = self.make_room()
+        first = self.upload_document(room)
+        second = self.upload_document(room)
+        self.assertEqual(first.document.name, second.document.name)
+        self.assertTrue(first.document.name.startswith('blobs/'))
+        self.assertEqual(Blob.objects.get(name=first.document.name).ref_count, 2)
+
+        name = first.document.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(blob_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(blob_storage.exists(name))
+
+    def test_recount(self):
+        message = self.upload_document(self.make_room())
+        Blob.objects.update(ref_count=7)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(blobs.recount(), (1, 0))
+        self.assertEqual(Blob.objects.get(name=message.document.name).ref_count, 1)
+
+    def test_dedupe_media(self):
+        room = self.make_room()
+        os.makedirs(os.path.join(self.media_root, 'documents'))
+        for name in ('documents/a.pdf', 'documents/a_AbCdEf1.pdf'):
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'%PDF-1.4 legacy')
+        message = Message.objects.create(user=self.user, room=room, body='legacy')
+        Message.objects.filter(pk=message.pk).update(document='documents/a.pdf')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=io.StringIO())
+        message.refresh_from_db()
+        self.assertTrue(message.document.name.startswith('blobs/'))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'documents')), [])
+        self.assertEqual(Blob.objects.get(name=message.document.name).ref_count, 1)
+
+
+class MediaServingTests(TempMediaMixin, TestCase):
+    """Media responses support validators, byte ranges and front-end sendfile"""
+
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.name = blob_storage.save_stream([self.CONTENT], '.mp3')
+        self.url = f"/images/{self.name}"
+
+    def test_full_and_conditional(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 10-19/{len(self.CONTENT)}")
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+
+        response = self.client.get(self.url, headers={'Range': f"bytes={len(self.CONTENT)}-"})
+        self.assertEqual(response.status_code, 416)
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_and_traversal(self):
+        self.assertEqual(self.client.get('/images/blobs/missing.mp3').status_code, 404)
+        self.assertEqual(self.client.get('/images/../settings.py').status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect_quoted(self):
+        os.makedirs(os.path.join(self.media_root, 'docs'))
+        with open(os.path.join(self.media_root, 'docs', 'my notes?#é.pdf'), 'wb') as f:
+            f.write(b'%PDF')
+        response = self.client.get('/images/docs/my%20notes%3F%23%C3%A9.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/docs/my%20notes%3F%23%C3%A9.pdf')
+        self.assertEqual(response.content, b'')
+
+
+STATIC_CSS = """
+/* Layout */
+.room  >  .header {
+    color: red;
+    margin: 0 auto;
+}
+a :hover { content: "keep  /* this */  text"; }
+""" + '.filler { padding: 1rem; }\n' * 20
+
+STATIC_JS = """
+// Greeting
+const pattern = /a\\/\\/b/g;  // not a comment
+let total = 1
+  + 2
+const text = 'keep  // this';
+""" + 'console.log(total, text, pattern);\n' * 20
+
+
+class StaticPipelineTests(TestCase):
+    """collectstatic minifies, hashes and precompresses; the middleware serves it"""
+
+    def test_minify_css(self):
+        css = minify_css(STATIC_CSS)
+        self.assertTrue(css.startswith('.room>.header{color:red;margin:0 auto}'))
+        self.assertIn('a :hover{content:"keep  /* this */  text"}', css)
+        self.assertNotIn('Layout', css)
+
+    def test_minify_js(self):
+        js = minify_js(STATIC_JS)
+        self.assertNotIn('Greeting', js)
+        self.assertIn('const pattern=/a\\/\\/b/g;\n', js)
+        # Line breaks survive so automatic semicolon insertion is unchanged
+        self.assertIn('let total=1\n+2\n', js)
+        self.assertIn("'keep  // this'", js)
+
+    def collect(self):
+        source = tempfile.mkdtemp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(source, 'styles'))
+        with open(os.path.join(source, 'styles', 'app.css'), 'w') as f:
+            f.write(STATIC_CSS)
+        with open(os.path.join(source, 'app.js'), 'w') as f:
+            f.write(STATIC_JS)
+        static_override = override_settings(
+            STATIC_ROOT=root,
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        static_override.enable()
+        self.addCleanup(static_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(root, 'staticfiles.json')) as f:
+            return root, json.load(f)['paths']
+
+    def test_collectstatic(self):
+        root, manifest = self.collect()
+        hashed = manifest['styles/app.css']
+        self.assertNotEqual(hashed, 'styles/app.css')
+        for name in ('styles/app.css', hashed):
+            with open(os.path.join(root, name)) as f:
+                self.assertEqual(f.read(), minify_css(STATIC_CSS))
+            with open(os.path.join(root, name + '.gz'), 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()).decode(), minify_css(STATIC_CSS))
+
+    def test_served_compressed(self):
+        _, manifest = self.collect()
+        url = '/static/' + manifest['app.js']
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(body, minify_js(STATIC_JS))
+
+        response = self.client.get(url, headers={'If-None-Match': response['ETag'], 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 304)
+
+        # Unhashed names are revalidated, and clients without gzip get the original
+        response = self.client.get('/static/app.js')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+
+class RoomSearchTests(StudyBudTestCase):
+    """Searching one room's messages isn't crowded out by busier rooms"""
+
+    def setUp(self):
+        super().setUp()
+        self.busy = self.make_room('Busy')
+        self.quiet = self.make_room('Quiet')
+        for i in range(5):
+            Message.objects.create(user=self.user, room=self.busy, body=f"exam prep {i}")
+        for i in range(2):
+            Message.objects.create(user=self.user, room=self.quiet, body=f"exam notes {i}")
+        Message.objects.create(user=self.user, room=self.quiet, body='lunch plans')
+
+    def test_scoped_to_room(self):
+        for name in ('api-messages', 'api-async-messages'):
+            with self.subTest(name):
+                response = self.client.get(reverse(name), {'room': self.quiet.pk, 'q': 'exam'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['count'], 2)
+                self.assertEqual(
+                    {message['body'] for message in response.json()['results']}, {'exam notes 0', 'exam notes 1'}
+                )
+                self.assertTrue(response.has_header('X-Search-Limit'))
+
+    def test_room_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.quiet.delete()
+        index_deletes = [query for query in queries if query['sql'].startswith('DELETE FROM base_search_index')]
+        # The room's document and all of its messages' documents
+        self.assertEqual(len(index_deletes), 2)
+        self.assertEqual(search.search_ids(search.MESSAGE, 'exam'), search.search_ids(
+            search.MESSAGE, 'exam', room_id=self.busy.pk
+        ))
+        self.assertEqual(len(search.search_ids(search.MESSAGE, 'exam')), 5)
+
+    def test_invalid_room(self):
+        for name in ('api-messages', 'api-async-messages'):
+            with self.subTest(name):
+                response = self.client.get(reverse(name), {'room': 'abc', 'q': 'exam'})
+                self.assertEqual(response.status_code, 400)
+
+
+class UploadTests(StudyBudTestCase):
+    """Chunks are only appended at the stored offset and with a matching checksum"""
+
+    CONTENT = b'0123456789'
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        settings_override = override_settings(CHUNKED_UPLOAD_DIR=self.upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.message = Message.objects.create(user=self.user, room=self.make_room(), body='notes')
+        self.client.force_login(self.user)
+
+    def start(self, checksum):
+        response = self.client.post(
+            reverse('api-uploads'),
+            {'message': self.message.pk, 'files': [
+                {'file_name': 'notes.txt', 'size': len(self.CONTENT), 'checksum': checksum}
+            ]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()[0]['url']
+
+    def patch(self, url, offset, data, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum is not None:
+            headers['Upload-Checksum'] = checksum
+        return self.client.patch(url, data, content_type='application/offset+octet-stream', headers=headers)
+
+    @staticmethod
+    def chunk_checksum(data):
+        return 'sha256 ' + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+    def test_offset_and_chunk_checksum(self):
+        url = self.start(hashlib.sha256(self.CONTENT).hexdigest())
+        first, rest = self.CONTENT[:4], self.CONTENT[4:]
+
+        response = self.patch(url, 4, first)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+        response = self.patch(url, 0, first, self.chunk_checksum(b'something else'))
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '0')
+
+        response = self.patch(url, 0, first, self.chunk_checksum(first))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Upload-Offset'], '4')
+
+        # A retried chunk has lost its offset and leaves the partial file alone
+        response = self.patch(url, 0, first, self.chunk_checksum(first))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '4')
+        upload = Upload.objects.get()
+        self.assertEqual(upload.offset, 4)
+        with open(f"{self.upload_dir}/{upload.pk}.part", 'rb') as part:
+            self.assertEqual(part.read(), first)
+
+        self.assertEqual(self.patch(url, 4, rest[:3]).status_code, 200)
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '7')
+
+    def test_file_checksum_mismatch(self):
+        url = self.start(hashlib.sha256(b'different file').hexdigest())
+        response = self.patch(url, 0, self.CONTENT)
+        self.assertEqual(response.status_code, 460)
+        self.assertFalse(Upload.objects.exists())
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalGetTests(StudyBudTestCase):
+    """API responses are answered with 304 until their data changes"""
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_room_list(self):
+        self.make_room()
+        self.assertRevalidates(reverse('api-rooms'), lambda: self.make_room('Another'))
+
+    def test_room_detail(self):
+        room = self.make_room()
+        self.assertRevalidates(
+            reverse('api-room', args=[room.pk]),
+            lambda: Message.objects.create(user=self.user, room=room, body='hello')
+        )
+
+    def test_async_room_detail(self):
+        room = self.make_room()
+        self.assertRevalidates(
+            reverse('api-async-room', args=[room.pk]),
+            lambda: room.participants.add(self.user)
+        )
+
+    @override_settings(CACHE_SHARED=False)
+    def test_no_validators_without_shared_cache(self):
+        self.make_room()
+        response = self.client.get(reverse('api-rooms'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_startup_warning_without_shared_cache(self):
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['base.W001'])
+
+    def test_no_warning_with_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class ValuesSerializationTests(TempMediaMixin, StudyBudTestCase):
+    """The values() serializers and the fast renderer produce DRF's exact bytes"""
+
+    def setUp(self):
+        super().setUp()
+        room = self.make_room('Ünïcode   room')
+        guest = User.objects.create(email='', username='guest', name='Gäst')
+        Message.objects.create(user=self.user, room=room, body='plain')
+        message = Message.objects.create(user=guest, room=room, body='with files')
+        Message.objects.filter(pk=message.pk).update(
+            image='images/photo.png',
+            renditions={'small': {'webp': 'renditions/photo-small.webp'}},
+        )
+        Attachment.objects.create(
+            message=message, file=blob_storage.save_stream([b'%PDF'], '.pdf'), file_type='document',
+            file_name='notes.pdf', file_size=1024,
+        )
+        User.objects.filter(pk=guest.pk).update(avatar='avatars/guest.png')
+        self.room = room
+
+    def assertSameOutput(self, url):
+        with override_settings(API_VALUES_SERIALIZERS=False):
+            expected = self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+
+    def test_rooms(self):
+        self.assertSameOutput(reverse('api-rooms'))
+
+    def test_messages(self):
+        self.assertSameOutput(f"{reverse('api-messages')}?room={self.room.pk}")
+
+    def test_users(self):
+        self.assertSameOutput(reverse('api-users'))
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'when': Message.objects.first().created,
+            'price': Decimal('1.50'),
+            'text': 'naïve     </script>',
+            'big': 2 ** 70,
+            'nested': [{'id': 1}, None, True],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+@override_settings(ACTIVITY_SETTLE_SECONDS=0)
+class ActivityFeedTests(StudyBudTestCase):
+    """The feed reads the shared message table in ID order"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room()
+
+    def post(self, body):
+        return Message.objects.create(user=self.user, room=self.room, body=body)
+
+    def test_since(self):
+        first, second, third = self.post('one'), self.post('two'), self.post('three')
+        response = self.client.get(reverse('api-activity'), {'since': first.pk, 'limit': 1})
+        self.assertEqual([e['id'] for e in response.json()['events']], [second.pk])
+        self.assertEqual(response.json()['last_id'], second.pk)
+
+        response = self.client.get(reverse('api-activity'), {'since': second.pk})
+        self.assertEqual([e['message']['body'] for e in response.json()['events']], ['three'])
+
+        response = self.client.get(reverse('api-activity'))
+        self.assertEqual([e['id'] for e in response.json()['events']], [first.pk, second.pk, third.pk])
+        self.assertEqual(response.json()['events'][0]['message']['room'], {'id': self.room.pk, 'name': self.room.name})
+
+    def test_writes_from_other_processes(self):
+        # No signals fire, as when another worker wrote the rows
+        cursor = self.post('seen').pk
+        Message.objects.bulk_create([Message(user=self.user, room=self.room, body='elsewhere')])
+        self.assertEqual([e['message']['body'] for e in activity.events_since(cursor, 10)], ['elsewhere'])
+
+    @override_settings(ACTIVITY_SETTLE_SECONDS=60)
+    def test_unsettled_messages_held_back(self):
+        # A lower ID may still be uncommitted, so neither is served yet
+        message = self.post('just now')
+        self.assertEqual(activity.events_since(0, 10), [])
+        self.assertEqual(activity.latest_id(), 0)
+
+        Message.objects.filter(pk=message.pk).update(created=message.created - timedelta(minutes=1))
+        self.assertEqual([e['id'] for e in activity.events_since(0, 10)], [message.pk])
+
+    async def test_stream(self):
+        old = await sync_to_async(self.post)('before')
+        stream = activity._stream(0)
+        self.assertIn(': connected', await anext(stream))
+        self.assertIn(f"id: {old.pk}\n", await anext(stream))
+
+        message = await sync_to_async(self.post)('live')
+        await sync_to_async(activity.record_message)(message)
+        frame = await asyncio.wait_for(anext(stream), 1)
+        self.assertTrue(frame.startswith(f"id: {message.pk}\nevent: message.created\n"))
+
+        activity.record_deletion(message.pk)
+        frame = await asyncio.wait_for(anext(stream), 1)
+        self.assertTrue(frame.startswith('event: message.deleted\n'))
+        await stream.aclose()
+
+
+class BulkTransferTests(StudyBudTestCase):
+    """export_studybud and import_studybud round-trip every record type"""
+
+    def setUp(self):
+        super().setUp()
+        room = self.make_room('Ünïcode room')
+        room.participants.add(self.user)
+        Message.objects.create(user=self.user, room=room, body='first line\nsecond line')
+        Message.objects.create(user=self.user, room=room, body='reply')
+
+    def export(self, fmt='ndjson'):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_studybud', '--format', fmt, stdout=out, stderr=err)
+        self.assertIn('Exported 6 records', err.getvalue())
+        return out.getvalue()
+
+    def test_ndjson_lines(self):
+        lines = self.export().split('\n')
+        self.assertEqual(lines.pop(), '')
+        self.assertNotIn('', lines)
+        self.assertEqual(
+            [json.loads(line)['type'] for line in lines],
+            ['user', 'topic', 'room', 'participant', 'message', 'message']
+        )
+
+    def round_trip(self, fmt):
+        data = self.export(fmt)
+        for model in (Message, Room, Topic, User):
+            model.objects.all().delete()
+        path = os.path.join(tempfile.mkdtemp(), f"export.{fmt}")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(data)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_studybud', path, stdout=out, stderr=io.StringIO())
+        self.assertIn('Imported 1 users, 1 topics, 1 rooms, 1 participants, 2 messages', out.getvalue())
+        room = Room.objects.get()
+        self.assertEqual(room.name, 'Ünïcode room')
+        self.assertEqual((room.message_count, room.participant_count), (2, 1))
+        self.assertEqual(
+            list(Message.objects.filter(room=room).order_by('id').values_list('body', flat=True)),
+            ['first line\nsecond line', 'reply']
+        )
+        self.assertEqual(find_drift(), [])
+        self.assertEqual([r['name'] for r in trending.top(trending.ROOM)], ['Ünïcode room'])
+        self.assertEqual([t['name'] for t in trending.top(trending.TOPIC)], ['Python'])
+
+    def test_ndjson_round_trip(self):
+        self.round_trip('ndjson')
+
+    def test_csv_round_trip(self):
+        self.round_trip('csv')
+
+
+@override_settings(METRICS_TOKEN='scrape-token', METRICS_ALLOWED_IPS=[])
+class MetricsTests(StudyBudTestCase):
+    """Requests are recorded per route, and /metrics is not public"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def scrape(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_routes_and_methods(self):
+        room = self.make_room()
+        self.client.get(reverse('api-room', args=[room.pk]))
+        self.client.generic('BREW', reverse('api-room', args=[room.pk]))
+        self.client.get('/no/such/page/')
+        body = self.scrape()
+        self.assertIn('studybud_requests_total{route="/api/rooms/<str:pk>/",method="GET",status="200"} 1', body)
+        self.assertIn('route="/api/rooms/<str:pk>/",method="OTHER"', body)
+        self.assertNotIn('BREW', body)
+        self.assertIn('route="<unmatched>",method="GET",status="404"', body)
+        self.assertIn('studybud_db_queries_per_request_count{route="/api/rooms/<str:pk>/",method="GET"} 1', body)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        wrong = self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(wrong.status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class SessionAuthTests(StudyBudTestCase):
+    """Sessions and users come from the cache only when it's shared"""
+
+    def setUp(self):
+        super().setUp()
+        self.user.set_password('secret-pass')
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api-feed'))
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries if 'FROM "django_session"' in q['sql'] or 'FROM "base_user"' in q['sql']]
+
+    @override_settings(CACHE_SHARED=True)
+    def test_cached_when_shared(self):
+        self.auth_queries()
+        self.assertEqual(self.auth_queries(), [])
+
+        # A password change still ends the session
+        self.user.set_password('new-pass')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('api-feed')).status_code, 403)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_database_when_not_shared(self):
+        self.auth_queries()
+        self.assertTrue(any('django_session' in sql for sql in self.auth_queries()))
+
+        # Signing out elsewhere removes the row, which every worker sees
+        Session.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('api-feed')).status_code, 403)
+
+
+@override_settings(CACHE_SHARED=True)
+class MembershipTests(StudyBudTestCase):
+    """Membership is cached per room and user and dropped when links change"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room()
+        self.guest = User.objects.create(email='guest@example.com', username='guest')
+
+    def test_repeat_join_from_cache(self):
+        self.assertTrue(membership.join(self.room, self.guest))
+        self.assertFalse(membership.join(self.room, self.guest))
+        with self.assertNumQueries(0):
+            self.assertFalse(membership.join(self.room, self.guest))
+
+    def test_changes_forget(self):
+        self.room.participants.add(self.guest)
+        self.assertTrue(membership.is_member(self.room.pk, self.guest.pk))
+        self.room.participants.clear()
+        self.assertFalse(membership.is_member(self.room.pk, self.guest.pk))
+
+        self.guest.participated_rooms.add(self.room)
+        self.assertTrue(membership.is_member(self.room.pk, self.guest.pk))
+        self.guest.participated_rooms.clear()
+        self.assertFalse(membership.is_member(self.room.pk, self.guest.pk))
+
+    def test_batches_read_only_the_users_given(self):
+        others = User.objects.bulk_create(
+            User(email=f"member{i}@example.com", username=f"member{i}") for i in range(30)
+        )
+        self.room.participants.add(*others)
+        self.assertEqual(membership.add_members(self.room, [others[0].pk, self.guest.pk, 999999]), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(membership.remove_members(self.room, [others[1].pk, self.user.pk]), 1)
+        self.assertRegex(queries[0]['sql'], r'"user_id" IN \(\d+, \d+\)')
+        self.assertEqual(Room.objects.get(pk=self.room.pk).participant_count, 30)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_database_without_shared_cache(self):
+        membership.join(self.room, self.guest)
+        # A change no signal reports, as if made by another worker
+        membership.Participant.objects.filter(room=self.room).delete()
+        self.assertTrue(membership.join(self.room, self.guest))
+
+
+class AsyncAPITests(StudyBudTestCase):
+    """The /api/async/ views return what their DRF counterparts do"""
+
+    def setUp(self):
+        super().setUp()
+        self.room = self.make_room('Python study')
+        self.make_room('Algebra')
+        self.room.participants.add(self.user)
+        for i in range(3):
+            Message.objects.create(user=self.user, room=self.room, body=f"Message {i}")
+
+    def assertSameAsSync(self, name, *args, query=''):
+        sync = self.client.get(reverse(f"api-{name}", args=args) + query)
+        response = self.client.get(reverse(f"api-async-{name}", args=args) + query)
+        self.assertEqual(response.status_code, sync.status_code)
+        self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), sync.content)
+
+    def test_lists(self):
+        self.assertSameAsSync('rooms')
+        self.assertSameAsSync('rooms', query='?q=python')
+        self.assertSameAsSync('rooms', query='?page=2&page_size=1')
+        self.assertSameAsSync('topics')
+        self.assertSameAsSync('users')
+
+    def test_messages(self):
+        self.assertSameAsSync('messages', query=f"?room={self.room.pk}")
+        first_page = self.client.get(reverse('api-messages'), {'page_size': 2}).json()
+        query = '?' + first_page['next'].split('?')[1]
+        self.assertIn('before=', query)
+        self.assertSameAsSync('messages', query=query)
+        self.assertSameAsSync('messages', query='?before=garbage')
+
+    def test_details(self):
+        self.assertSameAsSync('room', self.room.pk)
+        self.assertSameAsSync('room', 999999)
+        self.assertSameAsSync('user', self.user.pk)
+        self.assertSameAsSync('user', 999999)
+
+    async def test_create_message(self):
+        url = reverse('api-async-create-message', args=[self.room.pk])
+        response = await self.async_client.post(url, {'body': 'hi'}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(url, {'body': 'from async'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['body'], 'from async')
+        room = await Room.objects.aget(pk=self.room.pk)
+        self.assertEqual(room.message_count, 4)
+
+        response = await self.async_client.post(url, {'body': ''}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        missing = reverse('api-async-create-message', args=[999999])
+        response = await self.async_client.post(missing, {'body': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class TopicSuggestionTests(StudyBudTestCase):
+    """Topic suggestions match any word of a name and rank busy topics first"""
+
+    def setUp(self):
+        super().setUp()
+        self.ml = Topic.objects.create(name='Machine Learning')
+        self.rust = Topic.objects.create(name='Learning Rust')
+        for topic, rooms in ((self.ml, 2), (self.rust, 1), (self.topic, 3)):
+            for i in range(rooms):
+                Room.objects.create(host=self.user, topic=topic, name=f"{topic.name} {i}")
+
+    def names(self, prefix, limit=10):
+        return [topic['name'] for topic in autocomplete.suggest(prefix, limit)]
+
+    def test_suggest(self):
+        self.assertEqual(self.names('lea'), ['Machine Learning', 'Learning Rust'])
+        self.assertEqual(self.names('  MACH'), ['Machine Learning'])
+        self.assertEqual(self.names(''), ['Python', 'Machine Learning', 'Learning Rust'])
+        self.assertEqual(self.names('', limit=1), ['Python'])
+        self.assertEqual(self.names('xyz'), [])
+
+        response = self.client.get(reverse('api-topic-suggestions'), {'prefix': 'rust'})
+        self.assertEqual(response.json(), [{'id': self.rust.pk, 'name': 'Learning Rust', 'room_count': 1}])
+
+    def test_changes_applied_in_place(self):
+        self.names('')
+        with self.captureOnCommitCallbacks(execute=True):
+            Topic.objects.create(name='Rust Async')
+            self.rust.name = 'Rustic Learning'
+            self.rust.save()
+            self.ml.delete()
+            for i in range(3):
+                Room.objects.create(host=self.user, topic=self.rust, name=f"More {i}")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('rust'), ['Rustic Learning', 'Rust Async'])
+            self.assertEqual(self.names('lea'), ['Rustic Learning'])
+
+    def test_invalidate_after_bulk_writes(self):
+        self.names('')
+        Topic.objects.bulk_create([Topic(name='Quantum Computing')])
+        self.assertEqual(self.names('quantum'), [])
+        autocomplete.invalidate()
+        self.assertEqual(self.names('quantum'), ['Quantum Computing'])
+
+
+class TimelineTests(StudyBudTestCase):
+    """Timelines follow membership and messages, on write and on read"""
+
+    def setUp(self):
+        super().setUp()
+        self.guest = User.objects.create(email='guest@example.com', username='guest')
+        self.rooms = [self.make_room(f"Room {i}") for i in range(3)]
+        for room in self.rooms:
+            room.participants.add(self.guest)
+
+    def post(self, room, body='hello', user=None):
+        return Message.objects.create(user=user or self.guest, room=room, body=body)
+
+    def rooms_on(self, user):
+        return [entry.room.name for entry in timelines.timeline(user)]
+
+    def test_publish_moves_room_to_top(self):
+        self.post(self.rooms[0])
+        self.assertEqual(self.rooms_on(self.guest), ['Room 0', 'Room 2', 'Room 1'])
+        message = self.post(self.rooms[1])
+        self.assertEqual(self.rooms_on(self.guest), ['Room 1', 'Room 0', 'Room 2'])
+        self.assertEqual(timelines.timeline(self.guest)[0].message, message)
+
+        self.client.force_login(self.guest)
+        response = self.client.get(reverse('api-feed'))
+        self.assertEqual([entry['room']['name'] for entry in response.json()], ['Room 1', 'Room 0', 'Room 2'])
+
+    def test_leave(self):
+        self.rooms[0].participants.remove(self.guest)
+        self.assertEqual(self.rooms_on(self.guest), ['Room 2', 'Room 1'])
+        # Hosts keep their rooms
+        self.rooms[0].participants.add(self.user)
+        self.rooms[0].participants.remove(self.user)
+        self.assertEqual(len(self.rooms_on(self.user)), 3)
+
+    @mock.patch.object(timelines, 'FEED_SIZE', 2)
+    def test_prune_and_restore(self):
+        self.post(self.rooms[2])
+        self.post(self.rooms[1])
+        self.post(self.rooms[0])
+        room = self.make_room('Room 3')
+        room.participants.add(self.guest)
+        self.assertEqual(self.rooms_on(self.guest), ['Room 3', 'Room 0'])
+        # The host's own entries are never pruned
+        self.assertEqual(len(self.rooms_on(self.user)), 4)
+
+        self.post(self.rooms[2], 'back again', user=self.user)
+        self.assertEqual(self.rooms_on(self.guest)[0], 'Room 2')
+
+    @mock.patch.object(timelines, 'FEED_FANOUT_LIMIT', 1)
+    def test_large_rooms_read_on_read(self):
+        self.rooms[0].participants.add(self.user)
+        message = self.post(self.rooms[0], 'busy room')
+        # Nothing was written to the members' entries
+        self.assertFalse(FeedEntry.objects.filter(message=message).exists())
+        entry = timelines.timeline(self.guest)[0]
+        self.assertEqual((entry.room.name, entry.message), ('Room 0', message))
+
+    def test_retract(self):
+        first = self.post(self.rooms[0], 'first')
+        Message.objects.get(pk=self.post(self.rooms[0], 'second').pk).delete()
+        self.assertEqual(timelines.timeline(self.guest)[0].message, first)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.rooms[0].delete()
+        retracts = [q for q in queries if q['sql'].startswith('UPDATE "base_feed_entry"') and 'IS NULL' in q['sql']]
+        self.assertEqual(retracts, [])
+        self.assertEqual(self.rooms_on(self.guest), ['Room 2', 'Room 1'])
+
+    def test_rebuild_matches(self):
+        self.post(self.rooms[1])
+        self.post(self.rooms[0])
+        expected = [(e.room_id, e.message_id, e.activity_at) for e in timelines.timeline(self.guest)]
+        FeedEntry.objects.all().delete()
+        timelines.rebuild()
+        self.assertEqual([(e.room_id, e.message_id, e.activity_at) for e in timelines.timeline(self.guest)], expected)
+
+
+class QueryBudgetTests(StudyBudTestCase):
+    """The main pages issue a fixed number of queries however much data there is"""
+
+    def setUp(self):
+        super().setUp()
+        guests = [User.objects.create(email=f"guest{i}@example.com", username=f"guest{i}") for i in range(5)]
+        for i in range(5):
+            room = self.make_room(f"Room {i}")
+            room.participants.add(*guests)
+            for guest in guests:
+                Message.objects.create(user=guest, room=room, body=f"Hello from {guest.username}")
+        self.room = room
+
+    def assertBudget(self, budget, url):
+        with assert_max_queries(budget, url):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(STORAGES=PLAIN_STORAGES)
+    def test_pages(self):
+        self.assertBudget(12, reverse('home'))
+        self.assertBudget(15, reverse('room', args=[self.room.pk]))
+        self.assertBudget(6, reverse('topics'))
+
+    def test_api(self):
+        self.assertBudget(3, reverse('api-rooms'))
+        self.assertBudget(5, reverse('api-room', args=[self.room.pk]))
+        self.assertBudget(3, reverse('api-messages'))
+        self.assertBudget(2, reverse('api-topics'))
+        self.assertBudget(3, reverse('api-users'))
+
+    def test_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_max_queries(1):
+                list(Room.objects.all())
+                list(Topic.objects.all())
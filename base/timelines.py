@@ -0,0 +1,229 @@
+"""
+Personal home timelines.
+
+Each user's timeline holds one ``FeedEntry`` per room they host or have
+joined, carrying the room's latest message and when it was posted. Reading
+the timeline is one range scan of the ``(user, -activity_at)`` index,
+however many rooms or messages there are.
+
+Entries are written as things happen (fan-out on write), from
+``base.signals``:
+
+* joining a room, or creating one as its host, adds the entry;
+* leaving removes it, and deleting the room cascades;
+* posting a message moves every member's entry for that room to the top
+  with one UPDATE, and restores the entries of members whose entry was
+  pruned.
+
+Only the newest ``FEED_SIZE`` entries of a timeline can ever be read, so
+``prune`` drops the rest whenever entries are added. Entries for rooms the
+user hosts and for large rooms (below) are kept, since nothing would bring
+them back.
+
+A message in a room with more than ``FEED_FANOUT_LIMIT`` members would
+rewrite that many rows, so those rooms are skipped on write. Instead
+``timeline`` reads their latest activity from the room itself (fan-out on
+read), in a second small query over the user's entries for large rooms,
+and merges it in.
+
+Bulk imports rebuild the entries of the rooms they touch;
+``manage.py rebuild_timelines`` rebuilds everything.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import FeedEntry, Message, Room
+
+FEED_FANOUT_LIMIT = getattr(settings, 'FEED_FANOUT_LIMIT', 500)
+
+# Most entries a timeline read returns
+FEED_SIZE = getattr(settings, 'FEED_SIZE', 50)
+
+# Rooms rebuilt (or users pruned) per statement, to stay under database parameter limits
+REBUILD_BATCH_SIZE = 500
+
+Participant = Room.participants.through
+
+
+def _room_activity(room_ids):
+    """
+    Map each room to its latest message ID (or None) and activity time
+
+    A room without messages counts as active when it was created.
+    """
+    latest = Message.objects.filter(room_id=OuterRef('pk')).order_by('-created', '-id')
+    rows = Room.objects.filter(pk__in=room_ids).annotate(
+        latest_id=Subquery(latest.values('id')[:1]),
+        activity_at=Coalesce(Subquery(latest.values('created')[:1]), 'created'),
+    ).values_list('pk', 'latest_id', 'activity_at')
+    return {pk: (latest_id, activity_at) for pk, latest_id, activity_at in rows}
+
+
+def add_host(room):
+    """Put a new room on its host's timeline"""
+    if room.host_id is not None:
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=room.host_id, room=room, activity_at=room.created)], ignore_conflicts=True
+        )
+        prune([room.host_id])
+
+
+def add_members(room_id, user_ids):
+    """Put a room on the timelines of users who joined it"""
+    activity = _room_activity([room_id]).get(room_id)
+    if activity is None or not user_ids:
+        return
+    message_id, activity_at = activity
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, room_id=room_id, message_id=message_id, activity_at=activity_at)
+         for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    prune(user_ids)
+
+
+def add_rooms(user_id, room_ids):
+    """Put rooms a user joined on their timeline"""
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, room_id=room_id, message_id=message_id, activity_at=activity_at)
+         for room_id, (message_id, activity_at) in _room_activity(room_ids).items()],
+        ignore_conflicts=True
+    )
+    prune([user_id])
+
+
+def remove(room_ids=None, user_ids=None):
+    """
+    Take rooms off the timelines of users who left them
+
+    Hosts keep their own rooms. Pass ``room_ids``, ``user_ids`` or both;
+    ``None`` for one of them means every room or user.
+    """
+    entries = FeedEntry.objects.exclude(room__host_id=F('user_id'))
+    if room_ids is not None:
+        entries = entries.filter(room_id__in=room_ids)
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+
+
+def prune(user_ids):
+    """
+    Drop the entries past the newest ``FEED_SIZE`` of each user's timeline
+
+    Entries for rooms the user hosts and for rooms too large to fan out to
+    are kept.
+    """
+    ranked = FeedEntry.objects.filter(
+        user_id__in=user_ids, room__participant_count__lte=FEED_FANOUT_LIMIT
+    ).exclude(room__host_id=F('user_id')).annotate(
+        position=Window(RowNumber(), partition_by=F('user_id'), order_by=[F('activity_at').desc(), F('id').desc()])
+    )
+    stale = list(ranked.filter(position__gt=FEED_SIZE).values_list('pk', flat=True))
+    if stale:
+        FeedEntry.objects.filter(pk__in=stale).delete()
+
+
+def publish(message):
+    """Move a room to the top of its members' timelines after a new message"""
+    FeedEntry.objects.filter(
+        room_id=message.room_id,
+        room__participant_count__lte=FEED_FANOUT_LIMIT,
+        activity_at__lte=message.created,
+    ).update(message=message, activity_at=message.created)
+
+    pruned = list(Participant.objects.filter(
+        room_id=message.room_id, room__participant_count__lte=FEED_FANOUT_LIMIT
+    ).exclude(
+        Exists(FeedEntry.objects.filter(user_id=OuterRef('user_id'), room_id=message.room_id))
+    ).values_list('user_id', flat=True))
+    if pruned:
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, room_id=message.room_id, message=message, activity_at=message.created)
+             for user_id in pruned],
+            ignore_conflicts=True
+        )
+        prune(pruned)
+
+
+def retract(room_id):
+    """Point entries that showed a deleted message at the room's latest one"""
+    FeedEntry.objects.filter(room_id=room_id, message__isnull=True).update(
+        message=Subquery(
+            Message.objects.filter(room_id=room_id).order_by('-created', '-id').values('id')[:1]
+        )
+    )
+
+
+def timeline(user, limit=FEED_SIZE):
+    """
+    A user's rooms, most recent activity first
+
+    Returns:
+        List of FeedEntry with ``room`` (and its host and topic) and
+        ``message`` (and its author) loaded
+    """
+    entries = FeedEntry.objects.filter(user=user).select_related(
+        'room__host', 'room__topic', 'message__user'
+    )
+    timeline = list(entries.order_by('-activity_at', '-id')[:limit])
+
+    # Large rooms aren't fanned out to; read their latest activity here
+    pulled = list(entries.filter(room__participant_count__gt=FEED_FANOUT_LIMIT).annotate(
+        latest_id=Subquery(
+            Message.objects.filter(room_id=OuterRef('room_id')).order_by('-created', '-id').values('id')[:1]
+        )
+    ))
+    if pulled:
+        latest = Message.objects.select_related('user').in_bulk(
+            [entry.latest_id for entry in pulled if entry.latest_id]
+        )
+        pulled_rooms = set()
+        for entry in pulled:
+            pulled_rooms.add(entry.room_id)
+            message = latest.get(entry.latest_id)
+            if message is not None and message.created > entry.activity_at:
+                entry.message, entry.activity_at = message, message.created
+        timeline = [entry for entry in timeline if entry.room_id not in pulled_rooms] + pulled
+        timeline.sort(key=lambda entry: (entry.activity_at, entry.pk), reverse=True)
+        timeline = timeline[:limit]
+    return timeline
+
+
+def rebuild(room_ids=None):
+    """
+    Recreate timeline entries from room membership and messages
+
+    Args:
+        room_ids: Rooms to rebuild (defaults to every room)
+
+    Returns:
+        Number of entries written
+    """
+    if room_ids is None:
+        room_ids = Room.objects.order_by('pk').values_list('pk', flat=True).iterator()
+    room_ids = list(room_ids)
+    written = 0
+    for start in range(0, len(room_ids), REBUILD_BATCH_SIZE):
+        written += _rebuild_rooms(room_ids[start:start + REBUILD_BATCH_SIZE])
+    return written
+
+
+def _rebuild_rooms(room_ids):
+    members = set(Participant.objects.filter(room_id__in=room_ids).values_list('room_id', 'user_id'))
+    members.update(Room.objects.filter(pk__in=room_ids, host__isnull=False).values_list('pk', 'host_id'))
+    activity = _room_activity(room_ids)
+    with transaction.atomic():
+        FeedEntry.objects.filter(room_id__in=room_ids).delete()
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, room_id=room_id, message_id=activity[room_id][0],
+                       activity_at=activity[room_id][1])
+             for room_id, user_id in members if room_id in activity],
+            batch_size=1000
+        )
+    user_ids = sorted({user_id for room_id, user_id in members})
+    for start in range(0, len(user_ids), REBUILD_BATCH_SIZE):
+        prune(user_ids[start:start + REBUILD_BATCH_SIZE])
+    return len(members)
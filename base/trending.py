@@ -0,0 +1,184 @@
+"""
+Trending rooms and topics.
+
+Every message counts towards its room and the room's topic, and every new
+room towards its topic, with a weight that halves every
+``TRENDING_HALF_LIFE_HOURS``. Decaying every score as time passes would
+mean rewriting every row; instead each contribution is scaled up by
+e^(rate * t) at the time ``t`` it happens. All scores then decay by the
+same factor, ranks never change on their own, and one row per room or
+topic (``TrendingScore``) holds a running total. The total is kept as a
+logarithm so the scale factor can't overflow, and ``base.signals`` adds
+to it with a single UPDATE per message.
+
+The top ``TRENDING_SIZE`` rooms and topics are read by index order and
+cached for ``TRENDING_CACHE_TIMEOUT`` seconds, so pages never aggregate
+over messages. Bulk imports bypass the signals and rebuild every score
+when they finish; run ``manage.py rebuild_trending`` after changing the
+half-life or writing rows some other way.
+"""
+import math
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+
+from .models import Message, Room, Topic, TrendingScore
+
+ROOM = TrendingScore.ROOM
+TOPIC = TrendingScore.TOPIC
+
+HALF_LIFE = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24) * 3600
+RATE = math.log(2) / HALF_LIFE
+
+# Activity older than this adds under a millionth of a fresh message
+HISTORY = 20 * HALF_LIFE
+
+MESSAGE_WEIGHT = 1.0
+ROOM_WEIGHT = 5.0
+
+TRENDING_SIZE = getattr(settings, 'TRENDING_SIZE', 50)
+TRENDING_CACHE_TIMEOUT = getattr(settings, 'TRENDING_CACHE_TIMEOUT', 60)
+
+
+def _log_weight(weight, timestamp):
+    return RATE * timestamp + math.log(weight)
+
+
+def _log_add(a, b):
+    """log(e^a + e^b) without overflow"""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def _log_add_expression(x):
+    """``_log_add`` of the stored score and ``x``, evaluated by the database"""
+    x = Value(x)
+    return Greatest(F('score'), x) + Ln(Value(1.0) + Exp(-Abs(F('score') - x)))
+
+
+def current_score(score, now=None):
+    """A stored score decayed to ``now``: recent messages, each worth up to 1"""
+    return math.exp(score - RATE * (now or time.time()))
+
+
+def record(weight, when, room_id=None, topic_id=None):
+    """
+    Add activity to a room and/or topic
+
+    Args:
+        weight: Worth of the activity when fresh
+        when: Datetime the activity happened
+        room_id: Room to credit, if any
+        topic_id: Topic to credit, if any
+    """
+    targets = [(kind, pk) for kind, pk in ((ROOM, room_id), (TOPIC, topic_id)) if pk is not None]
+    if not targets:
+        return
+    x = _log_weight(weight, when.timestamp())
+    condition = Q()
+    for kind, pk in targets:
+        condition |= Q(kind=kind, object_id=pk)
+
+    scores = TrendingScore.objects.filter(condition)
+    if scores.update(score=_log_add_expression(x)) < len(targets):
+        # First activity since the last rebuild; a concurrent first write
+        # for the same object can drop one of the two contributions
+        existing = set(scores.values_list('kind', 'object_id'))
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(kind=kind, object_id=pk, score=x) for kind, pk in targets if (kind, pk) not in existing],
+            ignore_conflicts=True
+        )
+
+
+def forget(kind, object_id):
+    """Drop the score of a deleted room or topic"""
+    TrendingScore.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def _cache_key(kind):
+    return f"trending:{kind}"
+
+
+def _load(kind):
+    """The top ``TRENDING_SIZE`` objects of ``kind`` with their stored scores"""
+    scores = dict(
+        TrendingScore.objects.filter(kind=kind).order_by('-score')
+        .values_list('object_id', 'score')[:TRENDING_SIZE]
+    )
+    if kind == ROOM:
+        rows = Room.objects.filter(pk__in=scores).values('id', 'name', 'topic__name', 'message_count')
+        rows = [
+            {'id': row['id'], 'name': row['name'], 'topic': row['topic__name'],
+             'message_count': row['message_count']}
+            for row in rows
+        ]
+    else:
+        rows = list(Topic.objects.filter(pk__in=scores).values('id', 'name', 'room_count'))
+    for row in rows:
+        row['score'] = scores[row['id']]
+    rows.sort(key=lambda row: row['score'], reverse=True)
+    return rows
+
+
+def top(kind, limit=10):
+    """
+    The most active rooms or topics right now
+
+    Args:
+        kind: ``ROOM`` or ``TOPIC``
+        limit: Number to return, at most ``TRENDING_SIZE``
+
+    Returns:
+        List of dicts with ``id``, ``name``, ``score`` (current decayed
+        activity) and, for rooms, ``topic`` and ``message_count`` or, for
+        topics, ``room_count``
+    """
+    key = _cache_key(kind)
+    rows = cache.get(key)
+    if rows is None:
+        rows = _load(kind)
+        cache.set(key, rows, TRENDING_CACHE_TIMEOUT)
+    now = time.time()
+    return [{**row, 'score': round(current_score(row['score'], now), 3)} for row in rows[:limit]]
+
+
+def rebuild(now=None):
+    """
+    Recompute every score from the last ``HISTORY`` of rooms and messages
+
+    Returns:
+        Number of rooms and topics with a score
+    """
+    now = now or time.time()
+    since = datetime.fromtimestamp(now - HISTORY, tz=timezone.utc)
+    totals = {}
+
+    def add(key, x):
+        totals[key] = _log_add(totals[key], x) if key in totals else x
+
+    sources = (
+        (Message.objects.filter(created__gte=since).values_list('room_id', 'room__topic_id', 'created'),
+         MESSAGE_WEIGHT),
+        (Room.objects.filter(created__gte=since).values_list('id', 'topic_id', 'created'), ROOM_WEIGHT),
+    )
+    for queryset, weight in sources:
+        for room_id, topic_id, created in queryset.iterator(chunk_size=5000):
+            x = _log_weight(weight, created.timestamp())
+            add((ROOM, room_id), x)
+            if topic_id is not None:
+                add((TOPIC, topic_id), x)
+
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(kind=kind, object_id=pk, score=score) for (kind, pk), score in totals.items()],
+            batch_size=1000
+        )
+    cache.delete_many([_cache_key(ROOM), _cache_key(TOPIC)])
+    return len(totals)
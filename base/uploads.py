@@ -0,0 +1,305 @@
+"""
+Chunked, resumable attachment uploads.
+
+A client creates one upload session per file, then sends the bytes in any
+number of ``PATCH`` requests, tus style::
+
+    PATCH /api/uploads/<id>/
+    Upload-Offset: 8388608
+    Upload-Checksum: sha256 <base64 digest of this chunk>
+    Content-Type: application/offset+octet-stream
+
+Each chunk is streamed from the socket into a file of its own under
+``CHUNKED_UPLOAD_DIR``. Once its checksum matches, the request claims the
+chunk's range by moving the session's offset forward in the database and,
+in the same transaction, appends the chunk to the upload's partial file.
+Requests that lose the claim (a client retrying a chunk that timed out, say)
+never touch the partial file, and an interrupted upload resumes from the
+last good offset (``HEAD`` reports it). When the last byte arrives the file
+is moved into the blob store and an ``Attachment`` is created.
+"""
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import Attachment, Upload
+from .storage import blob_storage
+
+READ_SIZE = 64 * 1024
+
+# file_type -> accepted extensions
+ATTACHMENT_EXTENSIONS = {
+    'image': {'.jpg', '.jpeg', '.png', '.gif', '.webp'},
+    'video': {'.mp4', '.webm', '.mov', '.m4v'},
+    'audio': {'.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus', '.wav'},
+    'document': {
+        '.pdf', '.txt', '.md', '.csv', '.doc', '.docx', '.ppt', '.pptx',
+        '.xls', '.xlsx', '.odt', '.odp', '.ods', '.zip',
+    },
+}
+
+MB = 1024 * 1024
+
+DEFAULT_MAX_SIZES = {
+    'image': 20 * MB,
+    'video': 500 * MB,
+    'audio': 200 * MB,
+    'document': 50 * MB,
+}
+
+CHECKSUM_ALGORITHMS = {'md5', 'sha1', 'sha256'}
+
+
+class UploadError(Exception):
+    """
+    A rejected upload request
+
+    Args:
+        message: Error shown to the client
+        status: HTTP status code to respond with
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_MAX_SIZE', 8 * MB)
+
+
+def max_size(file_type):
+    return getattr(settings, 'ATTACHMENT_MAX_SIZES', DEFAULT_MAX_SIZES)[file_type]
+
+
+def upload_dir():
+    return getattr(settings, 'CHUNKED_UPLOAD_DIR', settings.BASE_DIR / 'uploads')
+
+
+def part_path(upload):
+    return os.path.join(upload_dir(), f"{upload.pk}.part")
+
+
+def classify(file_name):
+    """
+    Work out an attachment's type from its file name
+
+    Raises:
+        UploadError: The extension is not allowed
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    for file_type, extensions in ATTACHMENT_EXTENSIONS.items():
+        if extension in extensions:
+            return file_type
+    raise UploadError(f"Files of type '{extension or file_name}' are not allowed", status=415)
+
+
+def start(user, message, file_name, size, checksum=''):
+    """
+    Create an upload session for one file of a message
+
+    Args:
+        user: Uploading user; must be the message's author
+        message: Message the attachment belongs to
+        file_name: Original file name
+        size: Total size in bytes
+        checksum: Optional SHA-256 hex digest of the whole file
+
+    Returns:
+        The new Upload
+    """
+    if message.user_id != user.pk:
+        raise UploadError('You can only attach files to your own messages', status=403)
+    file_name = os.path.basename(str(file_name or '')).strip()
+    if not file_name:
+        raise UploadError('file_name is required')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be an integer')
+    file_type = classify(file_name)
+    if size <= 0:
+        raise UploadError('size must be positive')
+    if size > max_size(file_type):
+        raise UploadError(
+            f"{file_type.capitalize()} attachments are limited to {max_size(file_type) // MB} MB", status=413
+        )
+    checksum = (checksum or '').lower()
+    if checksum and (len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum)):
+        raise UploadError('checksum must be a SHA-256 hex digest')
+
+    return Upload.objects.create(
+        user=user, message=message, file_name=file_name[:255], file_type=file_type,
+        size=size, checksum=checksum
+    )
+
+
+def parse_checksum(header):
+    """
+    Parse an ``Upload-Checksum: <algorithm> <base64 digest>`` header
+
+    Returns:
+        Tuple of (algorithm, digest bytes), or None if the header is empty
+    """
+    if not header:
+        return None
+    try:
+        algorithm, encoded = header.split(' ', 1)
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise UploadError('Malformed Upload-Checksum header')
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f"Unsupported checksum algorithm '{algorithm}'")
+    return algorithm, digest
+
+
+def write_chunk(upload, offset, stream, length, checksum=None):
+    """
+    Append one chunk read from ``stream`` to an upload
+
+    The chunk is copied in small reads, so memory use does not depend on the
+    chunk size. It is received into a temporary file and only appended to the
+    partial file once its checksum matches and the offset has been claimed,
+    so a mismatched or concurrent chunk can simply be sent again.
+
+    Args:
+        upload: Upload being written
+        offset: Client's ``Upload-Offset``; must equal the stored offset
+        stream: File-like request body
+        length: Number of bytes in the chunk
+        checksum: Parsed ``Upload-Checksum`` header, or None
+
+    Returns:
+        The upload's new offset
+    """
+    if upload.attachment_id is not None:
+        raise UploadError('Upload is already complete', status=409)
+    if offset != upload.offset:
+        raise UploadError(f"Upload-Offset must be {upload.offset}", status=409)
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+    if length > max_chunk_size():
+        raise UploadError(f"Chunks are limited to {max_chunk_size() // MB} MB", status=413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk extends past the declared upload size', status=413)
+
+    digest = hashlib.new(checksum[0]) if checksum else None
+    received = 0
+    os.makedirs(upload_dir(), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=upload_dir(), prefix=f"{upload.pk}.", suffix='.chunk') as chunk:
+        while received < length:
+            data = stream.read(min(READ_SIZE, length - received))
+            if not data:
+                break
+            if digest:
+                digest.update(data)
+            chunk.write(data)
+            received += len(data)
+
+        if digest and (received != length or digest.digest() != checksum[1]):
+            # 460 is tus' "Checksum Mismatch"
+            raise UploadError('Chunk checksum mismatch', status=460)
+        chunk.flush()
+        chunk.seek(0)
+
+        # Claim the range with a compare-and-set; the row stays locked until
+        # the chunk is appended, and a failed append rolls the claim back
+        with transaction.atomic():
+            claimed = Upload.objects.filter(pk=upload.pk, offset=offset, attachment__isnull=True).update(
+                offset=offset + received, updated=timezone.now()
+            )
+            if not claimed:
+                current = Upload.objects.filter(pk=upload.pk).values_list('offset', flat=True).first()
+                if current is not None:
+                    upload.offset = current
+                raise UploadError('Upload was modified concurrently', status=409)
+            # The partial file is created by the first chunk; anything past
+            # the offset was left by an append that didn't commit
+            with os.fdopen(os.open(part_path(upload), os.O_RDWR | os.O_CREAT, 0o666), 'r+b') as part:
+                part.truncate(offset)
+                part.seek(offset)
+                shutil.copyfileobj(chunk, part, READ_SIZE)
+
+    upload.offset = offset + received
+    return upload.offset
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while data := f.read(READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def finish(upload):
+    """
+    Turn a fully received upload into an Attachment
+
+    Returns:
+        The created Attachment
+    """
+    path = part_path(upload)
+    if upload.checksum and file_sha256(path) != upload.checksum:
+        cancel(upload)
+        raise UploadError('File checksum mismatch; the upload has been discarded', status=460)
+    if upload.file_type == 'image':
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception:
+            cancel(upload)
+            raise UploadError('File is not a valid image', status=415)
+
+    name = blob_storage.adopt(path, os.path.splitext(upload.file_name)[1])
+    with transaction.atomic():
+        attachment = Attachment.objects.create(
+            message_id=upload.message_id, file=name, file_type=upload.file_type,
+            file_name=upload.file_name, file_size=upload.size
+        )
+        Upload.objects.filter(pk=upload.pk).update(attachment=attachment)
+    upload.attachment = attachment
+    return attachment
+
+
+def cancel(upload):
+    """Delete an upload session and its partial file"""
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_expired(max_age=None):
+    """
+    Delete upload sessions that have not been touched for ``max_age``
+
+    Returns:
+        Number of sessions deleted
+    """
+    if max_age is None:
+        max_age = timedelta(hours=getattr(settings, 'UPLOAD_EXPIRY_HOURS', 24))
+    expired = Upload.objects.filter(updated__lt=timezone.now() - max_age)
+    count = 0
+    for upload in expired.iterator():
+        cancel(upload)
+        count += 1
+
+    # Chunks of requests that died before cleaning up
+    cutoff = time.time() - max_age.total_seconds()
+    if os.path.isdir(upload_dir()):
+        for entry in os.scandir(upload_dir()):
+            if entry.name.endswith('.chunk') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    return count
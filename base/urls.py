@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import activity, views
 
 urlpatterns = [
     # Authentication URLs
@@ -26,6 +26,7 @@ urlpatterns = [
     # Browse pages
     path('topics/', views.topicsPage, name="topics"),
     path('activity/', views.activityPage, name="activity"),
+    path('activity/stream/', activity.activity_stream, name="activity-stream"),
 
     # AJAX endpoints
     path('join-room/<str:pk>/', views.join_room, name="join-room"),
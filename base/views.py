@@ -10,13 +10,25 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect
 from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from .models import Room, Topic, Message, User
 from .forms import RoomForm, UserForm, MyUserCreationForm, MessageForm
+from .db_routers import replica_reads
+from .pagination import decode_cursor, paginate_keyset
+from .query_budget import query_budget
+from . import fragments, membership, realtime, search, timelines, trending
 import logging
 
 logger = logging.getLogger(__name__)
 
+ROOM_MESSAGES_PAGE_SIZE = 50
 
+# Participants listed on the room page; the header shows the full count
+ROOM_PARTICIPANTS_SHOWN = 50
+
+
+@query_budget(12)
 @csrf_protect
 def loginPage(request):
     """Handle user login"""
@@ -31,12 +43,6 @@ def loginPage(request):
             messages.error(request, 'Please provide both email and password.')
             return render(request, 'base/login_register.html', {'page': 'login'})
 
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
-            messages.error(request, 'User with this email does not exist.')
-            return render(request, 'base/login_register.html', {'page': 'login'})
-
         user = authenticate(request, email=email, password=password)
 
         if user is not None:
@@ -50,6 +56,7 @@ def loginPage(request):
     return render(request, 'base/login_register.html', context)
 
 
+@query_budget(6)
 def logoutUser(request):
     """Handle user logout"""
     logout(request)
@@ -57,6 +64,7 @@ def logoutUser(request):
     return redirect('home')
 
 
+@query_budget(15)
 @csrf_protect
 def registerPage(request):
     """Handle user registration"""
@@ -90,67 +98,128 @@ def registerPage(request):
     return render(request, 'base/login_register.html', {'form': form})
 
 
+@query_budget(14)
+@replica_reads
 def home(request):
     """Home page with room listings and search"""
     q = request.GET.get('q', '').strip()
-    
-    # Build query for rooms
-    rooms_query = Room.objects.select_related('host', 'topic').prefetch_related('participants')
-    
-    if q:
-        rooms_query = rooms_query.filter(
-            Q(topic__name__icontains=q) |
-            Q(name__icontains=q) |
-            Q(description__icontains=q)
-        )
-
-    # Pagination
-    paginator = Paginator(rooms_query, 10)  # Show 10 rooms per page
     page_number = request.GET.get('page')
-    rooms = paginator.get_page(page_number)
 
-    # Get topics with room counts
-    topics = Topic.objects.annotate(room_count=Count('rooms')).order_by('-room_count')[:5]
-    
-    room_count = rooms_query.count()
-    
-    # Recent messages
-    recent_messages_query = Message.objects.select_related('user', 'room', 'room__topic')
-    if q:
-        recent_messages_query = recent_messages_query.filter(room__topic__name__icontains=q)
-    
-    room_messages = recent_messages_query[:3]
+    # Each sidebar/feed fragment is cached under versioned keys (see
+    # base.fragments); the queries below only run on a cache miss.
+    search_results = {}
+
+    def matching_room_ids():
+        # Ranked full-text search over room name, description and topic
+        if 'rooms' not in search_results:
+            search_results['rooms'] = search.search_ids(search.ROOM, q)
+        return search_results['rooms']
+
+    def render_feed():
+        rooms_query = Room.objects.select_related('host', 'topic')
+        if q:
+            rooms_query = search.order_by_ids(rooms_query, matching_room_ids())
+
+        # Pagination
+        paginator = Paginator(rooms_query, 10)  # Show 10 rooms per page
+        rooms = paginator.get_page(page_number)
+        return {
+            'html': str(render_to_string('base/feed_component.html', {'rooms': rooms}, request)),
+            'room_count': paginator.count,
+            # Searches stop at the best search.MAX_RESULTS matches
+            'search_limited': bool(q) and paginator.count >= search.MAX_RESULTS,
+        }
+
+    def topics_context():
+        # Get topics with room counts
+        return {'topics': Topic.objects.order_by('-room_count', 'name')[:5]}
+
+    def activity_context():
+        # Recent messages
+        recent_messages_query = Message.objects.select_related('user', 'room', 'room__topic')
+        if q:
+            recent_messages_query = recent_messages_query.filter(room_id__in=matching_room_ids())
+        # Live updates would ignore the search filter
+        return {'room_messages': recent_messages_query[:3], 'live_activity': not q}
+
+    # "My rooms": the user's materialized timeline, one indexed range read
+    personal_feed = request.user.is_authenticated and not q and request.GET.get('feed') == 'mine'
+    if personal_feed:
+        entries = timelines.timeline(request.user)
+        feed = {
+            'html': render_to_string('base/timeline_component.html', {'entries': entries}, request),
+            'room_count': len(entries),
+        }
+    else:
+        feed = fragments.cached(
+            'home-feed', [fragments.ROOMS, fragments.TOPICS], [q, page_number], render_feed
+        )
 
     context = {
-        'rooms': rooms,
-        'topics': topics,
-        'room_count': room_count,
-        'room_messages': room_messages,
+        'feed_html': mark_safe(feed['html']),
+        'room_count': feed['room_count'],
+        'search_limited': feed.get('search_limited', False),
+        'personal_feed': personal_feed,
+        'topics_html': fragments.render_fragment(
+            request, 'home-topics', 'base/topics_component.html',
+            [fragments.TOPICS], [], topics_context
+        ),
+        # Served from memory; scores change with every message (see base.trending)
+        'trending_topics': trending.top(trending.TOPIC, 5),
+        'trending_rooms': trending.top(trending.ROOM, 5),
+        # The activity sidebar shows delete links to the message author
+        'activity_html': fragments.render_fragment(
+            request, 'home-activity', 'base/activity_component.html',
+            [fragments.ROOMS, fragments.MESSAGES], [q, request.user.pk], activity_context
+        ),
         'search_query': q
     }
     return render(request, 'base/home.html', context)
 
 
+@query_budget(18)
 def room(request, pk):
     """Room detail view with messages"""
     room = get_object_or_404(
-        Room.objects.select_related('host', 'topic').prefetch_related('participants'),
+        Room.objects.select_related('host', 'topic'),
         id=pk
     )
     
-    room_messages = room.messages.select_related('user').order_by('created')
-    participants = room.participants.all()
+    # Keyset pagination: ?before=<cursor> loads older, ?after=<cursor> loads newer
+    try:
+        before = decode_cursor(request.GET['before']) if request.GET.get('before') else None
+        after = decode_cursor(request.GET['after']) if request.GET.get('after') else None
+    except ValueError:
+        before = after = None
+
+    room_messages = paginate_keyset(
+        room.messages.select_related('user'),
+        before=before,
+        after=after,
+        limit=ROOM_MESSAGES_PAGE_SIZE
+    )
+    participants = list(room.participants.order_by('id')[:ROOM_PARTICIPANTS_SHOWN])
 
     if request.method == 'POST' and request.user.is_authenticated:
+        # Posted via fetch() from room.js: answer with the message so the page
+        # can show it without a redirect and full re-render
+        is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
         form = MessageForm(request.POST, request.FILES)
         if form.is_valid():
             message = form.save(commit=False)
             message.user = request.user
             message.room = room
             message.save()
-            room.participants.add(request.user)
+            membership.join(room, request.user)
+            if is_ajax:
+                return JsonResponse(
+                    {'status': 'success', 'id': message.id, 'message': realtime.message_payload(message)},
+                    status=201
+                )
             messages.success(request, 'Message sent successfully!')
             return redirect('room', pk=room.id)
+        elif is_ajax:
+            return JsonResponse({'status': 'error', 'errors': form.errors}, status=400)
         else:
             for error in form.non_field_errors():
                 messages.error(request, error)
@@ -161,19 +230,19 @@ def room(request, pk):
         'room': room,
         'room_messages': room_messages,
         'participants': participants,
+        'participants_hidden': max(0, room.participant_count - len(participants)),
         'form': form
     }
     return render(request, 'base/room.html', context)
 
 
+@query_budget(10)
 def userProfile(request, pk):
     """User profile view"""
     user = get_object_or_404(User, id=pk)
-    rooms = user.hosted_rooms.select_related('topic').annotate(
-        participant_count=Count('participants')
-    )
+    rooms = user.hosted_rooms.select_related('topic')
     room_messages = user.messages.select_related('room')[:10]
-    topics = Topic.objects.all()
+    topics = Topic.objects.order_by('-room_count', 'name')[:5]
     
     context = {
         'user': user,
@@ -184,13 +253,13 @@ def userProfile(request, pk):
     return render(request, 'base/profile.html', context)
 
 
+@query_budget(15)
 @login_required(login_url='login')
 @csrf_protect
 def createRoom(request):
     """Create a new room"""
     form = RoomForm()
-    topics = Topic.objects.all().order_by('name')
-    
+
     if request.method == 'POST':
         form = RoomForm(request.POST, request.FILES)
         if form.is_valid():
@@ -210,10 +279,11 @@ def createRoom(request):
                 for error in errors:
                     messages.error(request, f"{field.replace('_', ' ').title()}: {error}")
 
-    context = {'form': form, 'topics': topics}
+    context = {'form': form}
     return render(request, 'base/room_form.html', context)
 
 
+@query_budget(15)
 @login_required(login_url='login')
 @csrf_protect
 def updateRoom(request, pk):
@@ -224,8 +294,7 @@ def updateRoom(request, pk):
         return HttpResponseForbidden('You are not allowed to edit this room.')
 
     form = RoomForm(instance=room)
-    topics = Topic.objects.all().order_by('name')
-    
+
     if request.method == 'POST':
         form = RoomForm(request.POST, request.FILES, instance=room)
         if form.is_valid():
@@ -244,7 +313,7 @@ def updateRoom(request, pk):
                 for error in errors:
                     messages.error(request, f"{field.replace('_', ' ').title()}: {error}")
 
-    context = {'form': form, 'topics': topics, 'room': room}
+    context = {'form': form, 'room': room}
     return render(request, 'base/room_form.html', context)
 
 
@@ -266,16 +335,17 @@ def deleteRoom(request, pk):
     return render(request, 'base/delete.html', {'obj': room})
 
 
+@query_budget(12)
 @login_required(login_url='login')
 @require_http_methods(["GET", "POST"])
 def deleteMessage(request, pk):
     """Delete a message"""
-    message = get_object_or_404(Message, id=pk)
+    message = get_object_or_404(Message.objects.select_related('user', 'room__host'), id=pk)
 
     if request.user != message.user and request.user != message.room.host:
         return HttpResponseForbidden('You are not allowed to delete this message.')
 
-    room_id = message.room.id
+    room_id = message.room_id
     
     if request.method == 'POST':
         message.delete()
@@ -285,6 +355,7 @@ def deleteMessage(request, pk):
     return render(request, 'base/delete.html', {'obj': message})
 
 
+@query_budget(10)
 @login_required(login_url='login')
 @csrf_protect
 def updateUser(request):
@@ -305,45 +376,55 @@ def updateUser(request):
     return render(request, 'base/update-user.html', {'form': form})
 
 
+@query_budget(6)
+@replica_reads
 def topicsPage(request):
     """Topics listing page"""
     q = request.GET.get('q', '').strip()
     
-    topics_query = Topic.objects.annotate(room_count=Count('rooms'))
+    topics_query = Topic.objects.all()
     
     if q:
-        topics_query = topics_query.filter(name__icontains=q)
+        topics_query = topics_query.filter(pk__in=search.search_ids(search.TOPIC, q))
     
     topics = topics_query.order_by('-room_count', 'name')
     
-    context = {'topics': topics, 'search_query': q}
+    context = {
+        'topics': topics,
+        'trending_topics': [] if q else trending.top(trending.TOPIC, 10),
+        'search_query': q
+    }
     return render(request, 'base/topics.html', context)
 
 
+@query_budget(6)
+@replica_reads
 def activityPage(request):
     """Recent activity page"""
     room_messages = Message.objects.select_related('user', 'room', 'room__topic').order_by('-created')[:20]
     
-    context = {'room_messages': room_messages}
+    context = {'room_messages': room_messages, 'live_activity': True}
     return render(request, 'base/activity.html', context)
 
 
 # API-like views for AJAX requests
+@query_budget(8)
 @login_required
 def join_room(request, pk):
     """Join a room via AJAX"""
     if request.method == 'POST':
         room = get_object_or_404(Room, id=pk)
-        room.participants.add(request.user)
+        membership.join(room, request.user)
         return JsonResponse({'status': 'success', 'message': 'Joined room successfully!'})
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'})
 
 
+@query_budget(8)
 @login_required
 def leave_room(request, pk):
     """Leave a room via AJAX"""
     if request.method == 'POST':
         room = get_object_or_404(Room, id=pk)
-        room.participants.remove(request.user)
+        membership.leave(room, request.user)
         return JsonResponse({'status': 'success', 'message': 'Left room successfully!'})
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'})
\ No newline at end of file
@@ -0,0 +1,112 @@
+// Live activity feed
+//
+// New messages arrive over the activity event stream (or, where the server
+// can't stream, by polling the activity API) and are prepended in place.
+
+const liveActivity = document.querySelector("[data-activity-stream-url]");
+
+if (liveActivity) {
+  const limit = Number(liveActivity.dataset.limit) || 20;
+  const currentUserId = liveActivity.dataset.userId;
+  const removeIcon = `<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="32" height="32" viewBox="0 0 32 32">
+    <title>remove</title>
+    <path d="M27.314 6.019l-1.333-1.333-9.98 9.981-9.981-9.981-1.333 1.333 9.981 9.981-9.981 9.98 1.333 1.333 9.981-9.98 9.98 9.98 1.333-1.333-9.98-9.98 9.98-9.981z"></path>
+  </svg>`;
+
+  const boxes = () => liveActivity.querySelectorAll(".activities__box[data-message-id]");
+  let lastId = Math.max(0, ...Array.from(boxes(), (box) => Number(box.dataset.messageId)));
+
+  const renderEvent = (message) => {
+    const box = document.createElement("div");
+    box.className = "activities__box";
+    box.dataset.messageId = message.id;
+
+    const header = document.createElement("div");
+    header.className = "activities__boxHeader roomListRoom__header";
+
+    const author = document.createElement("a");
+    author.className = "roomListRoom__author";
+    author.href = liveActivity.dataset.profileUrl.replace("__id__", message.user.id);
+
+    const avatar = document.createElement("div");
+    avatar.className = "avatar avatar--small";
+    const avatarImage = document.createElement("img");
+    avatarImage.src = message.user.avatar || "";
+    avatar.appendChild(avatarImage);
+
+    const name = document.createElement("p");
+    name.textContent = `@${message.user.username}`;
+    const date = document.createElement("span");
+    date.textContent = "just now";
+    name.appendChild(date);
+    author.append(avatar, name);
+    header.appendChild(author);
+
+    if (String(message.user.id) === currentUserId) {
+      const actions = document.createElement("div");
+      actions.className = "roomListRoom__actions";
+      const deleteLink = document.createElement("a");
+      deleteLink.href = liveActivity.dataset.deleteUrl.replace("__id__", message.id);
+      deleteLink.innerHTML = removeIcon;
+      actions.appendChild(deleteLink);
+      header.appendChild(actions);
+    }
+
+    const content = document.createElement("div");
+    content.className = "activities__boxContent";
+    const reply = document.createElement("p");
+    const roomLink = document.createElement("a");
+    roomLink.href = liveActivity.dataset.roomUrl.replace("__id__", message.room.id);
+    roomLink.textContent = message.room.name;
+    reply.append("replied to post “", roomLink, "”");
+    const body = document.createElement("div");
+    body.className = "activities__boxRoomContent";
+    body.textContent = message.body;
+    content.append(reply, body);
+
+    box.append(header, content);
+    return box;
+  };
+
+  const handleEvent = (event) => {
+    if (event.type === "message.created") {
+      lastId = Math.max(lastId, event.id);
+      if (liveActivity.querySelector(`[data-message-id="${event.id}"]`)) return;
+      const first = liveActivity.querySelector(".activities__box");
+      const box = renderEvent(event.message);
+      if (first) {
+        first.before(box);
+      } else {
+        liveActivity.appendChild(box);
+      }
+      const shown = boxes();
+      for (let i = limit; i < shown.length; i++) shown[i].remove();
+    } else if (event.type === "message.deleted") {
+      const box = liveActivity.querySelector(`[data-message-id="${event.message_id}"]`);
+      if (box) box.remove();
+    }
+  };
+
+  const poll = () => {
+    fetch(`${liveActivity.dataset.activityFeedUrl}?since=${lastId}&limit=${limit}`, {
+      headers: { Accept: "application/json" },
+    })
+      .then((response) => (response.ok ? response.json() : { events: [] }))
+      .then((data) => data.events.forEach(handleEvent))
+      .catch(() => {})
+      .finally(() => setTimeout(poll, 30000));
+  };
+
+  if (window.EventSource) {
+    const source = new EventSource(`${liveActivity.dataset.activityStreamUrl}?since=${lastId}`);
+    ["message.created", "message.deleted"].forEach((type) => {
+      source.addEventListener(type, (message) => handleEvent(JSON.parse(message.data)));
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself unless the server refused the stream
+      if (source.readyState === EventSource.CLOSED) poll();
+    };
+  } else {
+    poll();
+  }
+}
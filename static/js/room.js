@@ -0,0 +1,144 @@
+// Live room updates
+//
+// New messages arrive over the room's WebSocket and are appended in place;
+// the message form posts with fetch() so sending never reloads the page, and
+// shows the sent message from the response, so it appears even where no
+// socket is open (e.g. under runserver).
+
+const liveThreads = document.querySelector(".threads[data-socket-path]");
+
+if (liveThreads) {
+  const roomBox = document.querySelector(".room__box");
+  const currentUserId = liveThreads.dataset.userId;
+
+  const renderMessage = (message) => {
+    const thread = document.createElement("div");
+    thread.className = "thread";
+    thread.dataset.messageId = message.id;
+
+    const top = document.createElement("div");
+    top.className = "thread__top";
+
+    const author = document.createElement("div");
+    author.className = "thread__author";
+
+    const authorLink = document.createElement("a");
+    authorLink.className = "thread__authorInfo";
+    authorLink.href = liveThreads.dataset.profileUrl.replace("__id__", message.user.id);
+
+    const avatar = document.createElement("div");
+    avatar.className = "avatar avatar--small";
+    const avatarImage = document.createElement("img");
+    avatarImage.src = message.user.avatar || "";
+    avatar.appendChild(avatarImage);
+
+    const username = document.createElement("span");
+    username.textContent = `@${message.user.username}`;
+    authorLink.append(avatar, username);
+
+    const date = document.createElement("span");
+    date.className = "thread__date";
+    date.textContent = "just now";
+    author.append(authorLink, date);
+    top.appendChild(author);
+
+    if (String(message.user.id) === currentUserId) {
+      const deleteLink = document.createElement("a");
+      deleteLink.href = liveThreads.dataset.deleteUrl.replace("__id__", message.id);
+      deleteLink.innerHTML = '<div class="thread__delete">&times;</div>';
+      top.appendChild(deleteLink);
+    }
+
+    const details = document.createElement("div");
+    details.className = "thread__details";
+    details.textContent = message.body;
+
+    if (message.image) {
+      const image = document.createElement("img");
+      image.src = message.image;
+      image.loading = "lazy";
+      const attachment = document.createElement("div");
+      attachment.className = "thread__attachment";
+      attachment.appendChild(image);
+      details.appendChild(attachment);
+    }
+    if (message.document) {
+      const link = document.createElement("a");
+      link.href = message.document;
+      link.textContent = "Attached document";
+      const attachment = document.createElement("div");
+      attachment.className = "thread__attachment";
+      attachment.appendChild(link);
+      details.appendChild(attachment);
+    }
+
+    thread.append(top, details);
+    return thread;
+  };
+
+  const handleEvent = (event) => {
+    if (event.type === "message.created") {
+      if (liveThreads.querySelector(`[data-message-id="${event.message.id}"]`)) return;
+      liveThreads.appendChild(renderMessage(event.message));
+      if (roomBox) roomBox.scrollTop = roomBox.scrollHeight;
+    } else if (event.type === "message.deleted") {
+      const thread = liveThreads.querySelector(`[data-message-id="${event.id}"]`);
+      if (thread) thread.remove();
+    }
+  };
+
+  let retryDelay = 1000;
+  const connect = () => {
+    const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+    const socket = new WebSocket(`${scheme}://${window.location.host}${liveThreads.dataset.socketPath}`);
+    socket.onopen = () => {
+      retryDelay = 1000;
+    };
+    socket.onmessage = (message) => handleEvent(JSON.parse(message.data));
+    socket.onclose = (event) => {
+      // 4404: the room no longer exists
+      if (event.code === 4404) return;
+      setTimeout(connect, retryDelay);
+      retryDelay = Math.min(retryDelay * 2, 30000);
+    };
+  };
+  connect();
+
+  const messageForm = document.querySelector(".room__message form");
+  if (messageForm) {
+    const formError = messageForm.querySelector(".room__messageError");
+    const showError = (text) => {
+      formError.textContent = text;
+      formError.hidden = !text;
+    };
+
+    messageForm.addEventListener("submit", async (event) => {
+      event.preventDefault();
+      let response;
+      try {
+        response = await fetch(messageForm.action || window.location.pathname, {
+          method: "POST",
+          body: new FormData(messageForm),
+          headers: { "X-Requested-With": "XMLHttpRequest" },
+        });
+      } catch (error) {
+        showError("Your message couldn't be sent. Check your connection and try again.");
+        return;
+      }
+
+      if (response.status === 201) {
+        const data = await response.json();
+        messageForm.reset();
+        showError("");
+        // Shown right away; the copy arriving over the socket is skipped
+        handleEvent({ type: "message.created", message: data.message });
+      } else if (response.status === 400) {
+        const data = await response.json();
+        showError(Object.values(data.errors || {}).flat().join(" ") || "Your message couldn't be sent.");
+      } else {
+        // Not logged in or another failure: fall back to a normal post
+        messageForm.submit();
+      }
+    });
+  }
+}
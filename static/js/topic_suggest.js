@@ -0,0 +1,52 @@
+// Topic autocomplete
+//
+// The room form's topic datalist is filled from the topic suggestion API as
+// the user types, instead of the page embedding every topic.
+
+const topicInput = document.querySelector("input[data-suggest-url]");
+
+if (topicInput) {
+  const topicList = document.getElementById(topicInput.getAttribute("list"));
+  const cache = new Map();
+  let pending = null;
+  let timer = null;
+
+  const render = (topics) => {
+    topicList.replaceChildren(
+      ...topics.map((topic) => {
+        const option = document.createElement("option");
+        option.value = topic.name;
+        return option;
+      })
+    );
+  };
+
+  const suggest = async () => {
+    const prefix = topicInput.value.trim().toLowerCase();
+    if (cache.has(prefix)) {
+      render(cache.get(prefix));
+      return;
+    }
+    if (pending) pending.abort();
+    pending = new AbortController();
+    const url = `${topicInput.dataset.suggestUrl}?prefix=${encodeURIComponent(prefix)}`;
+    try {
+      const response = await fetch(url, {
+        headers: { Accept: "application/json" },
+        signal: pending.signal,
+      });
+      if (!response.ok) return;
+      const topics = await response.json();
+      cache.set(prefix, topics);
+      render(topics);
+    } catch (error) {
+      if (error.name !== "AbortError") throw error;
+    }
+  };
+
+  topicInput.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(suggest, 150);
+  });
+  topicInput.addEventListener("focus", suggest, { once: true });
+}
@@ -2,6 +2,8 @@
 ASGI config for studybud project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests are handled by Django; WebSocket connections to
+``/ws/rooms/<id>/`` receive live room events (see ``base.realtime``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +15,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'studybud.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Imported after Django is set up so the app registry is ready
+from base.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -36,7 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'base.apps.StaticFilesConfig',
 
     'base.apps.BaseConfig',
 
@@ -48,11 +50,16 @@ AUTH_USER_MODEL = 'base.User'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'base.middleware.StaticFilesMiddleware',
+    'base.metrics.MetricsMiddleware',
+    'base.middleware.QueryBudgetMiddleware',
     "corsheaders.middleware.CorsMiddleware",
+    'base.middleware.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Django's, with signed-in users cached (see base.auth)
+    'base.auth.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,7 +68,8 @@ ROOT_URLCONF = 'studybud.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, with render times recorded (see base.metrics)
+        'BACKEND': 'base.metrics.InstrumentedDjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates'
         ],
@@ -82,14 +90,130 @@ WSGI_APPLICATION = 'studybud.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+#
+# STUDYBUD_DB_ENGINE selects sqlite (default) or postgresql. For PostgreSQL
+# the connection is read from STUDYBUD_DB_NAME/USER/PASSWORD/HOST/PORT and
+# read replicas from STUDYBUD_DB_REPLICA_HOSTS (comma separated). Connections
+# are pooled by psycopg (STUDYBUD_DB_POOL_SIZE); set STUDYBUD_DB_POOL=0 to
+# use persistent connections instead, e.g. behind PgBouncer.
+
+DB_ENGINE = os.environ.get('STUDYBUD_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL = os.environ.get('STUDYBUD_DB_POOL', '1') != '0'
+
+    def _postgres_database(host):
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('STUDYBUD_DB_NAME', 'studybud'),
+            'USER': os.environ.get('STUDYBUD_DB_USER', 'studybud'),
+            'PASSWORD': os.environ.get('STUDYBUD_DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('STUDYBUD_DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        if DB_POOL:
+            database['OPTIONS']['pool'] = {
+                'min_size': 2,
+                'max_size': int(os.environ.get('STUDYBUD_DB_POOL_SIZE', '10')),
+            }
+        else:
+            database['CONN_MAX_AGE'] = int(os.environ.get('STUDYBUD_DB_CONN_MAX_AGE', '60'))
+        return database
+
+    DATABASES = {
+        'default': _postgres_database(os.environ.get('STUDYBUD_DB_HOST', 'localhost')),
+    }
+    replica_hosts = os.environ.get('STUDYBUD_DB_REPLICA_HOSTS', '')
+    for index, host in enumerate(filter(None, replica_hosts.split(',')), start=1):
+        DATABASES[f'replica_{index}'] = {
+            **_postgres_database(host.strip()),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    # WAL lets readers proceed while a message is being written; the busy
+    # timeout and IMMEDIATE transactions make writers queue for the lock
+    # instead of failing with "database is locked".
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('STUDYBUD_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Aliases that read-only views may be routed to (see base.db_routers)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+
+DATABASE_ROUTERS = ['base.db_routers.ReplicaRouter']
+
+# Seconds after a write during which a client's reads stay on the primary
+REPLICA_PIN_SECONDS = 5
+
+# Running under ``manage.py test``, which forces DEBUG off
+TESTING = sys.argv[1:2] == ['test']
+
+# What to do when a view exceeds its @query_budget: 'raise' fails the request
+# (development and tests), 'log' emits a warning (production), 'off' disables
+# counting entirely
+QUERY_BUDGET_MODE = os.environ.get('STUDYBUD_QUERY_BUDGET_MODE', 'raise' if DEBUG or TESTING else 'log')
 
-DATABASES = {
+# Request metrics, exported for Prometheus on /metrics (see base.metrics).
+# Outside DEBUG only staff, scrapers sending STUDYBUD_METRICS_TOKEN as a
+# bearer token and METRICS_ALLOWED_IPS may read them; behind a proxy every
+# client shares the proxy's address, so prefer the token. Requests slower
+# than METRICS_SLOW_REQUEST_SECONDS are logged with their SQL, sampled at
+# METRICS_SLOW_REQUEST_SAMPLE_RATE; None turns the log off.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('STUDYBUD_METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('STUDYBUD_METRICS_ALLOWED_IPS', '').split(',') if ip]
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+METRICS_SLOW_REQUEST_SAMPLE_RATE = 0.1
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# STUDYBUD_CACHE_BACKEND selects locmem (default), file or redis; the redis
+# backend works with any server speaking the Redis protocol.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'studybud'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+
+_cache_backend, _cache_location = CACHE_BACKENDS[os.environ.get('STUDYBUD_CACHE_BACKEND', 'locmem')]
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': _cache_backend,
+        'LOCATION': os.environ.get('STUDYBUD_CACHE_LOCATION', _cache_location),
     }
 }
 
+# Whether every worker process sees the same cache (see base.caches); guessed
+# from the backend when None. Page fragments, API conditional GET and the
+# session, user and member caches are only used when it is, since their
+# invalidation would otherwise stay in one process; the base.W001 check warns
+# when they are off.
+CACHE_SHARED = None
+
+# With a shared cache, sessions are read from it and written through to the
+# database, so they survive cache restarts; otherwise they're read from the
+# database (see base.sessions). Signed-in users are cached for
+# USER_CACHE_TIMEOUT seconds under the same condition (see base.auth)
+SESSION_ENGINE = 'base.sessions'
+USER_CACHE_TIMEOUT = 300
+
+# Seconds a rendered home page fragment may be served before re-rendering,
+# independent of signal-driven invalidation
+FRAGMENT_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -134,7 +258,19 @@ STATICFILES_DIRS = [
 
 MEDIA_ROOT = BASE_DIR / 'static/images'
 
-# STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic minifies CSS/JS, writes content-hashed names and .gz/.br
+# siblings; base.middleware.StaticFilesMiddleware serves them
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'base.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+STATIC_CACHE_SECONDS = 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -153,6 +289,59 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        # orjson-backed when installed; 'rest_framework.renderers.JSONRenderer' is the stock one
+        'base.api.renderers.FastJSONRenderer',
     ],
-}
\ No newline at end of file
+}
+
+# Serialize API list pages from .values() rows instead of ModelSerializers
+API_VALUES_SERIALIZERS = True
+
+# Realtime (WebSocket) pub/sub broker
+# Use 'base.broker.RedisBroker' with a redis:// LOCATION when running more
+# than one ASGI worker process.
+REALTIME_BROKER = {
+    'BACKEND': 'base.broker.InProcessBroker',
+}
+
+# Activity feed (see base.activity): the most events per request, and how
+# old a message must be before it's served, so that transactions committing
+# out of ID order can't be skipped by a cursor
+ACTIVITY_MAX_EVENTS = 200
+ACTIVITY_SETTLE_SECONDS = 1
+
+# Trending rooms and topics (see base.trending). Activity counts half as much
+# after each half-life; run ``manage.py rebuild_trending`` after changing it.
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_CACHE_TIMEOUT = 60
+
+# Personal timelines (see base.timelines). Messages in rooms with more members
+# than FEED_FANOUT_LIMIT aren't written to every member's timeline; readers
+# fetch those rooms' latest activity instead.
+FEED_FANOUT_LIMIT = 500
+FEED_SIZE = 50
+
+# Image renditions are generated by a thread pool after each upload commits.
+# Set IMAGE_RENDITIONS_SYNC to render inline instead (e.g. in tests).
+IMAGE_RENDITION_WORKERS = int(os.environ.get('STUDYBUD_IMAGE_WORKERS', 2))
+IMAGE_RENDITIONS_SYNC = False
+
+# Chunked attachment uploads (see base.uploads). Partial files live outside
+# MEDIA_ROOT until complete; sessions idle for UPLOAD_EXPIRY_HOURS are removed
+# by ``manage.py purge_uploads``.
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'uploads'
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = 24
+ATTACHMENT_MAX_SIZES = {
+    'image': 20 * 1024 * 1024,
+    'video': 500 * 1024 * 1024,
+    'audio': 200 * 1024 * 1024,
+    'document': 50 * 1024 * 1024,
+}
+
+# Media serving (see base.media). Set MEDIA_SENDFILE to 'x-sendfile' or
+# 'x-accel-redirect' to let the front-end server stream files; for nginx,
+# map MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT with an internal location.
+MEDIA_SENDFILE = os.environ.get('STUDYBUD_MEDIA_SENDFILE') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_SECONDS = 3600